@@ -21,3 +21,70 @@ class Config:
 
     .. versionadded:: 0.5
     """
+
+    NUMBER_OF_PROCESSES = None
+    """Number of worker processes of the pool shared by the parallel operations.
+
+    If None, the number of CPUs minus one (at least one) is used.
+
+    .. versionadded:: 2.2
+    """
+
+    HDF5_CHUNK_LAYOUT = "auto"
+    """Layout of the chunks of the HDF5 datasets in which darfix saves the processed stacks of frames.
+
+    One of "auto", "frame", "tile" or "contiguous" (see :class:`darfix.io.hdf5.ChunkLayout`).
+
+    .. versionadded:: 2.2
+    """
+
+    HDF5_COMPRESSION = None
+    """Compression filter of the HDF5 datasets in which darfix saves the processed stacks of frames
+    (for example "gzip" or "lzf"). If None, the datasets are not compressed.
+
+    .. versionadded:: 2.2
+    """
+
+    HDF5_COMPRESSION_OPTS = None
+    """Options of the compression filter defined by `HDF5_COMPRESSION` (for example the gzip level).
+
+    .. versionadded:: 2.2
+    """
+
+    HDF5_MAX_SLAB_NBYTES = 256 * 1024**2
+    """Maximum number of bytes read at once when loading consecutive frames of an HDF5 dataset in memory.
+
+    .. versionadded:: 2.2
+    """
+
+    PREFETCH_DEPTH = 4
+    """Number of frames read ahead in a background thread when iterating over frames that are not loaded in memory.
+
+    If 0, frames are read when they are processed.
+
+    .. versionadded:: 2.2
+    """
+
+    PREFETCH_MAX_NBYTES = 256 * 1024**2
+    """Maximum number of bytes of the frames read ahead when iterating over frames that are not loaded in memory.
+
+    .. versionadded:: 2.2
+    """
+
+    BACKGROUND_MAX_NBYTES = 512 * 1024**2
+    """Memory budget of the computation of the background image (median or mean) of frames that are not loaded in memory.
+
+    Frames are loaded in memory if they fit in the budget. Otherwise, the exact median is computed by
+    reading the frames several times: the smaller the budget, the more reads.
+
+    .. versionadded:: 2.2
+    """
+
+    WATERFALL_MAX_NBYTES = 512 * 1024**2
+    """Memory budget of the block-averaged images of the waterfall NMF
+    (see :func:`darfix.decomposition.multiresolution.multiresolution_nmf`).
+
+    If the images do not fit in the budget, they are saved in a temporary HDF5 file.
+
+    .. versionadded:: 2.2
+    """
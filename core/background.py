@@ -0,0 +1,269 @@
+"""
+Out-of-core computation of the background image (per-pixel median or mean) of a stack
+of frames that does not fit in memory.
+
+The mean is accumulated in a single read of the stack.
+
+The exact median is found by a radix selection on the bits of the pixel values:
+each read of the stack counts, for every pixel, the values sharing the bits already
+selected in a histogram of their next bits. The size of the histograms, hence the number
+of reads, is defined by a memory budget (`darfix.config.BACKGROUND_MAX_NBYTES`).
+Stacks fitting in the budget are loaded in memory and read once.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Callable
+from typing import Iterator
+from typing import Sequence
+
+import numpy
+
+import darfix
+
+from ..io.progress import display_progress
+from .imageOperations import Method
+
+_logger = logging.getLogger(__file__)
+
+_MAX_DIGIT_BITS = 16
+"""Maximum number of bits selected per read of the stack"""
+
+
+def compute_background(
+    frames: Sequence[numpy.ndarray],
+    n_frames: int,
+    method: Method | str = Method.median,
+    max_nbytes: int | None = None,
+    is_running: Callable[[], bool] | None = None,
+) -> numpy.ndarray | None:
+    """
+    Compute the per-pixel median or mean of a stack of frames, reading it
+    frame by frame.
+
+    :param frames: Frames of the stack, iterated several times
+        (for example a :class:`darfix.core.data.Data` on disk).
+    :param n_frames: Number of frames of the stack
+    :param method: Method used to compute the background.
+    :param max_nbytes: Memory budget of the computation.
+        If None, `darfix.config.BACKGROUND_MAX_NBYTES` is used.
+    :param is_running: Function returning False if the computation must be stopped
+    :returns: The background image or None if the computation was stopped.
+    :raises ValueError: If the stack is empty
+    """
+    if n_frames == 0:
+        raise ValueError("Cannot compute the background of an empty stack")
+    method = Method.from_value(method)
+    if max_nbytes is None:
+        max_nbytes = darfix.config.BACKGROUND_MAX_NBYTES
+    if is_running is None:
+
+        def is_running():
+            return True
+
+    if method == Method.mean:
+        return _compute_mean(frames, n_frames, is_running)
+
+    first_frame = numpy.asarray(frames[0])
+    if n_frames * first_frame.nbytes <= max_nbytes:
+        return _compute_median_in_memory(frames, n_frames, first_frame, is_running)
+    return _compute_median_by_selection(
+        frames, n_frames, first_frame, max_nbytes, is_running
+    )
+
+
+def _compute_mean(frames, n_frames: int, is_running) -> numpy.ndarray | None:
+    total = None
+    for frame in display_progress(frames, desc="Computing mean image"):
+        if not is_running():
+            return None
+        if total is None:
+            total = numpy.array(frame, dtype=numpy.float64)
+        else:
+            total += frame
+    return total / n_frames
+
+
+def _compute_median_in_memory(
+    frames, n_frames: int, first_frame: numpy.ndarray, is_running
+) -> numpy.ndarray | None:
+    stack = numpy.empty((n_frames,) + first_frame.shape, dtype=first_frame.dtype)
+    for i, frame in enumerate(display_progress(frames, desc="Loading frames")):
+        if not is_running():
+            return None
+        stack[i] = frame
+    return numpy.median(stack, axis=0, overwrite_input=True)
+
+
+class _OrderedKeys:
+    """
+    Bijection between the values of a dtype and unsigned integers (keys) of the same
+    number of bits, preserving the order of the values.
+    """
+
+    def __init__(self, dtype: numpy.dtype):
+        self.dtype = numpy.dtype(dtype)
+        if self.dtype.kind not in "uif":
+            raise TypeError(f"Cannot compute the median of values of type {dtype}")
+        self.bits = self.dtype.itemsize * 8
+        self._unsigned = numpy.dtype(f"u{self.dtype.itemsize}")
+        self._sign_bit = numpy.uint64(1 << (self.bits - 1))
+        self._mask = numpy.uint64((1 << self.bits) - 1)
+
+    def to_keys(self, values: numpy.ndarray) -> numpy.ndarray:
+        values = numpy.ascontiguousarray(values, dtype=self.dtype)
+        keys = values.view(self._unsigned).astype(numpy.uint64)
+        if self.dtype.kind == "i":
+            keys ^= self._sign_bit
+        elif self.dtype.kind == "f":
+            # Negative values: all the bits are flipped. Positive values: the sign bit is set.
+            negative = (keys & self._sign_bit) != 0
+            keys[negative] ^= self._mask
+            keys[~negative] |= self._sign_bit
+        return keys
+
+    def from_keys(self, keys: numpy.ndarray) -> numpy.ndarray:
+        keys = keys.copy()
+        if self.dtype.kind == "i":
+            keys ^= self._sign_bit
+        elif self.dtype.kind == "f":
+            positive = (keys & self._sign_bit) != 0
+            keys[positive] ^= self._sign_bit
+            keys[~positive] ^= self._mask
+        return keys.astype(self._unsigned).view(self.dtype)
+
+
+def _iter_slabs(
+    frames, slab_size: int, frame_shape, dtype, desc: str
+) -> Iterator[numpy.ndarray]:
+    slab = numpy.empty((slab_size,) + frame_shape, dtype=dtype)
+    n = 0
+    for frame in display_progress(frames, desc=desc):
+        slab[n] = frame
+        n += 1
+        if n == slab_size:
+            yield slab
+            n = 0
+    if n:
+        yield slab[:n]
+
+
+def _compute_median_by_selection(
+    frames, n_frames: int, first_frame: numpy.ndarray, max_nbytes: int, is_running
+) -> numpy.ndarray | None:
+    frame_shape = first_frame.shape
+    n_pixels = first_frame.size
+    ordered_keys = _OrderedKeys(first_frame.dtype)
+
+    # Histograms (uint32) and slab of frames (with their keys) must fit in the budget
+    bytes_per_bin = n_pixels * (4 + first_frame.dtype.itemsize + 8)
+    digit_bits = int(numpy.log2(max(max_nbytes * 3 // 4 // bytes_per_bin, 2)))
+    digit_bits = min(digit_bits, _MAX_DIGIT_BITS, ordered_keys.bits)
+    n_bins = 1 << digit_bits
+    slab_size = min(n_bins, n_frames)
+    # Temporary arrays of the histogram of a block of pixels for a slab of frames
+    block_size = max(max_nbytes // 4 // (n_bins * 8 + slab_size * 8 * 3), 1)
+    n_passes = -(-ordered_keys.bits // digit_bits) + (1 - n_frames % 2)
+    _logger.info(
+        "Median of %d frames computed in %d reads of %d bits",
+        n_frames,
+        n_passes,
+        digit_bits,
+    )
+
+    # Rank (starting at 0) of the lower median. The upper median is the next value.
+    rank = numpy.full(n_pixels, (n_frames - 1) // 2, dtype=numpy.int64)
+    prefix = numpy.zeros(n_pixels, dtype=numpy.uint64)
+    has_nan = numpy.zeros(n_pixels, dtype=bool)
+    remaining_bits = ordered_keys.bits
+    pixels = numpy.arange(n_pixels)
+    i_pass = 0
+
+    while remaining_bits > 0:
+        i_pass += 1
+        width = min(digit_bits, remaining_bits)
+        shift = numpy.uint64(remaining_bits - width)
+        bins = 1 << width
+        digit_mask = numpy.uint64(bins - 1)
+        counts = numpy.zeros((n_pixels, bins), dtype=numpy.uint32)
+        for slab in _iter_slabs(
+            frames,
+            slab_size,
+            frame_shape,
+            first_frame.dtype,
+            desc=f"Computing median image ({i_pass}/{n_passes})",
+        ):
+            if not is_running():
+                return None
+            if i_pass == 1 and ordered_keys.dtype.kind == "f":
+                has_nan |= numpy.isnan(slab).reshape(len(slab), -1).any(axis=0)
+            keys = ordered_keys.to_keys(slab).reshape(len(slab), -1)
+            for start in range(0, n_pixels, block_size):
+                stop = min(start + block_size, n_pixels)
+                block_keys = keys[:, start:stop]
+                digits = (block_keys >> shift) & digit_mask
+                bin_indices = digits.astype(numpy.int64) + pixels[: stop - start] * bins
+                if remaining_bits < ordered_keys.bits:
+                    # Only the values whose higher bits are the ones already selected
+                    same_prefix = (
+                        block_keys >> numpy.uint64(remaining_bits)
+                    ) == prefix[start:stop]
+                    bin_indices = bin_indices[same_prefix]
+                counts[start:stop] += (
+                    numpy.bincount(bin_indices.ravel(), minlength=(stop - start) * bins)
+                    .reshape(stop - start, bins)
+                    .astype(numpy.uint32)
+                )
+
+        # Select the bin of the value of rank `rank` in each histogram
+        for start in range(0, n_pixels, block_size):
+            stop = min(start + block_size, n_pixels)
+            cumulated = numpy.cumsum(counts[start:stop], axis=1, dtype=numpy.int64)
+            digits = numpy.argmax(cumulated > rank[start:stop, None], axis=1).astype(
+                numpy.uint64
+            )
+            block_pixels = pixels[: stop - start]
+            rank[start:stop] -= (
+                cumulated[block_pixels, digits.astype(numpy.int64)]
+                - counts[start:stop][block_pixels, digits.astype(numpy.int64)]
+            )
+            prefix[start:stop] = (prefix[start:stop] << numpy.uint64(width)) | digits
+        remaining_bits -= width
+        del counts
+
+    # Same dtype as numpy.median
+    median_dtype = numpy.dtype(
+        first_frame.dtype if first_frame.dtype.kind == "f" else numpy.float64
+    )
+    lower_keys = prefix
+    if n_frames % 2:
+        median = ordered_keys.from_keys(lower_keys).astype(median_dtype)
+    else:
+        # The upper median is the lower median if it is repeated, else the next value
+        n_lower_or_equal = numpy.zeros(n_pixels, dtype=numpy.int64)
+        next_keys = numpy.full(n_pixels, numpy.iinfo(numpy.uint64).max, numpy.uint64)
+        for slab in _iter_slabs(
+            frames,
+            slab_size,
+            frame_shape,
+            first_frame.dtype,
+            desc=f"Computing median image ({n_passes}/{n_passes})",
+        ):
+            if not is_running():
+                return None
+            for keys in ordered_keys.to_keys(slab).reshape(len(slab), -1):
+                lower_or_equal = keys <= lower_keys
+                n_lower_or_equal += lower_or_equal
+                keys[lower_or_equal] = next_keys[lower_or_equal]
+                numpy.minimum(next_keys, keys, out=next_keys)
+        upper_keys = numpy.where(
+            n_lower_or_equal > n_frames // 2, lower_keys, next_keys
+        )
+        median = (
+            ordered_keys.from_keys(lower_keys).astype(median_dtype)
+            + ordered_keys.from_keys(upper_keys).astype(median_dtype)
+        ) / median_dtype.type(2)
+
+    median[has_nan] = numpy.nan
+    return median.reshape(frame_shape)
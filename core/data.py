@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import hashlib
 import os
 from contextlib import contextmanager
 from enum import IntEnum
 from typing import Generator
+from typing import List
 from typing import Optional
 from typing import Tuple
 from typing import Union
@@ -13,9 +15,15 @@ import numpy
 from silx.io import utils
 from silx.io.url import DataUrl
 
+from darfix.core.metadata_table import MetadataTable
+from darfix.decomposition.matrix import FlattenedStack
 from darfix.io import utils as io_utils
+from darfix.io.frame_urls import FrameUrls
+from darfix.io.hdf5 import ChunkLayout
+from darfix.io.hdf5 import create_stack_dataset
+from darfix.io.hdf5 import get_stack_source
 from darfix.io.hdf5 import hdf5_file_cache
-from darfix.io.progress import display_progress
+from darfix.io.prefetch import prefetch
 
 
 class Operation(IntEnum):
@@ -61,6 +69,24 @@ class StateOfOperations:
         return self._is_running[operation]
 
 
+def _align_to_chunks(tile_size: int, chunk_size: int, frame_size: int) -> int:
+    if chunk_size >= frame_size:
+        return tile_size
+    return max(1, round(tile_size / chunk_size)) * chunk_size
+
+
+def _iter_batches(items, batch_size: int):
+    """Group the (index, image) items in (indices, stack of images) of `batch_size` images"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield [index for index, _ in batch], numpy.stack([img for _, img in batch])
+            batch = []
+    if batch:
+        yield [index for index, _ in batch], numpy.stack([img for _, img in batch])
+
+
 class Data(numpy.ndarray):
     """
 
@@ -68,16 +94,17 @@ class Data(numpy.ndarray):
     metadata. It inherits from numpy.ndarray and Overrides the necessary methods,
     taking into account the `in_memory` attribute.
 
-    :param urls: Array with the urls of the data
-    :type urls: array_like
-    :param metadata: Array with the metadata of the data
-    :type metadata: array_like
+    :param urls: Urls of the data, as :class:`FrameUrls` or array of :class:`DataUrl`
+    :type urls: Union[FrameUrls, array_like]
+    :param metadata: Metadata of the data, as :class:`MetadataTable` or array of metadata readers
+        (converted to a :class:`MetadataTable`)
+    :type metadata: Union[MetadataTable, array_like]
     :param in_memory: If True, the data is loaded into memory, default True
     :type in_memory: bool, optional
     """
 
     def __new__(cls, urls, metadata, in_memory=True, data=None):
-        urls = numpy.asarray(urls)
+        urls = FrameUrls.from_urls(urls)
         img_shape = None
         if in_memory:
             with hdf5_file_cache() as hdf5_cache:
@@ -85,17 +112,16 @@ class Data(numpy.ndarray):
                     data = None
                 if data is None:
                     url_shape = urls.shape
-                    url_idxs = numpy.unravel_index(numpy.arange(urls.size), url_shape)
                     if urls.size == 0:
                         data = numpy.empty(url_shape + (0, 0))
                     else:
                         img = hdf5_cache.get_data(next(urls.flat))
                         data = numpy.empty(url_shape + img.shape, img.dtype)
-                        for url, *url_idx in zip(
-                            display_progress(urls.flat, desc="Loading data in memory"),
-                            *url_idxs,
-                        ):
-                            data[tuple(url_idx)] = hdf5_cache.get_data(url)
+                        hdf5_cache.read_frames(
+                            urls,
+                            data.reshape((urls.size,) + img.shape),
+                            desc="Loading data in memory",
+                        )
             obj = data.view(cls)
         else:
             # Access image one at a time using url
@@ -103,7 +129,11 @@ class Data(numpy.ndarray):
 
         obj.in_memory = in_memory
         obj.urls = urls
-        obj.metadata = numpy.asarray(metadata)
+        if MetadataTable.is_metadata_readers(metadata):
+            metadata = MetadataTable.from_readers(metadata)
+        elif not isinstance(metadata, MetadataTable):
+            metadata = numpy.asarray(metadata)
+        obj.metadata = metadata
         obj._file = None
         obj._img_shape = img_shape
         obj.state_of_operations = StateOfOperations()
@@ -134,21 +164,31 @@ class Data(numpy.ndarray):
                     data.metadata = self.metadata[indices]
             return data
         if isinstance(indices, tuple):
-            if not isinstance(self.urls[indices[0]], numpy.ndarray):
+            if isinstance(self.urls[indices[0]], DataUrl):
                 return utils.get_data(self.urls[indices[0]])[indices[1], indices[2]]
             return Data(self.urls[indices[0]], self.metadata[indices], self.in_memory)
-        if not isinstance(self.urls[indices], numpy.ndarray):
+        if isinstance(self.urls[indices], DataUrl):
             return utils.get_data(self.urls[indices])
         return Data(self.urls[indices], self.metadata[indices], self.in_memory)
 
+    def __iter__(self):
+        if self.in_memory or self.ndim != 3:
+            return super().__iter__()
+        # Frames on disk are read ahead while the previous ones are processed
+        return self._iter_frames()
+
     def _iter_frames(self) -> Generator[numpy.ndarray, None, None]:
         if self.in_memory:
             fshape = (self.nframes,) + self.frame_shape
             yield from super().reshape(fshape)
         else:
-            with hdf5_file_cache() as hdf5_cache:
-                for url in self.urls.flatten():
-                    yield hdf5_cache.get_data(url)
+            yield from prefetch(self._read_frames(self.urls.flat))
+
+    @staticmethod
+    def _read_frames(urls) -> Generator[numpy.ndarray, None, None]:
+        with hdf5_file_cache() as hdf5_cache:
+            for url in urls:
+                yield hdf5_cache.get_data(url)
 
     def __reduce__(self):
         # Get the parent's __reduce__ tuple
@@ -215,6 +255,72 @@ class Data(numpy.ndarray):
             return super().ndim
         return super().ndim + 2
 
+    def tile_slices(self, tile_shape: Tuple[int, int]) -> List[Tuple[slice, slice]]:
+        """
+        Split the frames in tiles of (at most) `tile_shape`.
+
+        If the frames are stored in a single HDF5 dataset with chunks smaller than the frames,
+        the tile shape is rounded to a multiple of the chunk shape so that the tiles are aligned
+        with the chunks and each chunk is read only once.
+
+        :returns: The slices of each tile in the frames.
+        """
+        tile_height, tile_width = (max(1, int(size)) for size in tile_shape)
+        height, width = self.frame_shape
+        if not self.in_memory:
+            source = get_stack_source(self.urls)
+            if source is not None:
+                file_path, data_path, _ = source
+                with h5py.File(file_path, mode="r") as h5f:
+                    chunks = h5f[data_path].chunks
+                if chunks is not None and len(chunks) == 3:
+                    tile_height = _align_to_chunks(tile_height, chunks[1], height)
+                    tile_width = _align_to_chunks(tile_width, chunks[2], width)
+        return [
+            (slice(row, row + tile_height), slice(column, column + tile_width))
+            for row in range(0, height, tile_height)
+            for column in range(0, width, tile_width)
+        ]
+
+    def iter_tiles(
+        self, tile_shape: Tuple[int, int]
+    ) -> Generator[Tuple[Tuple[slice, slice], numpy.ndarray], None, None]:
+        """
+        Iterate over the pixel tiles of the stack of frames (see :meth:`tile_slices`).
+
+        When the data is on disk and all frames are stored in the same HDF5 dataset,
+        each tile is read with a single hyperslab selection instead of reading every frame.
+
+        :returns: The slices of each tile and the stack of tiles of shape (nframes, tile height, tile width).
+        """
+        tiles = self.tile_slices(tile_shape)
+        if self.in_memory:
+            stack = numpy.asarray(self).reshape((self.nframes,) + self.frame_shape)
+            for tile in tiles:
+                yield tile, stack[(slice(None),) + tile]
+            return
+
+        source = get_stack_source(self.urls)
+        if source is None:
+            with hdf5_file_cache() as hdf5_cache:
+                for tile in tiles:
+                    yield tile, numpy.asarray(
+                        [hdf5_cache.get_data(url)[tile] for url in self.urls.flat]
+                    )
+            return
+
+        file_path, data_path, frame_indices = source
+        # h5py requires increasing indices: read each frame once and reorder afterwards
+        unique_indices, inverse = numpy.unique(frame_indices, return_inverse=True)
+        if unique_indices[-1] - unique_indices[0] + 1 == len(unique_indices):
+            frame_selection = slice(unique_indices[0], unique_indices[-1] + 1)
+        else:
+            frame_selection = unique_indices
+        with h5py.File(file_path, mode="r", rdcc_nbytes=0) as h5f:
+            dataset = h5f[data_path]
+            for tile in tiles:
+                yield tile, dataset[(frame_selection,) + tile][inverse]
+
     def apply_funcs(
         self,
         funcs=[],
@@ -223,6 +329,7 @@ class Data(numpy.ndarray):
         text="",
         operation=None,
         new_shape=None,
+        batch_size=None,
     ):
         """
         Method that applies a series of functions into the data. It can save the images
@@ -239,14 +346,17 @@ class Data(numpy.ndarray):
         :param str text: Text to show in the advancement display.
         :param int operation: operation to stop
         :type int: Union[int, `Operation`]
+        :param batch_size: If not None, the functions are applied to stacks of
+            `batch_size` images instead of single images.
+        :type batch_size: Union[None, int]
 
-        :returns: Array with the new urls (if data was saved)
+        :returns: The new urls (if data was saved)
         """
         if indices is None:
             indices = range(len(self))
         if isinstance(indices, int):
             indices = [indices]
-        urls = []
+        saved_indices = []
         io_utils.advancement_display(0, self.nframes, text)
 
         if not hasattr(self, "state_of_operations"):
@@ -266,22 +376,30 @@ class Data(numpy.ndarray):
                 new_shape = self.shape if new_shape is None else tuple(new_shape)
                 if "dataset" in _file:
                     if new_shape != _file["dataset"].shape:
-                        _file.create_dataset(
-                            "update_dataset", new_shape, dtype=self.dtype
+                        create_stack_dataset(
+                            _file, "update_dataset", new_shape, self.dtype
                         )
                     else:
-                        _file.create_dataset(
+                        create_stack_dataset(
+                            _file,
                             "update_dataset",
-                            shape=_file["dataset"].shape,
-                            dtype=_file["dataset"].dtype,
+                            _file["dataset"].shape,
+                            _file["dataset"].dtype,
                         )
                         for i, img in enumerate(_file["dataset"]):
                             _file["update_dataset"][i] = img
                     dataset_name = "update_dataset"
                 else:
-                    _file.create_dataset("dataset", new_shape, dtype=self.dtype)
+                    create_stack_dataset(_file, "dataset", new_shape, self.dtype)
 
-                for i in indices:
+                if self.in_memory:
+                    frames = (self[int(i)] for i in indices)
+                else:
+                    frames = prefetch(self[int(i)] for i in indices)
+                items = zip(indices, frames)
+                if batch_size:
+                    items = _iter_batches(items, batch_size)
+                for i, img in items:
                     if (
                         operation is not None
                         and not self.state_of_operations.is_running(operation)
@@ -297,23 +415,22 @@ class Data(numpy.ndarray):
                     #             else:
                     #                 break
                     #     return
-                    img = self[int(i)]
                     for f, args in funcs:
                         img = f(*([img] + args))
                     if save:
-                        _file[dataset_name][i] = img
-                        urls.append(
-                            DataUrl(
-                                file_path=save,
-                                data_path="/dataset",
-                                data_slice=i,
-                                scheme="silx",
-                            )
-                        )
+                        if batch_size:
+                            for j, frame in zip(i, img):
+                                _file[dataset_name][j] = frame
+                            saved_indices.extend(i)
+                        else:
+                            _file[dataset_name][i] = img
+                            saved_indices.append(i)
                         # filename = save + str(i).zfill(4) + ".npy"
                         # numpy.save(filename, img)
                         # urls.append(DataUrl(file_path=filename, scheme='fabio'))
-                    io_utils.advancement_display(i + 1, self.nframes, text)
+                    io_utils.advancement_display(
+                        (i[-1] if batch_size else i) + 1, self.nframes, text
+                    )
 
                 self.state_of_operations.stop(operation)
 
@@ -324,7 +441,7 @@ class Data(numpy.ndarray):
             finally:
                 if _file is not None:
                     _file.close()
-        return numpy.array(urls)
+        return FrameUrls.from_hdf5_dataset(save, "/dataset", saved_indices)
 
     def save(self, path, indices=None, new_shape=None, in_memory=True) -> None:
         """
@@ -338,8 +455,6 @@ class Data(numpy.ndarray):
         """
         if not hasattr(self, "in_memory") or self.in_memory is None:
             self.in_memory = True
-        urls = []
-
         if indices is None:
             data = self.flatten()
             indices = numpy.arange(len(data))
@@ -362,34 +477,26 @@ class Data(numpy.ndarray):
                 else:
                     new_shape = self.shape
             if "dataset" not in _file:
-                _file.create_dataset("dataset", new_shape, dtype=self.dtype)
+                create_stack_dataset(_file, "dataset", new_shape, self.dtype)
             elif new_shape != _file["dataset"].shape:
                 del _file["dataset"]
-                _file.create_dataset("dataset", new_shape, dtype=self.dtype)
+                create_stack_dataset(_file, "dataset", new_shape, self.dtype)
 
             for i, j in enumerate(indices):
                 _file["dataset"][j] = data[i]
-                urls.append(
-                    DataUrl(
-                        file_path=path,
-                        data_path="/dataset",
-                        data_slice=j,
-                        scheme="silx",
-                    )
-                )
             #     filename = path + str(i).zfill(4) + ".npy"
             #     numpy.save(filename, img)
             #     urls.append(DataUrl(file_path=filename, scheme='fabio'))
         finally:
             if _file is not None:
                 _file.close()
-        urls = numpy.asarray(urls)
+        urls = FrameUrls.from_hdf5_dataset(path, "/dataset", indices)
         if self.urls is not None:
             new_urls = self.urls.flatten()
             new_urls[indices] = urls
             self.urls = new_urls.reshape(self.urls.shape)
         else:
-            self.urls = numpy.asarray(urls)
+            self.urls = urls
 
     @contextmanager
     def open_as_hdf5(self, _dir) -> Generator[h5py.Dataset, None, None]:
@@ -397,6 +504,9 @@ class Data(numpy.ndarray):
         Converts the data into an HDF5 file, setting flattened images in the rows.
         TODO: pass filename per parameter?
 
+        When the data is on disk, the file is only rewritten if the frames changed
+        since it was written (see :meth:`_source_identity`).
+
         :param _dir: Directory in which to save the HDF5 file.
         :type _dir: str
 
@@ -420,16 +530,67 @@ class Data(numpy.ndarray):
             if "dataset" in self._file and self._file["dataset"].shape != hdf5_shape:
                 del self._file["dataset"]
             if "dataset" not in self._file:
-                self._file.create_dataset("dataset", shape=hdf5_shape, dtype=self.dtype)
-
-            for image_idx, frame in enumerate(self._iter_frames()):
-                self._file["dataset"][image_idx] = frame.flatten()
+                # Decomposition methods read the dataset by rows (frames)
+                create_stack_dataset(
+                    self._file,
+                    "dataset",
+                    hdf5_shape,
+                    self.dtype,
+                    auto_layout=ChunkLayout.FRAME,
+                )
 
-            yield self._file["dataset"]
+            dataset = self._file["dataset"]
+            identity = None if self.in_memory else self._source_identity()
+            if identity is None or dataset.attrs.get("source") != identity:
+                if "source" in dataset.attrs:
+                    del dataset.attrs["source"]
+                for image_idx, frame in enumerate(self._iter_frames()):
+                    dataset[image_idx] = frame.flatten()
+                if identity is not None:
+                    dataset.attrs["source"] = identity
+
+            yield dataset
         finally:
             if self._file is not None:
                 self._file.close()
 
+    def _source_identity(self) -> str:
+        """Identity of the frames on disk: their urls and the size and modification time of their files"""
+        digest = hashlib.sha1()
+        for url in self.urls.flat:
+            digest.update(url.path().encode())
+        for file_path in sorted(set(self.urls.file_paths())):
+            stat = os.stat(file_path)
+            digest.update(f"{file_path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    @contextmanager
+    def open_as_matrix(
+        self, _dir
+    ) -> Generator[numpy.ndarray | FlattenedStack | h5py.Dataset, None, None]:
+        """
+        Matrix of the data with the flattened images in the rows, for the decomposition
+        methods (see :mod:`darfix.decomposition.matrix`). The data is not copied when possible:
+
+        - data in memory: reshaped view of the data (it must not be modified)
+        - frames of a single HDF5 dataset: the frames are flattened when read
+        - else: the HDF5 file of :meth:`open_as_hdf5`, reused while the frames are unchanged
+
+        :param _dir: Directory in which to save the HDF5 file, if needed.
+        """
+        if self.in_memory:
+            yield numpy.asarray(self).reshape(self.nframes, -1)
+            return
+        source = get_stack_source(self.urls)
+        if source is not None:
+            file_path, data_path, frame_indices = source
+            with h5py.File(file_path, mode="r") as h5f:
+                if h5f[data_path].ndim == 3:
+                    yield FlattenedStack(h5f[data_path], frame_indices)
+                    return
+        with self.open_as_hdf5(_dir) as dataset:
+            yield dataset
+
     def reshape(self, shape, order="C") -> "Data":
         """
         Returns an array containing the same data with a new shape of urls and metadata.
@@ -479,9 +640,10 @@ class Data(numpy.ndarray):
                 return numpy.array([])
             if not data.shape[0]:
                 return numpy.zeros(data[0].shape)
-            zsum = numpy.array(data[0], dtype=numpy.float64)
-            for i in range(1, len(data)):
-                zsum += data[i]
+            frames = iter(data)
+            zsum = numpy.array(next(frames), dtype=numpy.float64)
+            for frame in frames:
+                zsum += frame
             return zsum
         if axis == 1:
             return numpy.array([i.sum() for i in data])
@@ -504,7 +666,7 @@ class Data(numpy.ndarray):
         :return: Flattened data.
         :rtype: :class:`Data`
         """
-        urls = numpy.take(self.urls, indices, axis, mode=mode)
+        urls = self.urls.take(indices, axis, mode=mode)
         metadata = numpy.take(self.metadata, indices, axis, mode=mode)
         data = None
         if self.in_memory:
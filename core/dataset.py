@@ -3,11 +3,10 @@ from __future__ import annotations
 import copy
 import glob
 import logging
-import multiprocessing
 import os
 import warnings
-from functools import partial
-from multiprocessing import Pool
+from contextlib import ExitStack
+from typing import Callable
 from typing import Dict
 from typing import Literal
 from typing import Optional
@@ -20,33 +19,34 @@ import h5py
 import numpy
 import silx
 from silx.io import fabioh5
-from silx.io.fabioh5 import EdfFabioReader
 from silx.io.url import DataUrl
 from silx.io.utils import h5py_read_dataset
 from sklearn.exceptions import ConvergenceWarning
 
+import darfix
+from darfix.core.background import compute_background
 from darfix.core.data import Data
 from darfix.core.data import Operation
 from darfix.core.data import StateOfOperations
 from darfix.core.dimension import AcquisitionDims
 from darfix.core.dimension import find_dimensions_from_metadata
+from darfix.core.imageOperations import HotPixelRemoval
 from darfix.core.imageOperations import Method
 from darfix.core.imageOperations import background_subtraction
 from darfix.core.imageOperations import background_subtraction_2D
-from darfix.core.imageOperations import chunk_image
-from darfix.core.imageOperations import hot_pixel_removal_2D
 from darfix.core.imageOperations import hot_pixel_removal_3D
-from darfix.core.imageOperations import img2img_mean
 from darfix.core.imageOperations import mask_removal
 from darfix.core.imageOperations import threshold_removal
-from darfix.core.imageRegistration import apply_opencv_shift
+from darfix.core.imageRegistration import iter_shifted_frames
 from darfix.core.imageRegistration import shift_detection
+from darfix.core.mapping import MomentsAccumulator
 from darfix.core.mapping import calculate_RSM_histogram
-from darfix.core.mapping import compute_magnification
-from darfix.core.mapping import compute_moments
-from darfix.core.mapping import compute_rsm
+from darfix.core.mapping import magnification_transformation
+from darfix.core.mapping import rsm_transformation
+from darfix.core.metadata_table import MetadataTable
 from darfix.core.rocking_curves import MAPS_1D
 from darfix.core.rocking_curves import MAPS_2D
+from darfix.core.rocking_curves import compute_starting_values
 from darfix.core.rocking_curves import fit_2d_data
 from darfix.core.rocking_curves import fit_data
 from darfix.core.roi import apply_2D_ROI
@@ -54,10 +54,19 @@ from darfix.core.roi import apply_3D_ROI
 from darfix.core.utils import NoDimensionsError
 from darfix.core.utils import TooManyDimensionsForRockingCurvesError
 from darfix.core.utils import compute_hsv
+from darfix.decomposition.hals import HALSNMF
 from darfix.decomposition.ipca import IPCA
+from darfix.decomposition.multiresolution import multiresolution_nmf
 from darfix.decomposition.nica import NICA
 from darfix.decomposition.nmf import NMF
+from darfix.decomposition.nmf import NMFSolver
+from darfix.decomposition.rsvd import PCASolver
+from darfix.decomposition.rsvd import RandomizedPCA
 from darfix.io import utils as io_utils
+from darfix.io.frame_urls import FrameUrls
+from darfix.io.hdf5 import ChunkLayout
+from darfix.io.hdf5 import create_stack_dataset
+from darfix.io.progress import display_progress
 
 from ..math import SCALE_FACTOR
 from ..math import Vector3D
@@ -66,6 +75,38 @@ from .transformation import Transformation
 _logger = logging.getLogger(__file__)
 
 
+def _compile_frame_functions(funcs, dtype) -> Callable[[numpy.ndarray], numpy.ndarray]:
+    """Chain of the functions (function, arguments) applied to an image, cast to `dtype` after each function"""
+    funcs = list(funcs or [])
+
+    def process(image: numpy.ndarray) -> numpy.ndarray:
+        for func, args in funcs:
+            image = numpy.asarray(func(image, *args)).astype(dtype, copy=False)
+        return image
+
+    return process
+
+
+class _ProcessedFrames:
+    """Frames of a stack, processed when they are read if they are selected"""
+
+    def __init__(self, frames, process, selected: numpy.ndarray):
+        self._frames = frames
+        self._process = process
+        self._selected = selected
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __getitem__(self, index: int) -> numpy.ndarray:
+        frame = self._frames[index]
+        return self._process(frame) if self._selected[index] else frame
+
+    def __iter__(self):
+        for frame, selected in zip(self._frames, self._selected):
+            yield self._process(frame) if selected else frame
+
+
 class ImageDataset:
     """Class to define a dataset from a series of data files.
     The idea of this class is to make life easier for the user when using darfix.
@@ -183,7 +224,7 @@ class ImageDataset:
                 )
 
             self._data = Data(
-                numpy.array(data_urls),
+                data_urls,
                 metadata=metadata_readers,
                 in_memory=self._in_memory,
             )
@@ -204,7 +245,7 @@ class ImageDataset:
                 metadata_readers.append(fabio_reader)
                 fabio_reader.close()
 
-        return data_urls, metadata_readers
+        return data_urls, MetadataTable.from_readers(metadata_readers)
 
     def _init_hdf5_data_urls(
         self, data_url: Union[str, DataUrl], metadata_url: Union[str, DataUrl]
@@ -226,19 +267,13 @@ class ImageDataset:
                 )
             n_frames = hdf5_item.shape[0]
 
-        data_urls = [
-            DataUrl(
-                file_path=data_url.file_path(),
-                data_path=data_url.data_path(),
-                data_slice=i,
-                scheme="silx",
-            )
-            for i in range(n_frames)
-        ]
+        data_urls = FrameUrls.from_hdf5_dataset(
+            data_url.file_path(), data_url.data_path(), numpy.arange(n_frames)
+        )
 
-        # Metadata dict associated to each image
+        # Metadata of all images
         if metadata_url is None:
-            frame_metadata = [{} for _ in range(n_frames)]
+            datasets = {}
         else:
             if not isinstance(metadata_url, DataUrl):
                 metadata_url = DataUrl(metadata_url)
@@ -250,38 +285,8 @@ class ImageDataset:
                     )
 
                 datasets = extract_positioners(h5[metadata_path])
-                frame_metadata = [
-                    self._extract_hdf5_metadata(datasets, frame_index)
-                    for frame_index in range(n_frames)
-                ]
 
-        metadata_readers = [
-            _HDF5MetadataReader(metadata=mdata) for mdata in frame_metadata
-        ]
-
-        return data_urls, metadata_readers
-
-    @staticmethod
-    def _extract_hdf5_metadata(
-        datasets: Dict[str, h5py.Dataset], frame_index: int
-    ) -> dict:
-        metadata = {}
-        for name, dset in datasets.items():
-            if name in ImageDataset._DATASETS_USED_FOR_TRANSFORMATION:
-                if numpy.isscalar(dset):
-                    metadata[name] = dset
-                else:
-                    metadata[name] = dset[frame_index]
-            elif not numpy.isscalar(dset) and len(dset) <= frame_index:
-                # case there is some missing metadata. (a 1D numpy array contains less points that there is frame)
-                _logger.warning(
-                    f"Unable to access index {frame_index} of the dataset {name}"
-                )
-                # handling is done later in `extract_metadata_values` by filling the missing values with `NaN`
-                pass
-            else:
-                metadata[name] = dset[frame_index]
-        return metadata
+        return data_urls, MetadataTable.from_columns(datasets, n_frames)
 
     def stop_operation(self, operation):
         """
@@ -326,14 +331,12 @@ class ImageDataset:
         io_utils.advancement_display(0, self.nframes, "Computing intensity")
         frames_intensity = []
         with self.state_of_operations.run_context(Operation.PARTITION):
-            for i in range(self.nframes):
-                import cv2
+            import cv2
 
+            for i, frame in enumerate(self.get_data()):
                 if not self.state_of_operations.is_running(Operation.PARTITION):
                     return
-                frames_intensity += [
-                    cv2.GaussianBlur(self.get_data(i), kernel, sigma).var()
-                ]
+                frames_intensity += [cv2.GaussianBlur(frame, kernel, sigma).var()]
                 io_utils.advancement_display(i + 1, self.nframes, "Computing intensity")
             self._frames_intensity = frames_intensity
             return frames_intensity
@@ -415,33 +418,11 @@ class ImageDataset:
         :return: Array with the new data.
         """
         if dimension is not None and len(self._data.shape) > 3:
-            # Make sure dimension and value are lists
-            if isinstance(dimension[0], int):
-                dimension[0] = [dimension[0]]
-                dimension[1] = [dimension[1]]
-            data = self.data
-
-            # Init list of bool indices
-            bool_indices = numpy.zeros(self.data.nframes, dtype=bool)
-            if indices is None:
-                indices = numpy.arange(self.nframes)
-            bool_indices[indices] = True
-            bool_indices = bool_indices.reshape(self.data.scan_shape)
-            indx = numpy.arange(self.nframes).reshape(self.data.scan_shape)
-
-            # For every axis, get corresponding elements
-            for i, dim in enumerate(sorted(dimension[0])):
-                # Flip axis to be consistent with the data shape
-                axis = self.dims.ndim - dim - 1
-                data = data.take(indices=dimension[1][i], axis=axis)
-                bool_indices = bool_indices.take(indices=dimension[1][i], axis=axis)
-                indx = indx.take(indices=dimension[1][i], axis=axis)
-
-            data = data[bool_indices]
-            indx = indx[bool_indices]
+            frame_indices = self._get_frame_indices(indices, dimension)
+            data = self.data.flatten()[frame_indices]
             if return_indices:
-                return data.flatten(), indx.flatten()
-            return data.flatten()
+                return data, frame_indices
+            return data
 
         data = self.data.flatten()
         if return_indices:
@@ -452,6 +433,36 @@ class ImageDataset:
             return data
         return data[indices]
 
+    def _get_frame_indices(self, indices=None, dimension=None):
+        """
+        Flat indices of the frames selected by `indices` and `dimension` (see :meth:`get_data`).
+
+        :returns: The indices or None if all the frames are selected.
+        """
+        if dimension is None or len(self._data.shape) <= 3:
+            return indices
+        # Make sure dimension and value are lists
+        if isinstance(dimension[0], int):
+            dimension[0] = [dimension[0]]
+            dimension[1] = [dimension[1]]
+
+        # Init list of bool indices
+        bool_indices = numpy.zeros(self.data.nframes, dtype=bool)
+        if indices is None:
+            indices = numpy.arange(self.nframes)
+        bool_indices[indices] = True
+        bool_indices = bool_indices.reshape(self.data.scan_shape)
+        indx = numpy.arange(self.nframes).reshape(self.data.scan_shape)
+
+        # For every axis, get corresponding elements
+        for i, dim in enumerate(sorted(dimension[0])):
+            # Flip axis to be consistent with the data shape
+            axis = self.dims.ndim - dim - 1
+            bool_indices = bool_indices.take(indices=dimension[1][i], axis=axis)
+            indx = indx.take(indices=dimension[1][i], axis=axis)
+
+        return indx[bool_indices].flatten()
+
     @property
     def nframes(self):
         """
@@ -549,24 +560,32 @@ class ImageDataset:
     def get_metadata_dict(self) -> dict[str, numpy.ndarray]:
         return {key: self.get_metadata_values(key) for key in self.get_metadata_keys()}
 
-    def get_metadata_keys(self) -> numpy.ndarray:
+    def get_metadata_keys(self) -> list[str]:
         """
         Get all metadata keys (like positioner names)
         """
-        return extract_metadata_keys(self.get_data().metadata)
+        return self._get_metadata_table().keys()
 
     def get_metadata_values(self, key, indices=None, dimension=None) -> numpy.ndarray:
-        metadata = self.get_data(indices, dimension).metadata
-        values = extract_metadata_values(
-            metadata,
-            key,
-            missing_value=numpy.nan,
-            take_previous_when_missing=True,
+        """
+        Values of the metadata `key` for the frames selected by `indices` and `dimension`
+        (see :meth:`get_data`). Missing values are filled with the previous value.
+        """
+        metadata = self._get_metadata_table().ravel()
+        frame_indices = self._get_frame_indices(indices, dimension)
+        if frame_indices is not None:
+            metadata = metadata[frame_indices]
+        return metadata.values(
+            key, missing_value=numpy.nan, take_previous_when_missing=True
         )
-        if numpy.isscalar(values):
-            return values
-        else:
-            return numpy.asarray(values)  # makes sure they all have the same dtype
+
+    def _get_metadata_table(self) -> MetadataTable:
+        metadata = self.data.metadata
+        if not isinstance(metadata, MetadataTable):
+            raise TypeError(
+                f"Metadata should be a {MetadataTable} or contain metadata readers. But got {type(metadata)}."
+            )
+        return metadata
 
     def get_dimensions_values(self, indices=None):
         """
@@ -633,13 +652,13 @@ class ImageDataset:
         :param indices: Indices of the images to apply background subtraction.
             If None, the background subtraction is applied to all the data.
         :type indices: Union[None, array_like]
-        :param int step: Distance between images to be used when computing the median.
-            Parameter used only when flag in_memory is False and method is `Method.median`.
-            If `step` is not None, all images with distance of `step`, starting at 0,
-            will be loaded into memory for computing the median, if the data loading throws
-            a MemoryError, the median computation is tried with `step += 1`.
-        :param chunk_shape: Shape of the chunk image to use per iteration.
-            Parameter used only when flag in_memory is False and method is `Method.median`.
+        :param int step: Distance between images to be used when computing the background.
+            Parameter used only when flag in_memory is False.
+            If `step` is not None, only the images with distance of `step`, starting at 0,
+            are used to compute the background.
+        :param chunk_shape: Not used anymore: the background is computed from the whole images
+            within the memory budget `darfix.config.BACKGROUND_MAX_NBYTES`
+            (see :func:`darfix.core.background.compute_background`).
         :type chunk_shape: array_like
         :returns: dataset with data of same size as `self.data` but with the
             modified images. The urls of the modified images are replaced with
@@ -689,87 +708,9 @@ class ImageDataset:
                 new_data.save(os.path.join(temp_dir, "data.hdf5"))
                 urls = new_data.urls
             else:
-                bg = numpy.zeros(self.running_data[0].shape, self.running_data.dtype)
-                if method == Method.mean:
-                    if bg_data.in_memory:
-                        numpy.mean(bg_data, out=bg, axis=0)
-                    else:
-                        io_utils.advancement_display(
-                            0, len(bg_data), "Computing mean image"
-                        )
-                        for i in range(len(bg_data)):
-                            if not self.state_of_operations.is_running(Operation.BS):
-                                return
-                            bg = img2img_mean(bg_data[i], bg, i)
-                            io_utils.advancement_display(
-                                i + 1, len(bg_data), "Computing mean image"
-                            )
-                elif method == Method.median:
-                    if bg_data.in_memory:
-                        numpy.median(bg_data, out=bg, axis=0)
-                    else:
-                        if step is not None:
-                            bg_indices = numpy.arange(0, len(bg_data), step)
-                            try:
-                                numpy.median(
-                                    Data(
-                                        bg_data.urls[bg_indices],
-                                        bg_data.metadata[bg_indices],
-                                    ),
-                                    out=bg,
-                                    axis=0,
-                                )
-                            except MemoryError:
-                                if not self.state_of_operations.is_running(
-                                    Operation.BS
-                                ):
-                                    return
-                                _logger.error(
-                                    "MemoryError, trying with step %s", step + 1
-                                )
-                                return self.apply_background_subtraction(
-                                    background, method, indices, step + 1
-                                )
-                        else:
-                            start = [0, 0]
-                            img = self.running_data[0]
-                            bg = numpy.empty(img.shape, img.dtype)
-                            chunks_1 = int(numpy.ceil(img.shape[0] / chunk_shape[0]))
-                            chunks_2 = int(numpy.ceil(img.shape[1] / chunk_shape[1]))
-                            io_utils.advancement_display(
-                                0,
-                                chunks_1 * chunks_2 * len(bg_data),
-                                "Computing median image",
-                            )
-                            for i in range(chunks_1):
-                                for j in range(chunks_2):
-                                    if not self.state_of_operations.is_running(
-                                        Operation.BS
-                                    ):
-                                        return
-                                    c_images = []
-                                    cpus = multiprocessing.cpu_count()
-                                    with Pool(cpus - 1) as p:
-                                        c_images = p.map(
-                                            partial(chunk_image, start, chunk_shape),
-                                            bg_data,
-                                        )
-                                    io_utils.advancement_display(
-                                        i * chunks_2 + j + 1,
-                                        chunks_1 * chunks_2,
-                                        "Computing median image",
-                                    )
-                                    numpy.median(
-                                        c_images,
-                                        out=bg[
-                                            start[0] : start[0] + chunk_shape[0],
-                                            start[1] : start[1] + chunk_shape[1],
-                                        ],
-                                        axis=0,
-                                    )
-                                    start[1] = chunk_shape[1] * (j + 1)
-                                start[0] = chunk_shape[0] * (i + 1)
-                                start[1] = 0
+                bg = self.compute_background_image(background, method, indices, step)
+                if bg is None:
+                    return
 
                 if not self.state_of_operations.is_running(Operation.BS):
                     return
@@ -784,7 +725,7 @@ class ImageDataset:
 
         # Set urls as shape and dimension of original urls.
         if indices is not None:
-            new_urls = numpy.array(self.get_data().urls, dtype=object)
+            new_urls = self.get_data().urls.copy()
             new_urls[indices] = urls
             new_data = Data(
                 new_urls.reshape(self.data.urls.shape),
@@ -813,6 +754,226 @@ class ImageDataset:
             title=self.title,
         )
 
+    def compute_background_image(
+        self, background=None, method="median", indices=None, step=None, funcs=None
+    ) -> numpy.ndarray | None:
+        """
+        Computes the background image subtracted by :meth:`apply_background_subtraction`.
+
+        :param background: Data to be used as background (see :meth:`apply_background_subtraction`)
+        :param method: Method to use to compute the background.
+        :param indices: Indices of the images the background is subtracted from.
+        :param int step: Distance between images to be used when computing the background.
+            Parameter used only when the background data is not in memory.
+        :param funcs: Functions (see :meth:`apply_frame_functions`) applied to the images
+            of this dataset with indices `indices` before computing the background.
+        :returns: The background image, with the dtype of the data, or None if the
+            background subtraction was stopped.
+        """
+        method = Method.from_value(method)
+        data = self.get_data()
+        bg = numpy.zeros(data.frame_shape, data.dtype)
+
+        processed = numpy.zeros(len(data), dtype=bool)
+        processed[slice(None) if indices is None else indices] = True
+        if background is None:
+            bg_data = self.get_data(indices)
+            bg_processed = processed[slice(None) if indices is None else indices]
+        elif isinstance(background, ImageDataset):
+            bg_data = background.data.flatten()
+            bg_processed = numpy.zeros(len(bg_data), dtype=bool)
+        else:
+            bg_data = self.get_data(background)
+            bg_processed = processed[background]
+        if not funcs:
+            bg_processed = numpy.zeros(len(bg_data), dtype=bool)
+
+        if bg_data.in_memory and not bg_processed.any():
+            if method == Method.mean:
+                numpy.mean(bg_data, out=bg, axis=0)
+            elif method == Method.median:
+                numpy.median(bg_data, out=bg, axis=0)
+            return bg
+
+        if step is not None and not bg_data.in_memory:
+            bg_indices = numpy.arange(0, len(bg_data), step)
+            bg_data = bg_data[bg_indices]
+            bg_processed = bg_processed[bg_indices]
+        if not len(bg_data):
+            return bg
+
+        def is_running():
+            return self.state_of_operations.is_running(Operation.BS)
+
+        with ExitStack() as stack:
+            if bg_processed.any():
+                # The functions are applied once, the median can read the frames several times
+                frames = self._process_background_frames(
+                    _ProcessedFrames(
+                        bg_data,
+                        _compile_frame_functions(funcs, data.dtype),
+                        bg_processed,
+                    ),
+                    frame_shape=data.frame_shape,
+                    dtype=data.dtype,
+                    in_memory=bg_data.in_memory,
+                    stack=stack,
+                    is_running=is_running,
+                )
+                if frames is None:
+                    return None
+            else:
+                frames = bg_data
+            if isinstance(frames, numpy.ndarray) and not isinstance(frames, Data):
+                if method == Method.mean:
+                    background_image = numpy.mean(frames, axis=0)
+                else:
+                    background_image = numpy.median(
+                        frames, axis=0, overwrite_input=True
+                    )
+            else:
+                background_image = compute_background(
+                    frames, len(frames), method, is_running=is_running
+                )
+        if background_image is None:
+            return None
+        if method == Method.mean and not bg_data.in_memory:
+            # Mean images are not rounded to the dtype of the data
+            return background_image
+        bg[...] = background_image
+        return bg
+
+    def _process_background_frames(
+        self,
+        frames: _ProcessedFrames,
+        frame_shape: tuple,
+        dtype: numpy.dtype,
+        in_memory: bool,
+        stack: ExitStack,
+        is_running,
+    ) -> numpy.ndarray | h5py.Dataset | None:
+        """
+        Read and process once the frames used to compute the background.
+
+        The processed frames are kept in memory if the data is in memory or if they fit in
+        `darfix.config.BACKGROUND_MAX_NBYTES`, else they are saved in a temporary HDF5
+        file, removed when `stack` is closed.
+
+        :returns: The processed frames or None if the processing was stopped.
+        """
+        shape = (len(frames),) + tuple(frame_shape)
+        nbytes = numpy.prod(shape) * numpy.dtype(dtype).itemsize
+        if in_memory or nbytes <= darfix.config.BACKGROUND_MAX_NBYTES:
+            processed = numpy.empty(shape, dtype)
+        else:
+            filename = os.path.join(self.dir, "background.hdf5.tmp")
+            h5f = h5py.File(filename, "w")
+            stack.callback(os.remove, filename)
+            stack.callback(h5f.close)
+            processed = create_stack_dataset(
+                h5f, "dataset", shape, dtype, auto_layout=ChunkLayout.FRAME
+            )
+        for i, frame in enumerate(
+            display_progress(frames, desc="Processing background frames")
+        ):
+            if not is_running():
+                return None
+            processed[i] = frame
+        return processed
+
+    def apply_frame_functions(
+        self,
+        funcs,
+        indices=None,
+        operations: Sequence[Operation] = (),
+        _dir=None,
+    ):
+        """
+        Applies a chain of functions to every image and saves the new data into disk,
+        reading and writing the data once.
+
+        :param funcs: List of tuples (function, arguments). Every function is called as
+            `function(image, *arguments)` and its result is cast to the dtype of the data
+            before being passed to the next function.
+        :param indices: Indices of the images to apply the functions to.
+            If None, the functions are applied to all the data.
+        :type indices: Union[None, array_like]
+        :param operations: Operations applied by the functions.
+            The processing is stopped if one of them is stopped (see :meth:`stop_operation`).
+        :return: dataset with data of same size as `self.data` but with the
+            modified images, or None if the processing was stopped.
+        :rtype: Dataset
+        """
+        _dir = self.dir if _dir is None else _dir
+        os.makedirs(_dir, exist_ok=True)
+        filename = os.path.join(_dir, "data.hdf5")
+
+        data = self.get_data()
+        process = _compile_frame_functions(funcs, data.dtype)
+        processed = numpy.zeros(len(data), dtype=bool)
+        processed[slice(None) if indices is None else indices] = True
+        frames = _ProcessedFrames(data, process, processed)
+
+        with ExitStack() as stack:
+            for operation in operations:
+                stack.enter_context(self.state_of_operations.run_context(operation))
+
+            def is_running():
+                return all(
+                    self.state_of_operations.is_running(operation)
+                    for operation in operations
+                )
+
+            if self._in_memory:
+                new_frames = numpy.empty(data.shape, data.dtype)
+                for i, frame in enumerate(
+                    display_progress(frames, desc="Applying operations")
+                ):
+                    if not is_running():
+                        return None
+                    new_frames[i] = frame
+                new_data = Data(
+                    self.data.urls,
+                    self.data.metadata,
+                    self._in_memory,
+                    data=new_frames.reshape(self.data.shape),
+                )
+                new_data.save(filename, indices=indices)
+            else:
+                # Write in a new file as the data can be read from `filename`
+                temp_filename = os.path.join(_dir, "data.hdf5.tmp")
+                with h5py.File(temp_filename, "w") as h5f:
+                    dataset = create_stack_dataset(
+                        h5f, "dataset", data.shape, data.dtype
+                    )
+                    for i, frame in enumerate(
+                        display_progress(frames, desc="Applying operations")
+                    ):
+                        if not is_running():
+                            break
+                        dataset[i] = frame
+                if not is_running():
+                    os.remove(temp_filename)
+                    return None
+                os.replace(temp_filename, filename)
+                urls = FrameUrls.from_hdf5_dataset(
+                    filename, "/dataset", range(len(data))
+                )
+                new_data = Data(
+                    urls.reshape(self.data.urls.shape),
+                    self.data.metadata,
+                    self._in_memory,
+                )
+
+        return ImageDataset(
+            _dir=_dir,
+            data=new_data,
+            dims=self.__dims,
+            transformation=self.transformation,
+            in_memory=self._in_memory,
+            title=self.title,
+        )
+
     def apply_hot_pixel_removal(self, kernel=3, indices=None, _dir=None):
         """
         Applies hot pixel removal to Data, and saves the new data
@@ -844,17 +1005,22 @@ class ImageDataset:
             new_data.save(os.path.join(temp_dir, "data.hdf5"))
             urls = new_data.urls
         else:
-            urls = self.running_data.apply_funcs(
-                [(hot_pixel_removal_2D, [kernel])],
-                save=os.path.join(temp_dir, "data.hdf5"),
-                text="Applying hot pixel removal",
-                operation=Operation.HP,
-            )
+            with HotPixelRemoval(
+                self.running_data.frame_shape, self.running_data.dtype, kernel
+            ) as remover:
+                # Frames are corrected in place, by blocks
+                urls = self.running_data.apply_funcs(
+                    [(lambda frames: remover(frames, out=frames), [])],
+                    save=os.path.join(temp_dir, "data.hdf5"),
+                    text="Applying hot pixel removal",
+                    operation=Operation.HP,
+                    batch_size=remover.block_size,
+                )
             if urls is None:
                 return
 
         if indices is not None:
-            new_urls = numpy.array(self.get_data().urls, dtype=object)
+            new_urls = self.get_data().urls.copy()
             new_urls[indices] = urls
             new_data = Data(
                 new_urls.reshape(self.data.urls.shape),
@@ -922,7 +1088,7 @@ class ImageDataset:
             if urls is None:
                 return
         if indices is not None:
-            new_urls = numpy.array(self.get_data().urls, dtype=object)
+            new_urls = self.get_data().urls.copy()
             new_urls[indices] = urls
             new_data = Data(
                 new_urls.reshape(self.data.urls.shape),
@@ -991,7 +1157,7 @@ class ImageDataset:
             if urls is None:
                 return
         if indices is not None:
-            new_urls = numpy.array(self.get_data().urls, dtype=object)
+            new_urls = self.get_data().urls.copy()
             new_urls[indices] = urls
             new_data = Data(
                 new_urls.reshape(self.data.urls.shape),
@@ -1069,12 +1235,7 @@ class ImageDataset:
 
         transformation = self.transformation
         if transformation is not None:
-            transformation = Transformation(
-                transformation.kind,
-                apply_2D_ROI(transformation.x, origin, size, center),
-                apply_2D_ROI(transformation.y, origin, size, center),
-                transformation.rotate,
-            )
+            transformation = transformation.crop(origin, size, center)
 
         if indices is None:
             shape = list(self.data.shape)[:-2]
@@ -1090,7 +1251,9 @@ class ImageDataset:
             title=self.title,
         )
 
-    def find_shift(self, dimension=None, steps=50, indices=None):
+    def find_shift(
+        self, dimension=None, steps=50, indices=None, search="grid", pyramid_levels=0
+    ):
         """
         Find shift of the data or part of it.
 
@@ -1102,17 +1265,36 @@ class ImageDataset:
         :param indices: Boolean index list with True in the images to apply the shift to.
             If None, the hot pixel removal is applied to all the data.
         :type indices: Union[None, array_like]
+        :param Union['grid', 'fourier'] search: Search of the best shift.
+            See `core.imageRegistration.improve_linear_shift`
+        :param int pyramid_levels: If not 0, number of levels of the multi-resolution
+            shift detection. See `core.imageRegistration.find_shift_pyramid`
         :returns: Array with shift per frame.
         """
         data = self.get_data(indices=indices, dimension=dimension)
-        return shift_detection(data, steps)
+        return shift_detection(
+            data, steps, search=search, pyramid_levels=pyramid_levels
+        )
 
     def find_shift_along_dimension(
-        self, dimension: Tuple[int, ...], steps=50, indices=None
+        self,
+        dimension: Tuple[int, ...],
+        steps=50,
+        indices=None,
+        search="grid",
+        pyramid_levels=0,
     ):
         shift = []
         for value in range(self.dims.get(dimension[0]).size):
-            shift.append(self.find_shift([dimension[0], value], steps, indices))
+            shift.append(
+                self.find_shift(
+                    [dimension[0], value],
+                    steps,
+                    indices,
+                    search=search,
+                    pyramid_levels=pyramid_levels,
+                )
+            )
         return numpy.array(shift)
 
     def apply_shift_along_dimension(
@@ -1189,99 +1371,33 @@ class ImageDataset:
                     _file = h5py.File(filename, "w")
                 dataset_name = "dataset"
                 if "dataset" not in _file:
-                    _file.create_dataset(
-                        "dataset", self.get_data().shape, dtype=self.data.dtype
+                    create_stack_dataset(
+                        _file, "dataset", self.get_data().shape, self.data.dtype
                     )
                 elif self.get_data().shape != _file["dataset"].shape:
                     del _file["dataset"]
-                    _file.create_dataset(
-                        "dataset", self.get_data().shape, dtype=self.data.dtype
+                    create_stack_dataset(
+                        _file, "dataset", self.get_data().shape, self.data.dtype
                     )
                 else:
                     dataset_name = "update_dataset"
                     _file.copy("dataset", "update_dataset")
 
-                io_utils.advancement_display(0, len(data), "Applying shift")
-                if dimension is not None:
-                    # Convert dimension and value into list
-                    if type(dimension[0]) is int:
-                        dimension[0] = [dimension[0]]
-                        dimension[1] = [dimension[1]]
-                    urls = []
-                    for i, idx in enumerate(rindices):
-                        if not self.state_of_operations.is_running(Operation.SHIFT):
-                            if "update_dataset" in _file:
-                                del _file["update_dataset"]
-                            return
-                        img = apply_opencv_shift(data[i], shift[:, i], shift_approach)
-                        if shift[:, i].all() > 1:
-                            shift_approach = "linear"
-                        _file[dataset_name][idx] = img
-                        urls.append(
-                            DataUrl(
-                                file_path=_dir + "/data.hdf5",
-                                data_path="/dataset",
-                                data_slice=idx,
-                                scheme="silx",
-                            )
-                        )
-                        io_utils.advancement_display(
-                            i + 1, len(rindices), "Applying shift"
-                        )
-
-                    # Replace specific urls that correspond to the modified data
-                    new_urls = numpy.array(self.data.urls, dtype=object)
-                    copy_urls = new_urls
-                    if indices is not None:
-                        # Create array of booleans to know which indices we have
-                        bool_indices = numpy.zeros(
-                            self.get_data().shape[:-2], dtype=bool
-                        )
-                        bool_indices[indices] = True
-                        bool_indices = bool_indices.reshape(self.data.scan_shape)
-                        for i, dim in enumerate(sorted(dimension[0])):
-                            # Flip axis to be consistent with the data shape
-                            axis = self.dims.ndim - dim - 1
-                            copy_urls = numpy.swapaxes(copy_urls, 0, axis)[
-                                dimension[1][i], :
-                            ]
-                            bool_indices = numpy.swapaxes(bool_indices, 0, axis)[
-                                dimension[1][i], :
-                            ]
-                        copy_urls[bool_indices] = urls
-                    else:
-                        for i, dim in enumerate(sorted(dimension[0])):
-                            # Flip axis to be consistent with the data shape
-                            axis = self.dims.ndim - dim - 1
-                            copy_urls = numpy.swapaxes(copy_urls, 0, axis)[
-                                dimension[1][i], :
-                            ]
-                        copy_urls[:] = urls
-                else:
-                    urls = []
-                    for i, idx in enumerate(rindices):
-                        if not self.state_of_operations.is_running(Operation.SHIFT):
-                            if "update_dataset" in _file:
-                                del _file["update_dataset"]
-                            return
-                        if shift[:, i].all() > 1:
-                            shift_approach = "linear"
-                        img = apply_opencv_shift(data[i], shift[:, i], shift_approach)
-                        _file[dataset_name][idx] = img
-                        urls.append(
-                            DataUrl(
-                                file_path=_dir + "/data.hdf5",
-                                data_path="/dataset",
-                                data_slice=idx,
-                                scheme="silx",
-                            )
-                        )
-                        io_utils.advancement_display(i + 1, len(data), "Applying shift")
-                    if indices is not None:
-                        new_urls = numpy.array(self.data.urls, dtype=object).flatten()
-                        numpy.put(new_urls, indices, urls)
-                    else:
-                        new_urls = numpy.array(urls)
+                io_utils.advancement_display(0, len(rindices), "Applying shift")
+                shifted_frames = iter_shifted_frames(data, shift, shift_approach)
+                for i, (idx, img) in enumerate(zip(rindices, shifted_frames)):
+                    if not self.state_of_operations.is_running(Operation.SHIFT):
+                        if "update_dataset" in _file:
+                            del _file["update_dataset"]
+                        return
+                    _file[dataset_name][idx] = img
+                    io_utils.advancement_display(i + 1, len(rindices), "Applying shift")
+
+                # Replace the urls of the modified frames
+                new_urls = self.data.urls.flatten()
+                new_urls[rindices] = FrameUrls.from_hdf5_dataset(
+                    os.path.join(_dir, "data.hdf5"), "/dataset", rindices
+                )
 
                 if dataset_name == "update_dataset":
                     del _file["dataset"]
@@ -1312,6 +1428,7 @@ class ImageDataset:
         shift_approach="fft",
         indices=None,
         callback=None,
+        search="grid",
     ):
         """
         Find the shift of the data or part of it and apply it.
@@ -1326,13 +1443,23 @@ class ImageDataset:
             If None, the hot pixel removal is applied to all the data.
         :type indices: Union[None, array_like]
         :param Union[function, None] callback: Callback
+        :param Union['grid', 'fourier'] search: Search of the best shift.
+            See `core.imageRegistration.improve_linear_shift`
         :returns: Dataset with the new data.
         """
-        shift = self.find_shift(dimension, steps, indices=indices)
+        shift = self.find_shift(dimension, steps, indices=indices, search=search)
         return self.apply_shift(shift, dimension, indices=indices)
 
     def _waterfall_nmf(
-        self, num_components, iterations, vstep=None, hstep=None, indices=None
+        self,
+        num_components,
+        iterations,
+        vstep=100,
+        hstep=None,
+        indices=None,
+        solver: NMFSolver | str = NMFSolver.MU,
+        dtype=None,
+        tol=None,
     ):
         """
         This method is used as a way to improve the speed of convergence of
@@ -1345,70 +1472,54 @@ class ImageDataset:
         This way, the number of iterations with big images can be diminished, and
         the method converges faster.
 
+        The resized images are block averages of the images (binning by a power of 2),
+        computed in a single read of the data and kept in memory, or in a temporary file
+        if they do not fit in `darfix.config.WATERFALL_MAX_NBYTES`
+        (see :func:`darfix.decomposition.multiresolution.multiresolution_nmf`).
+
         :param int num_components: Number of components to find.
         :param array_like iterations: Array with number of iterations per step of the waterfall.
             The size of the array sets the size of the waterfall.
+        :param int vstep: Number of full size images per block of the NMF.
+        :param hstep: Not used.
         :param Union[None, array_like] indices: If not None, apply method only to indices of data.
+        :param solver: NMF solver of the steps (see :meth:`nmf`)
+        :param dtype: Type of the computation
+        :param tol: Tolerance of the convergence-based stopping of the steps
+        :return: (H, W): Components at the size of the images and mixing matrix,
+            to initialize the NMF of the data.
         """
-
-        import shutil
-
-        from skimage.transform import resize
-
-        W = None
-        H = None
-        shape = numpy.asarray(self.get_data(0).shape)
-        first_size = (shape / (len(iterations) + 1)).astype(int)
-        size = first_size
-
-        os.makedirs(os.path.join(self.dir, "waterfall"), exist_ok=True)
-
         _logger.info("Starting waterfall NMF")
 
-        for i in range(len(iterations)):
-            new_urls = []
-            if indices is None:
-                indices = range(self.nframes)
-            for j in indices:
-                filename = os.path.join(self.dir, "waterfall", str(j) + ".npy")
-                numpy.save(filename, resize(self.get_data(j), size))
-                new_urls.append(DataUrl(file_path=filename, scheme="fabio"))
-            data = Data(new_urls, self.get_data(indices).metadata, self._in_memory)
-            dataset = ImageDataset(
-                _dir=os.path.join(self.dir, "waterfall"),
-                data=data,
-                in_memory=self._in_memory,
-            )
-            if vstep:
-                v_step = vstep * (len(iterations) - i)
-            if hstep:
-                h_step = hstep * (len(iterations) - i)
-            H, W = dataset.nmf(
-                num_components, iterations[i], W=W, H=H, vstep=v_step, hstep=h_step
-            )
-            size = first_size * (i + 2)
-            H2 = numpy.empty((H.shape[0], size[0] * size[1]))
-            for row in range(H.shape[0]):
-                H2[row] = resize(H[row].reshape((i + 1) * first_size), size).flatten()
-            H = H2
-
-        try:
-            shutil.rmtree(os.path.join(self.dir, "waterfall"))
-        except Exception as e:
-            print(
-                "Failed to delete %s. Reason: %s"
-                % (os.path.join(self.dir, "waterfall"), e)
-            )
-
-        H = resize(H, (num_components, shape[0] * shape[1]))
-
-        return H, W
+        data = self.get_data(indices)
+        model_class = HALSNMF if NMFSolver.from_value(solver) == NMFSolver.HALS else NMF
+        return multiresolution_nmf(
+            display_progress(data, desc="Building image pyramid"),
+            len(data),
+            data.shape[-2:],
+            num_components,
+            iterations,
+            model_class=model_class,
+            vstep=vstep or 100,
+            dtype=dtype,
+            tol=tol,
+            tmp_dir=self.dir,
+        )
 
-    def pca(self, num_components=None, chunk_size=500, indices=None, return_vals=False):
+    def pca(
+        self,
+        num_components=None,
+        chunk_size=500,
+        indices=None,
+        return_vals=False,
+        solver: PCASolver | str = PCASolver.FULL,
+        oversampling: int = 10,
+        power_iterations: int = 2,
+    ):
         """
         Compute Principal Component Analysis on the data.
-        The method, first converts, if not already, the data into an hdf5 file object
-        with the images flattened in the rows.
+        The images are flattened in the rows of a matrix, without copy when possible
+        (see :meth:`darfix.core.data.Data.open_as_matrix`).
 
         :param num_components: Number of components to find.
             If None, it uses the minimum between the number of images and the
@@ -1422,27 +1533,43 @@ class ImageDataset:
         :param return_vals: If True, returns only the singular values of PCA, else returns
             the components and the mixing matrix, defaults to False
         :type return_vals: bool, optional
+        :param solver: 'full' (scikit-learn PCA in memory, incremental PCA on disk)
+            or 'randomized' (randomized SVD, see :class:`darfix.decomposition.rsvd.RandomizedPCA`)
+        :param oversampling: Number of additional random vectors of the randomized SVD
+        :param power_iterations: Number of power iterations of the randomized SVD
 
         :return: (H, W): The components matrix and the mixing matrix.
         """
         bss_dir = os.path.join(self.dir, "bss")
         os.makedirs(bss_dir, exist_ok=True)
-        if self._in_memory:
+        if PCASolver.from_value(solver) == PCASolver.RANDOMIZED:
+            with self.data.open_as_matrix(bss_dir) as matrix:
+                model = RandomizedPCA(
+                    matrix,
+                    num_components,
+                    indices=indices,
+                    oversampling=oversampling,
+                    power_iterations=power_iterations,
+                    chunk_size=chunk_size,
+                )
+                model.fit_transform()
+            H, vals, W = model.H, model.singular_values, model.W
+        elif self._in_memory:
             from sklearn import decomposition
 
             model = decomposition.PCA(n_components=num_components)
 
-            with self.data.open_as_hdf5(bss_dir) as h5dset:
+            with self.data.open_as_matrix(bss_dir) as matrix:
                 if indices is not None:
-                    W = model.fit_transform(h5dset[indices])
+                    W = model.fit_transform(matrix[indices])
                 else:
-                    W = model.fit_transform(h5dset[:, :])
+                    W = model.fit_transform(matrix[:, :])
 
             H, vals, W = model.components_, model.singular_values_, W
         else:
-            with self.data.open_as_hdf5(bss_dir) as h5dset:
+            with self.data.open_as_matrix(bss_dir) as matrix:
                 model = IPCA(
-                    h5dset,
+                    matrix,
                     chunk_size,
                     num_components,
                     indices=indices,
@@ -1475,8 +1602,8 @@ class ImageDataset:
     ):
         """
         Compute Non-negative Independent Component Analysis on the data.
-        The method, first converts, if not already, the data into an hdf5 file object
-        with the images flattened in the rows.
+        The images are flattened in the rows of a matrix, without copy when possible
+        (see :meth:`darfix.core.data.Data.open_as_matrix`).
 
         :param num_components: Number of components to find
         :type num_components: Union[None, int]
@@ -1497,9 +1624,9 @@ class ImageDataset:
 
         if self._in_memory:
             chunksize = None
-        with self.data.open_as_hdf5(bss_dir) as h5dest:
+        with self.data.open_as_matrix(bss_dir) as matrix:
             model = NICA(
-                h5dest,
+                matrix,
                 num_components,
                 chunksize,
                 indices=indices,
@@ -1519,11 +1646,14 @@ class ImageDataset:
         hstep=1000,
         indices=None,
         init=None,
+        dtype=None,
+        solver: NMFSolver | str = NMFSolver.MU,
+        tol=None,
     ):
         """
         Compute Non-negative Matrix Factorization on the data.
-        The method, first converts, if not already, the data into an hdf5 file object
-        with the images flattened in the rows.
+        The images are flattened in the rows of a matrix, without copy when possible
+        (see :meth:`darfix.core.data.Data.open_as_matrix`).
 
         :param num_components: Number of components to find
         :type num_components: Union[None, int]
@@ -1533,9 +1663,10 @@ class ImageDataset:
             to check for convergence, defaults to None
             TODO: not able for huge datasets.
         :type error_step: Union[None, int], optional
-        :param waterfall: If not None, NMF is computed using the waterfall method.
-            The parameter should be an array with the number of iterations per
-            sub-computation, defaults to None
+        :param waterfall: If not None, NMF is computed using the waterfall method
+            (see :meth:`_waterfall_nmf`). The parameter should be an array with the
+            number of iterations per sub-computation, defaults to None.
+            Not used by the 'mu' solver for data in memory.
         :type waterfall: Union[None, array_like], optional
         :param H: Init matrix for H of shape (n_components, n_samples), defaults to None
         :type H: Union[None, array_like], optional
@@ -1543,26 +1674,35 @@ class ImageDataset:
         :type W: Union[None, array_like], optional
         :param indices: If not None, apply method only to indices of data, defaults to None
         :type indices: Union[None, array_like], optional
+        :param dtype: Type of the computation for data on disk or with the 'hals' solver
+            (float64 or float32), defaults to float64
+        :param solver: 'mu' (multiplicative updates, scikit-learn for data in memory)
+            or 'hals' (hierarchical alternating least squares, see
+            :class:`darfix.decomposition.hals.HALSNMF`)
+        :param tol: If not None, stop when the relative decrease of the error during an
+            iteration is below `tol`. Not used by the 'mu' solver for data in memory.
 
         :return: (H, W): The components matrix and the mixing matrix.
         """
         bss_dir = os.path.join(self.dir, "bss")
         os.makedirs(bss_dir, exist_ok=True)
+        solver = NMFSolver.from_value(solver)
 
-        if self._in_memory:
+        if self._in_memory and solver == NMFSolver.MU:
             from sklearn import decomposition
 
             model = decomposition.NMF(
                 n_components=num_components, init=init, max_iter=num_iter
             )
-            with self.data.open_as_hdf5(bss_dir) as h5dest:
+            with self.data.open_as_matrix(bss_dir) as matrix:
                 if indices is not None:
-                    X = h5dest[indices]
+                    X = matrix[indices]
                 else:
-                    X = h5dest
-                if numpy.any(X[:, :] < 0):
+                    X = matrix[:, :]
+                if numpy.any(X < 0):
                     _logger.warning("Setting negative values to 0 to compute NMF")
-                    X[X[:, :] < 0] = 0
+                    # X can be a view of the data: it must not be modified
+                    X = numpy.maximum(X, 0)
                 if H is not None:
                     X = X.astype(H.dtype)
                 elif W is not None:
@@ -1574,11 +1714,21 @@ class ImageDataset:
         else:
             if waterfall is not None:
                 H, W = self._waterfall_nmf(
-                    num_components, waterfall, vstep, hstep, indices=indices
+                    num_components,
+                    waterfall,
+                    vstep,
+                    hstep,
+                    indices=indices,
+                    solver=solver,
+                    dtype=dtype,
+                    tol=tol,
                 )
 
-            with self.data.open_as_hdf5(bss_dir) as h5dest:
-                model = NMF(h5dest, num_components, indices=indices)
+            model_class = HALSNMF if solver == NMFSolver.HALS else NMF
+            with self.data.open_as_matrix(bss_dir) as matrix:
+                model = model_class(
+                    matrix, num_components, indices=indices, dtype=dtype
+                )
                 with warnings.catch_warnings():
                     warnings.simplefilter("always", ConvergenceWarning)
                     model.fit_transform(
@@ -1588,6 +1738,7 @@ class ImageDataset:
                         vstep=vstep,
                         hstep=hstep,
                         error_step=error_step,
+                        tol=tol,
                     )
                 return model.H, model.W
 
@@ -1601,10 +1752,16 @@ class ImageDataset:
         vstep=100,
         hstep=1000,
         indices=None,
+        solver: NMFSolver | str = NMFSolver.HALS,
+        tol=1e-4,
     ):
         """
         Applies both NICA and NMF to the data. The init H and W for NMF are the
         result of NICA.
+
+        By default, the NMF is computed with the 'hals' solver (see :meth:`nmf`), which
+        refines the NICA result in few iterations, stopped when the relative decrease
+        of the error is below `tol`.
         """
         H, W = self.nica(num_components, chunksize, num_iter, indices=indices)
 
@@ -1623,77 +1780,44 @@ class ImageDataset:
             hstep,
             indices=indices,
             init="custom",
+            solver=solver,
+            tol=tol,
         )
 
     def apply_moments(self, indices=None, chunk_shape=(500, 500)):
         """
         Compute the COM, FWHM, skewness and kurtosis of the data for very dimension.
 
+        The moments of all the dimensions are accumulated in a single read of the data
+        (see :class:`darfix.core.mapping.MomentsAccumulator`).
+
         :param indices: If not None, apply method only to indices of data, defaults to None
         :type indices: Union[None, array_like], optional
-        :param chunk_shape: Shape of the chunk image to use per iteration.
-            Parameter used only when flag in_memory is False.
+        :param chunk_shape: Not used anymore: the data is read frame by frame, the
+            moments are accumulated for whole images.
         :type chunk_shape: array_like, optional
         """
 
         if not self.dims.ndim:
             raise NoDimensionsError("apply_moments")
         self.running_data = self.get_data(indices)
-        for axis, dim in self.dims.items():
-            # Get motor values per image of the stack
-            values = self.get_dimensions_values(indices)[dim.name]
-            if self._in_memory:
-                # Data in memory
-                moments = numpy.asarray(
-                    compute_moments(values, self.running_data), dtype=numpy.float64
-                )
-            else:
-                # Data on disk
-                start = [0, 0]
-                img = self.running_data[0]
-                moments = numpy.empty(
-                    (4, img.shape[0], img.shape[1]), dtype=numpy.float64
-                )
-                chunks_1 = int(numpy.ceil(img.shape[0] / chunk_shape[0]))
-                chunks_2 = int(numpy.ceil(img.shape[1] / chunk_shape[1]))
-                io_utils.advancement_display(
-                    0, chunks_1 * chunks_2 * len(self.running_data), "Computing moments"
-                )
-                for i in range(chunks_1):
-                    for j in range(chunks_2):
-                        c_images = []
-                        cpus = multiprocessing.cpu_count()
-                        with Pool(cpus - 1) as p:
-                            c_images = p.map(
-                                partial(chunk_image, start, chunk_shape),
-                                self.running_data,
-                            )
-                        io_utils.advancement_display(
-                            i * chunks_2 + j + 1,
-                            chunks_1 * chunks_2,
-                            "Computing moments",
-                        )
-                        com, std, skew, kurt = compute_moments(values, c_images)
-                        moments[0][
-                            start[0] : start[0] + chunk_shape[0],
-                            start[1] : start[1] + chunk_shape[1],
-                        ] = com
-                        moments[1][
-                            start[0] : start[0] + chunk_shape[0],
-                            start[1] : start[1] + chunk_shape[1],
-                        ] = std
-                        moments[2][
-                            start[0] : start[0] + chunk_shape[0],
-                            start[1] : start[1] + chunk_shape[1],
-                        ] = skew
-                        moments[3][
-                            start[0] : start[0] + chunk_shape[0],
-                            start[1] : start[1] + chunk_shape[1],
-                        ] = kurt
-                        start[1] = chunk_shape[1] * (j + 1)
-                    start[0] = chunk_shape[0] * (i + 1)
-                    start[1] = 0
-            self.moments_dims[axis] = moments
+        dimensions_values = self.get_dimensions_values(indices)
+        axes = list(self.dims.keys())
+        accumulator = MomentsAccumulator(
+            [dimensions_values[dim.name] for dim in self.dims.values()],
+            self.running_data.frame_shape,
+        )
+        if self._in_memory:
+            slab_size = accumulator.slab_size()
+            for start in range(0, len(self.running_data), slab_size):
+                accumulator.add(self.running_data[start : start + slab_size])
+        else:
+            # Data on disk: frames are read once, ahead of the accumulation
+            accumulator.add_frames(
+                display_progress(self.running_data, desc="Computing moments")
+            )
+        for axis, moments in zip(axes, accumulator.moments()):
+            self.moments_dims[axis] = numpy.asarray(moments, dtype=numpy.float64)
 
         return self.moments_dims
 
@@ -1755,6 +1879,8 @@ class ImageDataset:
                 else:
                     values = None
                 maps = numpy.empty((len(MAPS_1D), *data.frame_shape))
+                # `data` only contains the frames of `indices`
+                moments_indices = None
             elif self.dims.ndim == 2:
                 xdim = self.dims.get(0)
                 ydim = self.dims.get(1)
@@ -1766,67 +1892,51 @@ class ImageDataset:
                 _fit = fit_2d_data
                 data = self.get_data()
                 maps = numpy.empty((len(MAPS_2D), *data.frame_shape))
+                moments_indices = indices
             else:
                 raise TooManyDimensionsForRockingCurvesError()
             if not data.in_memory:
-                # Use chunks to load the data into memory
-                start = [0, 0]
-                chunks_1 = int(numpy.ceil(data.frame_shape[0] / chunk_shape[0]))
-                chunks_2 = int(numpy.ceil(data.frame_shape[1] / chunk_shape[1]))
+                # Load the data into memory one tile of the whole stack at a time
                 img = numpy.empty(data.frame_shape)
+                n_tiles = len(data.tile_slices(chunk_shape))
                 io_utils.advancement_display(
-                    0, chunks_1 * chunks_2 * len(data), "Fitting rocking curves"
+                    0, n_tiles * len(data), "Fitting rocking curves"
                 )
-                for i in range(chunks_1):
-                    for j in range(chunks_2):
-                        if not self.state_of_operations.is_running(Operation.FIT):
-                            raise RuntimeError(
-                                "Expected to be in FIT state of operation."
-                            )
-                        # Use multiprocessing to chunk the images
-                        cpus = multiprocessing.cpu_count()
-                        with Pool(cpus - 1) as p:
-                            c_images = p.map(
-                                partial(chunk_image, start, chunk_shape), data
-                            )
-                        fitted_data, chunked_maps = _fit(
-                            numpy.asarray(c_images),
-                            values=values,
-                            shape=shape,
-                            indices=indices,
-                            int_thresh=int_thresh,
-                            method=method,
+                for i, (tile, c_images) in enumerate(data.iter_tiles(chunk_shape)):
+                    if not self.state_of_operations.is_running(Operation.FIT):
+                        raise RuntimeError("Expected to be in FIT state of operation.")
+                    fitted_data, chunked_maps = _fit(
+                        c_images,
+                        moments=compute_starting_values(
+                            c_images, values, moments_indices
+                        ),
+                        values=values,
+                        shape=shape,
+                        indices=indices,
+                        int_thresh=int_thresh,
+                        method=method,
+                    )
+                    for k in range(len(fitted_data)):
+                        filename = os.path.join(
+                            _dir, "data_fit_" + str(indices[k]).zfill(4) + ".npy"
+                        )
+                        if i != 0:
+                            # If tile is not the first, load image from disk
+                            img = numpy.load(filename)
+                        else:
+                            urls.append(DataUrl(file_path=filename, scheme="fabio"))
+                        img[tile] = fitted_data[k]
+                        numpy.save(filename, img)
+                        io_utils.advancement_display(
+                            i * len(data) + k + 1,
+                            n_tiles * len(data),
+                            "Fitting rocking curves",
                         )
-                        for k in range(len(fitted_data)):
-                            filename = os.path.join(
-                                _dir, "data_fit_" + str(indices[k]).zfill(4) + ".npy"
-                            )
-                            if (i, j) != (0, 0):
-                                # If chunk is not the first, load image from disk
-                                img = numpy.load(filename)
-                            else:
-                                urls.append(DataUrl(file_path=filename, scheme="fabio"))
-                            img[
-                                start[0] : start[0] + chunk_shape[0],
-                                start[1] : start[1] + chunk_shape[1],
-                            ] = fitted_data[k]
-                            numpy.save(filename, img)
-                            io_utils.advancement_display(
-                                i * chunks_2 * len(data) + j * len(data) + k + 1,
-                                chunks_1 * chunks_2 * len(data),
-                                "Fitting rocking curves",
-                            )
-                        maps[
-                            :,
-                            start[0] : start[0] + chunk_shape[0],
-                            start[1] : start[1] + chunk_shape[1],
-                        ] = chunked_maps
-                        start[1] = chunk_shape[1] * (j + 1)
-                    start[0] = chunk_shape[0] * (i + 1)
-                    start[1] = 0
+                    maps[(slice(None),) + tile] = chunked_maps
             else:
                 fitted_data, maps = _fit(
                     data,
+                    moments=compute_starting_values(data, values, moments_indices),
                     values=values,
                     shape=shape,
                     int_thresh=int_thresh,
@@ -1842,10 +1952,10 @@ class ImageDataset:
 
         if indices is not None:
             # Replace only fitted data urls
-            new_urls = numpy.array(self.data.urls, dtype=object).flatten()
-            numpy.put(new_urls, indices, urls)
+            new_urls = self.data.urls.flatten()
+            new_urls[indices] = urls
         else:
-            new_urls = numpy.array(urls)
+            new_urls = FrameUrls.from_urls(urls)
 
         data = Data(
             new_urls.reshape(self.data.urls.shape),
@@ -1876,6 +1986,8 @@ class ImageDataset:
         Computes transformation matrix.
         Depending on the kind of transformation, computes either RSM or magnification
         axes to be used on future widgets.
+        The transformations are compact (separable axes) and cached by frame shape,
+        pixel size and motor values.
 
         :param d: Size of the pixel
         :param kind: Transformation to apply, either 'magnification' or 'rsm'
@@ -1909,15 +2021,24 @@ class ImageDataset:
                     "RSM transformation matrix computation is only for 1D datasets. Use kind='magnification' or project the dataset first."
                 )
             ffz = get_dataset("ffz")
-            x, y = compute_rsm(H, W, d, ffz, -mainx, rotate)
+            self.transformation = rsm_transformation(
+                H, W, float(d), float(ffz), -float(mainx), rotate
+            )
         else:
             obx = get_dataset("obx")
             obpitch = numpy.unique(get_dataset("obpitch"))
             obpitch = obpitch[len(obpitch) // 2]
-            x, y = compute_magnification(
-                H, W, d, obx, obpitch, -mainx, topography_orientation, center
+            self.transformation = magnification_transformation(
+                H,
+                W,
+                float(d),
+                float(obx),
+                float(obpitch),
+                -float(mainx),
+                topography_orientation,
+                center,
+                rotate,
             )
-        self.transformation = Transformation(kind, x, y, rotate)
 
     def project_data(self, dimension: Sequence[int], indices=None, _dir=None):
         """
@@ -2067,89 +2188,11 @@ class ImageDataset:
 
 ###########################################################################################################################
 #
-# Code below is related to abstraction between edf and hdf5 to read metadata
-# TODO When a refacto will be done about IO. This code should be replaced by a class with a higher level of abstraction :
-# For now we have an existing fabio class for edf and a mock for hdf5. It would be better to have an abstract class for darfix metadata
-# and 2 implementation, one for edf, one for hdf5.
+# Code below is related to reading metadata from HDF5 files. EDF metadata is read with silx FabioReader
+# and both are stored as a darfix.core.metadata_table.MetadataTable.
 #
 ###########################################################################################################################
 
-POSITIONER_METADATA = fabioh5.FabioReader.POSITIONER
-
-
-class _HDF5MetadataReader:
-    """
-    Equivalent of silx.io.fabioh5.FabioReader to give access to HDF5 metadata
-
-    FIXME: remove this class. Storage and reading of metadata has been based on EDF. This class is a work-around
-    Design of handle metadata shouldn't be based on the data type but more abstracted
-    """
-
-    def __init__(self, metadata: dict) -> None:
-        self._metadata = metadata
-
-    def get_value(self, kind, name):
-        return self._metadata[name]
-
-    def get_keys(self, kind):
-        if kind == POSITIONER_METADATA:
-            return tuple(self._metadata.keys())
-        else:
-            return tuple()
-
-
-def extract_metadata_keys(
-    metadata: list[fabioh5.EdfFabioReader | _HDF5MetadataReader],
-) -> list[str]:
-    result = []
-    if len(metadata) > 0:
-        result = list(metadata[0].get_keys(POSITIONER_METADATA))
-    return result
-
-
-def extract_metadata_values(
-    metadata: list[fabioh5.EdfFabioReader | _HDF5MetadataReader],
-    key: str,
-    missing_value=numpy.nan,
-    take_previous_when_missing: bool = True,
-) -> list:
-    values = []
-    has_missing_value = False
-    kind = POSITIONER_METADATA
-    for data in metadata:
-        if not isinstance(data, (_HDF5MetadataReader, EdfFabioReader)):
-            raise TypeError(
-                f"Metadata should contain instances of {_HDF5MetadataReader} or {EdfFabioReader}. But got {type(data)}."
-            )
-        try:
-            value = data.get_value(kind=POSITIONER_METADATA, name=key)
-        except KeyError:
-            has_missing_value = True
-            if take_previous_when_missing and values:
-                values.append(values[-1])
-            else:
-                values.append(missing_value)
-        else:
-            if not isinstance(data, _HDF5MetadataReader):
-                # _HDF5MetadataReader already returns a scalar when silx FabioReader return an array of a single element
-                value = value[0]
-            values.append(value)
-    if has_missing_value:
-        if take_previous_when_missing:
-            _logger.warning(
-                "Missing value(s) filled to previous value for kind '%s' and key '%s'",
-                kind,
-                key,
-            )
-        else:
-            _logger.warning(
-                "Missing value(s) filled with %s for kind '%s' and key '%s'",
-                missing_value,
-                kind,
-                key,
-            )
-    return values
-
 
 def extract_positioners(positioners: h5py.Group) -> Dict[str, h5py.Dataset]:
     # Some positioners are detectors and therefore scalars in `positioners`.
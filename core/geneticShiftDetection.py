@@ -7,8 +7,8 @@ import random
 
 import numpy
 
-from .autofocus import normalized_variance
-from .imageRegistration import apply_opencv_shift
+from .imageRegistration import ShiftScore
+from .imageRegistration import has_converged
 
 
 class GeneticShiftDetection:
@@ -22,9 +22,11 @@ class GeneticShiftDetection:
     :param array_like data: Stack of images.
     :param array_like optimal_shift: Array with 2 rows (y and x) and
         ``len(data)`` columns with an optimal linear shift.
+    :param Union[None,int] n_workers: Number of individuals scored in parallel.
+        If None, the number of CPUs is used.
     """
 
-    def __init__(self, data, optimal_shift):
+    def __init__(self, data, optimal_shift, n_workers=None):
         assert optimal_shift.shape[1] == len(
             data
         ), "Optimal shift\
@@ -32,6 +34,10 @@ class GeneticShiftDetection:
 
         self.data = data
         self.optimal_shift = optimal_shift
+        self.n_workers = n_workers
+        self.shift_approach = "linear"
+        # Scores of the individuals by shift approach, kept between generations
+        self._shift_scores = {}
 
     def initialize(self, size):
         """
@@ -58,16 +64,14 @@ class GeneticShiftDetection:
         :returns: ndarray, ndarray
         """
 
-        scores = []
-        for i in range(len(population)):
-            result = numpy.zeros(self.data[0].shape)
-            n_shift = self.optimal_shift + population[i]
-            for iFrame in range(len(self.data)):
-                result += apply_opencv_shift(
-                    self.data[iFrame], n_shift[:, iFrame], shift_approach
-                )
-            scores.append(normalized_variance(result))
-        scores, population = numpy.array(scores), numpy.asanyarray(population)
+        if shift_approach not in self._shift_scores:
+            self._shift_scores[shift_approach] = ShiftScore(
+                self.data, shift_approach, self.n_workers
+            )
+        scores = self._shift_scores[shift_approach].score_population(
+            [self.optimal_shift + individual for individual in population]
+        )
+        population = numpy.asanyarray(population)
         inds = numpy.flip(numpy.argsort(scores))
         return scores[inds], population[inds]
 
@@ -146,7 +150,7 @@ class GeneticShiftDetection:
         :param array_like population: Actual population of individuals.
         """
         # Selection, crossover and mutation
-        scores_sorted, population_sorted = self.fitness(population)
+        scores_sorted, population_sorted = self.fitness(population, self.shift_approach)
         population = self.select(population_sorted, scores_sorted)
         population = self.crossover(population)
         population = self.mutate(population)
@@ -157,7 +161,9 @@ class GeneticShiftDetection:
 
         return population
 
-    def fit(self, mean, sigma, n_gens, size):
+    def fit(
+        self, mean, sigma, n_gens, size, shift_approach="linear", tol=None, patience=10
+    ):
         """
         Computes the genetic algorithm.
 
@@ -167,6 +173,10 @@ class GeneticShiftDetection:
             the diagonal of 2x2 matrix).
         :param int n_gens: number of generations to compute.
         :param int size: number of individuals of the population.
+        :param Union[`linear`,`fft`] shift_approach: Name of the shift approach to be used.
+        :param Union[None,float] tol: If not None, the algorithm stops when the best score
+            did not improve by more than `tol` (relative) during `patience` generations.
+        :param int patience: See `tol`.
 
         :returns: The genetic algorithm
         :rtype: GA
@@ -175,21 +185,35 @@ class GeneticShiftDetection:
         self.scores_best, self.scores_avg = [], []
         self.mean = mean
         self.sigma = sigma
+        self.shift_approach = shift_approach
 
         population = self.initialize(size)
-        for i in range(n_gens):
-            population = self.generate(population)
-            print(
-                "\rBest score: {:10.4f}, Avg score: {:10.4f}      {:3}%".format(
-                    self.scores_best[-1],
-                    self.scores_avg[-1],
-                    int(100 * (i + 1) / n_gens),
-                ),
-                end="\r",
-            )
+        try:
+            for i in range(n_gens):
+                population = self.generate(population)
+                print(
+                    "\rBest score: {:10.4f}, Avg score: {:10.4f}      {:3}%".format(
+                        self.scores_best[-1],
+                        self.scores_avg[-1],
+                        int(100 * (i + 1) / n_gens),
+                    ),
+                    end="\r",
+                )
+                if has_converged(self.scores_best, tol, patience):
+                    break
+        finally:
+            self.close()
 
         return self
 
+    def close(self):
+        """
+        Releases the scores of the individuals (spectra of the images and threads).
+        """
+        for shift_score in self._shift_scores.values():
+            shift_score.close()
+        self._shift_scores = {}
+
     @property
     def support_(self):
         """
@@ -5,6 +5,7 @@ import silx.math
 from silx.utils.enum import Enum as _Enum
 
 from ..io.progress import display_progress
+from .utils import ThreadedOperation
 
 
 class Method(_Enum):
@@ -161,17 +162,121 @@ def chunk_image(start, chunk_shape, img):
     ]
 
 
-def hot_pixel_removal_3D(data: numpy.ndarray, ksize: int = 3) -> numpy.ndarray:
+def hot_pixel_removal_3D(
+    data: numpy.ndarray,
+    ksize: int = 3,
+    out: numpy.ndarray | None = None,
+    n_threads: int | None = None,
+) -> numpy.ndarray:
     """
     Function to remove hot pixels of the data using median filter.
 
+    The frames are processed by blocks with :class:`HotPixelRemoval`.
+
     :param array_like data: Input data.
     :param ksize: Size of the mask to apply.
+    :param out: Array in which to store the corrected data (it can be `data`).
+        If None, a new array of the dtype of `data` is returned.
+    :param n_threads: Number of threads processing the frames of a block in parallel.
+        If None, the number of CPUs is used.
+    """
+    if out is None:
+        out = numpy.empty(data.shape, dtype=data.dtype)
+    with HotPixelRemoval(data.shape[1:], data.dtype, ksize, n_threads) as remover:
+        block_size = remover.block_size
+        for start in display_progress(
+            range(0, len(data), block_size), desc="Removing hot pixels"
+        ):
+            stop = min(start + block_size, len(data))
+            remover(data[start:stop], out=out[start:stop])
+    return out
+
+
+class HotPixelRemoval(ThreadedOperation):
     """
-    corrected_data = numpy.empty(data.shape, dtype=data.dtype)
-    for i, frame in enumerate(display_progress(data, desc="Removing hot pixels")):
-        corrected_data[i] = hot_pixel_removal_2D(frame, ksize)
-    return corrected_data
+    Hot pixel removal of blocks of frames, giving the same result as
+    :func:`hot_pixel_removal_2D` applied to each frame.
+
+    The temporary images of the computation are allocated once per thread and reused
+    for all the frames. The frames of a block are processed in parallel by threads:
+    the median filter and the numpy operations release the GIL.
+
+    :param frame_shape: Shape of the frames
+    :param dtype: Dtype of the frames
+    :param ksize: Size of the mask to apply.
+    :param n_threads: Number of threads. If None, the number of CPUs is used.
+    """
+
+    def __init__(
+        self,
+        frame_shape: tuple[int, int],
+        dtype,
+        ksize: int = 3,
+        n_threads: int | None = None,
+    ):
+        self._ksize = ksize
+        dtype = numpy.dtype(dtype)
+        if numpy.issubdtype(dtype, numpy.integer):
+            # Signed integer because we will subtract
+            self._image_dtype = numpy.dtype(numpy.int16)
+            self._subtracted_dtype = numpy.dtype(numpy.int32)
+        elif numpy.issubdtype(dtype, numpy.floating):
+            self._image_dtype = numpy.dtype(numpy.float32)
+            self._subtracted_dtype = self._image_dtype
+        else:
+            self._image_dtype = dtype
+            self._subtracted_dtype = dtype
+        ThreadedOperation.__init__(self, n_threads, "darfix-hot-pixels")
+        self._scratch = [
+            (
+                numpy.empty(frame_shape, self._image_dtype),
+                numpy.empty(frame_shape, self._subtracted_dtype),
+                numpy.empty(frame_shape, dtype=bool),
+            )
+            for _ in range(self.n_threads)
+        ]
+
+    @property
+    def block_size(self) -> int:
+        """Number of frames to process at once to use all the threads"""
+        return 4 * self.n_threads
+
+    def __call__(
+        self, frames: numpy.ndarray, out: numpy.ndarray | None = None
+    ) -> numpy.ndarray:
+        """
+        :param frames: Block of frames of shape (n_frames, height, width)
+        :param out: Array in which to store the corrected frames (it can be `frames`).
+            If None, a new array of the dtype of `frames` is returned.
+        """
+        frames = numpy.asarray(frames)
+        if out is None:
+            out = numpy.empty(frames.shape, dtype=frames.dtype)
+        n_workers = min(self.n_threads, len(frames))
+        if n_workers <= 1:
+            self._process_frames(frames, out, 0, 1)
+            return out
+
+        futures = [
+            self.executor.submit(self._process_frames, frames, out, worker, n_workers)
+            for worker in range(n_workers)
+        ]
+        for future in futures:
+            future.result()
+        return out
+
+    def _process_frames(
+        self, frames: numpy.ndarray, out: numpy.ndarray, worker: int, n_workers: int
+    ) -> None:
+        image, subtracted, hot_pixels = self._scratch[worker]
+        for i in range(worker, len(frames), n_workers):
+            numpy.copyto(image, frames[i], casting="unsafe")
+            median = silx.math.medfilt(image, self._ksize)
+            numpy.subtract(image, median, out=subtracted, dtype=self._subtracted_dtype)
+            threshold = numpy.std(subtracted)
+            numpy.greater(subtracted, threshold, out=hot_pixels)
+            numpy.copyto(image, median, where=hot_pixels)
+            numpy.copyto(out[i], image, casting="unsafe")
 
 
 def hot_pixel_removal_2D(image: numpy.ndarray, ksize: int = 3) -> numpy.ndarray:
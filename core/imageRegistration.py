@@ -1,8 +1,11 @@
+from __future__ import annotations
+
 __authors__ = ["J. Garriga"]
 __license__ = "MIT"
 __date__ = "07/07/2021"
 
 import enum
+import os
 import warnings
 
 try:
@@ -13,6 +16,7 @@ else:
     has_cv2 = True
 
 import numpy
+import scipy.fft
 import skimage
 
 try:
@@ -28,6 +32,19 @@ from silx.utils.enum import Enum as _Enum
 from darfix.io import utils
 
 from .autofocus import normalized_variance
+from .utils import ThreadedOperation
+
+_SHIFT_BLOCK_NBYTES = 64 * 1024**2
+"""Maximum size of the spectra of a block of frames shifted at once"""
+
+_SHIFT_SEARCH_MAX_NBYTES = 256 * 1024**2
+"""Maximum size of the spectra of the frames kept by the Fourier shift search"""
+
+_SHIFT_SEARCH_COARSE_STEPS = 16
+"""Number of shifts evaluated before refining the Fourier shift search"""
+
+_PYRAMID_MIN_SIZE = 32
+"""Minimum size (in pixels) of the binned images of the shift detection pyramid"""
 
 
 @enum.unique
@@ -40,6 +57,18 @@ class ShiftApproach(_Enum):
     FFT = "fft"
 
 
+@enum.unique
+class ShiftSearch(_Enum):
+    """
+    Different searches of the linear shift between the images.
+    """
+
+    GRID = "grid"
+    """Shift and sum the images for each value of an evenly spaced grid"""
+    FOURIER = "fourier"
+    """Sum the images in Fourier space, with a coarse-to-fine search of the shift"""
+
+
 def compute_com(data):
     """
     Compute the center of mass of a stack of images.
@@ -93,6 +122,93 @@ def find_shift(img1, img2, upsample_factor=1000) -> numpy.ndarray:
     )
 
 
+def find_shift_pyramid(
+    img1, img2, levels=3, upsample_factor=1000, coarse_upsample_factor=10
+) -> numpy.ndarray:
+    """
+    Finds the shift between two images as :func:`find_shift`, with a multi-resolution
+    approach for large images.
+
+    The shift is first found between the images binned ``2**levels`` times.
+    It is then refined on the full resolution cross-correlation, only in a small window
+    around the coarse shift, by successive upsampled DFTs increasing the precision
+    ten times each until reaching ``1 / upsample_factor``.
+
+    :param array_like img1: first image.
+    :param array_like img2: second image, must be same dimensionsionality as ``img1``.
+    :param int levels: Number of times the images are binned by 2. It is reduced
+        so that the binned images are at least `_PYRAMID_MIN_SIZE` pixels wide.
+    :param int upsample_factor: optional.
+    :param int coarse_upsample_factor: Upsample factor at the coarsest level.
+    """
+    img1 = numpy.asarray(img1, dtype=numpy.float64)
+    img2 = numpy.asarray(img2, dtype=numpy.float64)
+    levels = min(levels, int(numpy.log2(max(min(img1.shape) / _PYRAMID_MIN_SIZE, 1))))
+    if levels <= 0:
+        return find_shift(img1, img2, upsample_factor)
+
+    binning = 2**levels
+    coarse_shift = binning * find_shift(
+        _bin_image(img1, binning),
+        _bin_image(img2, binning),
+        coarse_upsample_factor,
+    )
+
+    image_product = scipy.fft.fft2(img1) * scipy.fft.fft2(img2).conj()
+    # Precision of the coarse shift (with a margin), in pixels
+    radius = binning
+    shift = coarse_shift
+    upsample = 1
+    while True:
+        region_size = int(numpy.ceil(2 * radius * upsample)) + 1
+        center = region_size // 2
+        shift = numpy.round(shift * upsample) / upsample
+        cross_correlation = _upsampled_dft(
+            image_product.conj(), region_size, upsample, center - shift * upsample
+        ).conj()
+        maxima = numpy.unravel_index(
+            numpy.argmax(numpy.abs(cross_correlation)), cross_correlation.shape
+        )
+        shift = shift + (numpy.array(maxima) - center) / upsample
+        if upsample >= upsample_factor:
+            break
+        radius = 1 / upsample
+        upsample = min(upsample * 10, upsample_factor)
+
+    # Same range as phase_cross_correlation
+    shape = numpy.array(img1.shape)
+    shift = numpy.mod(shift, shape)
+    shift[shift > shape // 2] -= shape[shift > shape // 2]
+    return shift
+
+
+def _bin_image(img, binning: int) -> numpy.ndarray:
+    """Sum of the pixels of the image by blocks of `binning` x `binning` pixels"""
+    ynum, xnum = (n // binning for n in img.shape)
+    return (
+        img[: ynum * binning, : xnum * binning]
+        .reshape(ynum, binning, xnum, binning)
+        .sum(axis=(1, 3))
+    )
+
+
+def _upsampled_dft(data, region_size: int, upsample_factor: int, offsets):
+    """
+    Inverse DFT of `data` upsampled `upsample_factor` times, in a region of
+    `region_size` x `region_size` samples starting at `offsets` (in upsampled samples),
+    computed by matrix products instead of an FFT of the full upsampled array.
+    """
+    for n_items, offset in zip(data.shape[::-1], offsets[::-1]):
+        kernel = numpy.exp(
+            -2j
+            * numpy.pi
+            * (numpy.arange(region_size) - offset)[:, None]
+            * scipy.fft.fftfreq(n_items, upsample_factor)
+        )
+        data = numpy.tensordot(kernel, data, axes=(1, -1))
+    return data
+
+
 def _numpy_fft_shift(img, dx, dy):
     """
     Shift an image by Fourier approach using Numpy library.
@@ -175,6 +291,72 @@ def apply_opencv_shift(img, shift, shift_approach="fft"):
         return _opencv_fft_shift(img, shift[1], shift[0])
 
 
+class FourierShift:
+    """
+    Sub-pixel shift of blocks of frames by Fourier approach, giving the same result as
+    :func:`_numpy_fft_shift` applied to each frame.
+
+    The frequency grids are computed once for all the frames. The phase ramp of each
+    frame is separable, so it is applied as two products with a row and a column
+    of phases instead of building the full ramp. The FFTs of a block of frames are
+    computed at once by `scipy.fft`, using several threads.
+
+    :param frame_shape: Shape of the frames
+    :param n_threads: Number of threads of the FFTs. If None, the number of CPUs is used.
+    """
+
+    def __init__(self, frame_shape: tuple[int, int], n_threads: int | None = None):
+        self._frame_shape = tuple(frame_shape)
+        if n_threads is None:
+            n_threads = os.cpu_count() or 1
+        self._n_threads = max(int(n_threads), 1)
+        ynum, xnum = self._frame_shape
+        # -2i.pi.f for each frequency f of the axes
+        self._y_phases = -2j * numpy.pi * scipy.fft.fftfreq(ynum)
+        self._x_phases = -2j * numpy.pi * scipy.fft.fftfreq(xnum)
+
+    @property
+    def block_size(self) -> int:
+        """Number of frames to shift at once"""
+        frame_nbytes = (
+            numpy.prod(self._frame_shape) * numpy.dtype(numpy.complex64).itemsize
+        )
+        return int(
+            max(min(4 * self._n_threads, _SHIFT_BLOCK_NBYTES // frame_nbytes), 1)
+        )
+
+    def __call__(
+        self,
+        frames: numpy.ndarray,
+        shifts: numpy.ndarray,
+        out: numpy.ndarray | None = None,
+    ) -> numpy.ndarray:
+        """
+        :param frames: Block of frames of shape (n_frames, height, width)
+        :param shifts: Shifts of the frames, of shape (2, n_frames). ``shifts[0]``
+            refers to the y-axis, ``shifts[1]`` refers to the x-axis.
+        :param out: Array in which to store the shifted frames.
+            If None, a new float32 array is returned.
+        """
+        frames = numpy.asarray(frames, dtype=numpy.float32)
+        shifts = numpy.asarray(shifts, dtype=numpy.float64)
+        if out is None:
+            out = numpy.empty(frames.shape, dtype=numpy.float32)
+        if len(frames) == 0:
+            return out
+
+        spectrum = scipy.fft.fft2(frames, workers=self._n_threads)
+        spectrum *= numpy.exp(
+            numpy.multiply.outer(shifts[0], self._y_phases).astype(spectrum.dtype)
+        )[:, :, None]
+        spectrum *= numpy.exp(
+            numpy.multiply.outer(shifts[1], self._x_phases).astype(spectrum.dtype)
+        )[:, None, :]
+        shifted = scipy.fft.ifft2(spectrum, workers=self._n_threads, overwrite_x=True)
+        numpy.copyto(out, shifted.real, casting="unsafe")
+        return out
+
+
 def normalize(x):
     """
     Normalizes a vector or matrix.
@@ -184,13 +366,245 @@ def normalize(x):
     return x / numpy.linalg.norm(x)
 
 
+class _FrameSpectra:
+    """
+    Real FFTs of frames of a stack, computed once to score shifts of the frames
+    in Fourier space.
+
+    If the spectra do not fit in `max_nbytes`, only their lowest frequencies are kept,
+    which amounts to scoring downsampled frames.
+
+    :param data: The stack of images.
+    :param frames_indices: Indices of the frames to transform.
+    :param max_nbytes: Maximum size of the spectra.
+    """
+
+    def __init__(self, data, frames_indices, max_nbytes: int):
+        ynum, xnum = data[frames_indices[0]].shape
+        self.npixels = ynum * xnum
+        n_columns = xnum // 2 + 1
+
+        # Frequencies kept in the spectra
+        spectra_nbytes = (
+            len(frames_indices)
+            * ynum
+            * n_columns
+            * numpy.dtype(numpy.complex64).itemsize
+        )
+        ratio = min(numpy.sqrt(max_nbytes / max(spectra_nbytes, 1)), 1)
+        if ratio < 1:
+            half_rows = max(int(ynum * ratio) // 2, 1)
+            rows = numpy.r_[0 : half_rows + 1, ynum - half_rows : ynum]
+            rows = numpy.unique(rows % ynum)
+            n_columns = max(int(n_columns * ratio), 1)
+        else:
+            rows = numpy.arange(ynum)
+        # Weight of each column of the real FFT in the full spectrum
+        self._weights = numpy.full(n_columns, 2.0)
+        self._weights[0] = 1
+        if xnum % 2 == 0 and n_columns == xnum // 2 + 1:
+            self._weights[-1] = 1
+
+        self.spectra = numpy.empty(
+            (len(frames_indices), len(rows), n_columns), dtype=numpy.complex64
+        )
+        for i, iFrame in enumerate(frames_indices):
+            spectrum = scipy.fft.rfft2(
+                numpy.asarray(data[iFrame], dtype=numpy.float32), workers=-1
+            )
+            self.spectra[i] = spectrum[rows, :n_columns]
+
+        # -2i.pi.f for each frequency f kept
+        self.y_phases = -2j * numpy.pi * scipy.fft.fftfreq(ynum)[rows]
+        self.x_phases = -2j * numpy.pi * scipy.fft.rfftfreq(xnum)[:n_columns]
+
+    def normalized_variance(self, spectrum: numpy.ndarray) -> float:
+        """
+        Normalized variance of an image from its (cropped) real FFT,
+        given by Parseval's theorem.
+        """
+        dc = spectrum[0, 0].real
+        power = numpy.dot(
+            (spectrum.real**2 + spectrum.imag**2).sum(axis=0, dtype=numpy.float64),
+            self._weights,
+        )
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return (power - dc**2) / (self.npixels * dc)
+
+
+class _FourierShiftScore:
+    """
+    Normalized variance of the sum of the frames of a stack, frame ``i`` being
+    shifted by ``h * v * i``, computed in Fourier space for any value of ``h``.
+
+    The spectra of the frames are computed once. The spectrum of the sum of the
+    shifted frames is then a polynomial in the phase ramp of ``h * v``, evaluated
+    with Horner's method: no frame is shifted back to real space.
+
+    :param data: The stack of images.
+    :param v: The direction of the shift.
+    :param frames_indices: Indices of the frames of the sum.
+    :param max_nbytes: Maximum size of the spectra.
+    """
+
+    def __init__(self, data, v, frames_indices, max_nbytes: int):
+        self._frames_indices = numpy.sort(numpy.asarray(frames_indices, dtype=int))
+        self._frames = _FrameSpectra(data, self._frames_indices, max_nbytes)
+        self._phases = (
+            v[0] * self._frames.y_phases[:, None]
+            + v[1] * self._frames.x_phases[None, :]
+        )
+
+    def __call__(self, h: float) -> float:
+        spectra = self._frames.spectra
+        ramp = numpy.exp(h * self._phases).astype(numpy.complex64)
+        total = numpy.zeros(spectra.shape[1:], dtype=numpy.complex64)
+        selected = len(self._frames_indices) - 1
+        for iFrame in range(self._frames_indices[-1], -1, -1):
+            total *= ramp
+            if iFrame == self._frames_indices[selected]:
+                total += spectra[selected]
+                selected -= 1
+        return self._frames.normalized_variance(total)
+
+
+class ShiftScore(ThreadedOperation):
+    """
+    Score of a shift of each frame of a stack: the normalized variance of the sum
+    of the shifted frames. It is used to compare candidate shifts, the best
+    shifts giving the sharpest sum.
+
+    With the `fft` approach, the spectra of the frames are computed once for all
+    the candidates and the shifted frames are summed in Fourier space.
+    The candidates of a population are scored in parallel by threads.
+
+    :param data: The stack of images.
+    :param Union[`linear`,`fft`] shift_approach: The shift method to be used to apply the shift.
+    :param n_threads: Number of candidates scored in parallel.
+        If None, the number of CPUs is used.
+    """
+
+    def __init__(self, data, shift_approach="linear", n_threads: int | None = None):
+        self._data = data
+        self._shift_approach = ShiftApproach.from_value(shift_approach)
+        ThreadedOperation.__init__(self, n_threads, "darfix-shift-score")
+        if self._shift_approach == ShiftApproach.FFT:
+            self._frames = _FrameSpectra(
+                data, numpy.arange(len(data)), _SHIFT_SEARCH_MAX_NBYTES
+            )
+            frame_nbytes = self._frames.spectra[0].nbytes
+            self._block_size = max(_SHIFT_BLOCK_NBYTES // frame_nbytes // 4, 1)
+
+    def __call__(self, n_shift: numpy.ndarray) -> float:
+        """
+        :param n_shift: Shift of each frame, of shape (2, n_frames). ``n_shift[0]``
+            refers to the y-axis, ``n_shift[1]`` refers to the x-axis.
+        """
+        n_shift = numpy.asarray(n_shift, dtype=numpy.float64)
+        if self._shift_approach != ShiftApproach.FFT:
+            result = numpy.zeros(self._data[0].shape)
+            for iFrame in range(len(self._data)):
+                result += apply_opencv_shift(
+                    self._data[iFrame], n_shift[:, iFrame], self._shift_approach
+                )
+            return normalized_variance(result)
+
+        spectra = self._frames.spectra
+        # The phase ramp of each frame is the product of a column and a row of phases
+        y_ramps = numpy.exp(
+            numpy.multiply.outer(n_shift[0], self._frames.y_phases)
+        ).astype(numpy.complex64)
+        x_ramps = numpy.exp(
+            numpy.multiply.outer(n_shift[1], self._frames.x_phases)
+        ).astype(numpy.complex64)
+        total = numpy.zeros(spectra.shape[1:], dtype=numpy.complex64)
+        for start in range(0, len(spectra), self._block_size):
+            stop = start + self._block_size
+            shifted = spectra[start:stop] * x_ramps[start:stop, None, :]
+            shifted *= y_ramps[start:stop, :, None]
+            total += shifted.sum(axis=0)
+        return self._frames.normalized_variance(total)
+
+    def score_population(self, population) -> numpy.ndarray:
+        """
+        Scores of the candidate shifts of a population.
+
+        :param population: Candidate shifts, of shape (n_candidates, 2, n_frames).
+        """
+        if self.n_threads == 1 or len(population) <= 1:
+            return numpy.array([self(n_shift) for n_shift in population])
+        return numpy.array(list(self.executor.map(self, population)))
+
+
+def has_converged(best_scores, tol: float | None, patience: int) -> bool:
+    """
+    Whether an optimization has converged: the best score did not improve
+    by more than `tol` (relative to its value) during the last `patience` iterations.
+
+    :param best_scores: Best score after each iteration.
+    :param tol: Relative tolerance. If None, the optimization never converges.
+    :param patience: Number of iterations.
+    """
+    if tol is None or len(best_scores) <= patience:
+        return False
+    previous = best_scores[-1 - patience]
+    return best_scores[-1] - previous <= tol * abs(previous)
+
+
+def _maximize(score, start: float, stop: float, precision: float, n_coarse: int):
+    """
+    Coarse-to-fine search of the maximum of `score` between `start` and `stop`:
+    the best of `n_coarse` evenly spaced values is refined by a golden-section search
+    between its neighbours, until the interval is smaller than `precision`.
+    """
+    candidates = numpy.linspace(start, stop, max(n_coarse, 3))
+    scores = []
+    for i, h in enumerate(candidates):
+        scores.append(score(h))
+        utils.advancement_display(i + 1, len(candidates), "Finding shift")
+    scores = numpy.nan_to_num(scores, nan=-numpy.inf)
+    best = int(numpy.argmax(scores))
+    best_h, best_score = candidates[best], scores[best]
+
+    a = candidates[max(best - 1, 0)]
+    b = candidates[min(best + 1, len(candidates) - 1)]
+    inv_phi = (numpy.sqrt(5) - 1) / 2
+    c = b - inv_phi * (b - a)
+    d = a + inv_phi * (b - a)
+    score_c, score_d = score(c), score(d)
+    while b - a > precision:
+        if score_c >= score_d:
+            b, d, score_d = d, c, score_c
+            c = b - inv_phi * (b - a)
+            score_c = score(c)
+        else:
+            a, c, score_c = c, d, score_d
+            d = a + inv_phi * (b - a)
+            score_d = score(d)
+    for h, h_score in ((c, score_c), (d, score_d)):
+        if h_score > best_score:
+            best_h, best_score = h, h_score
+    return best_h
+
+
 def improve_linear_shift(
-    data, v, h, epsilon, steps, nimages=None, shift_approach="linear"
+    data,
+    v,
+    h,
+    epsilon,
+    steps,
+    nimages=None,
+    shift_approach="linear",
+    search="grid",
 ):
     """
     Function to find the best shift between the images. It loops ``steps`` times,
     applying a different shift each, and trying to find the one that has the best result.
 
+    With the `fourier` search, the images are transformed once and the shifted images
+    are summed in Fourier space. The best of a few shifts is then refined until
+    reaching the precision of the ``steps`` tries.
+
     :param array_like data: The stack of images.
     :param 2-dimensional array_like v: The vector with the direction of the shift.
     :param float epsilon: Maximum value of h
@@ -199,15 +613,28 @@ def improve_linear_shift(
         be smaller or equal as the length of the data. If it is smaller, the images used
         are chosen using `numpy.random.choice`, without replacement.
     :param Union[`linear`,`fft`] shift_approach: The shift method to be used to apply the shift.
+        Not used by the `fourier` search.
+    :param Union[`grid`,`fourier`] search: The search of the best shift.
     :returns: ndarray
     """
     shift_approach = ShiftApproach.from_value(shift_approach)
+    search = ShiftSearch.from_value(search)
     v = numpy.asanyarray(v)
     iData = range(data.shape[0])
 
     if nimages:
         iData = numpy.random.choice(iData, nimages, False)
 
+    if search == ShiftSearch.FOURIER:
+        score = _FourierShiftScore(data, v, iData, _SHIFT_SEARCH_MAX_NBYTES)
+        return _maximize(
+            score,
+            0,
+            h + epsilon,
+            precision=epsilon / steps,
+            n_coarse=min(steps, _SHIFT_SEARCH_COARSE_STEPS),
+        )
+
     score = {}
     utils.advancement_display(0, h + epsilon, "Finding shift")
     step = epsilon / steps
@@ -225,11 +652,18 @@ def improve_linear_shift(
     return optimal_h
 
 
-def shift_detection(data, steps, shift_approach="linear"):
+def shift_detection(
+    data, steps, shift_approach="linear", search="grid", pyramid_levels=0
+):
     """
     Finds the linear shift from a set of images.
 
     :param ndarray data: Array with the images.
+    :param int steps: Number of different tries of the shift (see :func:`improve_linear_shift`).
+    :param Union[`linear`,`fft`] shift_approach: The shift method to be used to apply the shift.
+    :param Union[`grid`,`fourier`] search: The search of the best shift.
+    :param int pyramid_levels: If not 0, the shift between the two halves of the stack
+        is found with a pyramid of this number of levels (see :func:`find_shift_pyramid`).
     :returns: A vector of length the number of images with the linear shift
         to apply to every image.
     :rtype: ndarray
@@ -247,6 +681,8 @@ def shift_detection(data, steps, shift_approach="linear"):
             second_sum += data[i]
     if not first_sum.any() or not second_sum.any():
         shift = numpy.zeros(second_sum.ndim)
+    elif pyramid_levels:
+        shift = find_shift_pyramid(first_sum, second_sum, pyramid_levels, 1000)
     else:
         shift = find_shift(first_sum, second_sum, 1000)
     v = normalize(shift)
@@ -255,7 +691,9 @@ def shift_detection(data, steps, shift_approach="linear"):
     if not h:
         return numpy.outer([0, 0], numpy.arange(len(data)))
     epsilon = 2 * h
-    h = improve_linear_shift(data, v, h, epsilon, steps, shift_approach=shift_approach)
+    h = improve_linear_shift(
+        data, v, h, epsilon, steps, shift_approach=shift_approach, search=search
+    )
     return numpy.outer(h * v, numpy.arange(len(data)))
 
 
@@ -297,11 +735,24 @@ def shift_correction(data, n_shift, shift_approach="fft", callback=None):
 
     utils.advancement_display(0, len(data), "Applying shift")
 
-    for count, frame in enumerate(data):
-        shifted_data[count] = apply_opencv_shift(frame, shift[:, count], shift_approach)
-        utils.advancement_display(count + 1, len(data), "Applying shift")
-        if callback:
-            callback(int(count / len(data) * 100))
+    if shift_approach == ShiftApproach.FFT:
+        shifter = FourierShift(data.shape[1:])
+        for start in range(0, len(data), shifter.block_size):
+            stop = min(start + shifter.block_size, len(data))
+            shifter(
+                data[start:stop], shift[:, start:stop], out=shifted_data[start:stop]
+            )
+            utils.advancement_display(stop, len(data), "Applying shift")
+            if callback:
+                callback(int(start / len(data) * 100))
+    else:
+        for count, frame in enumerate(data):
+            shifted_data[count] = apply_opencv_shift(
+                frame, shift[:, count], shift_approach
+            )
+            utils.advancement_display(count + 1, len(data), "Applying shift")
+            if callback:
+                callback(int(count / len(data) * 100))
 
     with warnings.catch_warnings():
         warnings.simplefilter("always")
@@ -315,7 +766,52 @@ def shift_correction(data, n_shift, shift_approach="fft", callback=None):
     return shifted_data
 
 
-def random_search(data, optimal_shift, iterations, sigma=None, shift_approach="linear"):
+def iter_shifted_frames(frames, n_shift, shift_approach="fft"):
+    """
+    Generator applying a shift to each frame of a stack, for stacks that are streamed
+    (e.g. read from disk) instead of being loaded in memory.
+    With the `fft` approach, the frames are shifted by blocks with :class:`FourierShift`.
+
+    :param Iterable frames: The frames to shift.
+    :param array_like n_shift: Array with the shift to be applied at every frame
+        (see :func:`shift_correction`).
+    :param Union[`linear`,`fft`] shift_approach: Name of the shift approach
+        to be used. Default: `fft`.
+    :returns: Generator of the shifted frames.
+    """
+    shift_approach = ShiftApproach.from_value(shift_approach)
+    shift = numpy.asanyarray(n_shift)
+
+    if shift_approach != ShiftApproach.FFT:
+        for frame, frame_shift in zip(frames, shift.T):
+            yield apply_opencv_shift(frame, frame_shift, shift_approach)
+        return
+
+    shifter = None
+    block = []
+    start = 0
+    for frame in frames:
+        if shifter is None:
+            shifter = FourierShift(numpy.shape(frame))
+        block.append(frame)
+        if len(block) == shifter.block_size:
+            yield from shifter(block, shift[:, start : start + len(block)])
+            start += len(block)
+            block = []
+    if block:
+        yield from shifter(block, shift[:, start : start + len(block)])
+
+
+def random_search(
+    data,
+    optimal_shift,
+    iterations,
+    sigma=None,
+    shift_approach="linear",
+    n_workers=None,
+    tol=None,
+    patience=10,
+):
     """
     Function that performs random search to a set of images to find an improved vector of shifts (one
     for each image). For this, it adds to the optimal shift a series of random samples obtained from
@@ -327,34 +823,41 @@ def random_search(data, optimal_shift, iterations, sigma=None, shift_approach="l
     :param number sigma: Standard deviation of the distribution.
     :param Union[`linear`,`fft`] shift_approach: Name of the shift approach
         to be used. Default: `linear`.
+    :param Union[None,int] n_workers: Number of samples scored in parallel.
+        If None, the number of CPUs is used.
+    :param Union[None,float] tol: If not None, the search stops when the best score did
+        not improve by more than `tol` (relative) during `patience` iterations.
+    :param int patience: See `tol`.
     :returns: A vector of length the number of images with the best shift found for every image.
     :rtype: ndarray
     """
     best_score = -numpy.inf
     best_result = numpy.empty(optimal_shift.shape)
+    best_scores = []
 
     if sigma is None:
         # Using shift from second image
         sigma = abs(optimal_shift[:, 1] / 3)
 
     utils.advancement_display(0, iterations)
-    for i in range(iterations):
-        result = []
-        normal = numpy.random.multivariate_normal(
-            (0, 0), sigma * numpy.eye(2), len(data)
-        ).T
-        n_shift = optimal_shift + normal
-        for iFrame in range(len(data)):
-            shifty = n_shift[0][iFrame]
-            shiftx = n_shift[1][iFrame]
-            result += [
-                apply_opencv_shift(data[iFrame], [shifty, shiftx], shift_approach)
-            ]
-        score = normalized_variance(result)
-        if best_score < score:
-            best_result = n_shift
-            best_score = score
-
-        utils.advancement_display(i + 1, iterations)
+    with ShiftScore(data, shift_approach, n_workers) as shift_score:
+        for start in range(0, iterations, shift_score.n_threads):
+            stop = min(start + shift_score.n_threads, iterations)
+            population = []
+            for i in range(start, stop):
+                normal = numpy.random.multivariate_normal(
+                    (0, 0), sigma * numpy.eye(2), len(data)
+                ).T
+                population.append(optimal_shift + normal)
+            scores = shift_score.score_population(population)
+
+            for i, (n_shift, score) in enumerate(zip(population, scores), start):
+                if best_score < score:
+                    best_result = n_shift
+                    best_score = score
+                best_scores.append(best_score)
+                utils.advancement_display(i + 1, iterations)
+                if has_converged(best_scores, tol, patience):
+                    return best_result
 
     return best_result
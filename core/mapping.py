@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import functools
+from typing import Iterable
+from typing import List
 from typing import Literal
 from typing import Tuple
 
 import numpy
-import tqdm
 from silx.math.medianfilter import medfilt2d
 from skimage.transform import rescale
 
@@ -12,12 +14,154 @@ import darfix
 
 from ..io.progress import display_progress
 from ..math import Vector3D
+from .transformation import RSMTransformation
+from .transformation import Transformation
+from .utils import ThreadedOperation
+
+_TRANSFORMATION_CACHE_SIZE = 8
+"""Maximum number of separable axes of transformations kept in cache"""
+
+_EPSILON = numpy.finfo(numpy.float64).eps
+
+_MOMENTS_SLAB_NBYTES = 64 * 1024**2
+"""Maximum number of bytes of the frames converted to float64 at once to accumulate the moments"""
+
+
+class MomentsAccumulator:
+    """
+    Accumulate the moments of the rocking curves of all the dimensions of a stack of
+    frames in a single pass over the stack.
+
+    The frames are added in the order of the stack, one by one or by slabs. For each
+    frame, the weighted power sums (up to the fourth power) of the motor values of each
+    dimension are accumulated in a single matrix product. The central moments are derived
+    from these sums at the end.
+
+    The motor values are centered on their mean to limit the rounding errors.
+
+    :param values: Motor values of each frame of the stack, for each dimension
+        (array of shape (n_dimensions, n_frames))
+    :param frame_shape: Shape of the frames
+    """
+
+    def __init__(self, values, frame_shape: Tuple[int, ...]):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if values.ndim == 1:
+            values = values[None, :]
+        self._center = (
+            values.mean(axis=1) if values.shape[1] else numpy.zeros(len(values))
+        )
+        centered_values = values - self._center[:, None]
+        # Row 0 is the sum of the weights, then x, x^2, x^3 and x^4 for each dimension
+        self._powers = numpy.concatenate(
+            [numpy.ones((1, values.shape[1]))]
+            + [centered_values**power for power in range(1, 5)]
+        )
+        self._frame_shape = tuple(frame_shape)
+        self._sums = numpy.zeros(
+            (len(self._powers), int(numpy.prod(self._frame_shape)))
+        )
+        self._n_frames_added = 0
+
+    @property
+    def n_dimensions(self) -> int:
+        return len(self._center)
+
+    @property
+    def n_frames(self) -> int:
+        return self._powers.shape[1]
+
+    def slab_size(self) -> int:
+        """Number of frames to add at once to limit the memory used by :meth:`add`"""
+        frame_nbytes = max(numpy.prod(self._frame_shape), 1) * 8
+        return max(int(_MOMENTS_SLAB_NBYTES // frame_nbytes), 1)
+
+    def add(self, frames) -> None:
+        """
+        Add the next frames of the stack.
+
+        :param frames: Array of shape (n, *frame_shape)
+        """
+        frames = numpy.asarray(frames)
+        start = self._n_frames_added
+        stop = start + len(frames)
+        if stop > self.n_frames:
+            raise ValueError(
+                f"Too many frames added: expected {self.n_frames}, got {stop}"
+            )
+        self._sums += self._powers[:, start:stop] @ frames.reshape(
+            len(frames), -1
+        ).astype(numpy.float64, copy=False)
+        self._n_frames_added = stop
+
+    def add_frames(self, frames: Iterable[numpy.ndarray]) -> None:
+        """
+        Add the next frames of the stack, provided one by one.
+        Frames are gathered in slabs (see :meth:`slab_size`) before being added.
+        """
+        slab_size = self.slab_size()
+        slab = []
+        for frame in frames:
+            slab.append(frame)
+            if len(slab) == slab_size:
+                self.add(slab)
+                slab = []
+        if slab:
+            self.add(slab)
+
+    def moments(
+        self, smooth: bool = True
+    ) -> List[Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+        """
+        :param smooth: If True, a median filter is applied to the maps
+        :returns: For each dimension, the maps of the center of mass, FWHM,
+            skewness and kurtosis.
+        """
+        if self._n_frames_added != self.n_frames:
+            raise ValueError(
+                f"Moments accumulated on {self._n_frames_added} frames instead of {self.n_frames}"
+            )
+        n_dimensions = self.n_dimensions
+        sums = self._sums.reshape((len(self._sums),) + self._frame_shape)
+        wsum = sums[0]
+        moments = []
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            for dim in range(n_dimensions):
+                # Raw moments of the centered values: m_k = sum(w * x^k) / sum(w)
+                m1, m2, m3, m4 = (
+                    sums[1 + (power - 1) * n_dimensions + dim] / wsum
+                    for power in range(1, 5)
+                )
+                var = m2 - m1**2
+                # The rounding errors of m2 - m1**2 are proportional to m2: below them,
+                # the variance (for example of a single point) is 0
+                var[(var <= self.n_frames * _EPSILON * m2) & (wsum > 0)] = 0
+                sigma = numpy.sqrt(var)
+                mean = m1 + self._center[dim]
+                fwhm = darfix.config.FWHM_VAL * sigma
+
+                # Central moments from the raw moments
+                mu3 = m3 - 3 * m1 * m2 + 2 * m1**3
+                mu4 = m4 - 4 * m1 * m3 + 6 * m1**2 * m2 - 3 * m1**4
+                skew = numpy.where(var > 0, mu3 / sigma**3, numpy.nan)
+                kurt = numpy.where(var > 0, mu4 / var**2, numpy.nan)
+                kurt -= 3  # Fisher’s definition
+
+                if smooth:
+                    mean = medfilt2d(mean)
+                    fwhm = medfilt2d(fwhm)
+                    skew = medfilt2d(skew)
+                    kurt = medfilt2d(kurt)
+                moments.append((mean, fwhm, skew, kurt))
+        return moments
 
 
 def compute_moments(values, data, smooth: bool = True):
     """
     Compute first, second, third and fourth moment of data on values.
 
+    The moments are accumulated in a single pass over `data` (see :class:`MomentsAccumulator`).
+
     :param values: 1D array of X-values
     :param data: nD array of Y-values with `len(weight) == len(values)`
     :returns: The four first moments to distribution Y(X)
@@ -25,61 +169,44 @@ def compute_moments(values, data, smooth: bool = True):
     if len(values) != len(data):
         raise ValueError("the length of 'values' and 'data' is not equal")
 
-    wsum = numpy.sum(data, axis=0, dtype=numpy.float64)
-    values = numpy.asarray(values, dtype=numpy.float64)
+    accumulator = MomentsAccumulator(values, data.shape[1:])
+    slab_size = accumulator.slab_size()
+    for start in display_progress(
+        range(0, len(data), slab_size), desc="Moments: accumulate power sums"
+    ):
+        accumulator.add(data[start : start + slab_size])
+    return accumulator.moments(smooth)[0]
 
-    # Moments
-    # mean = sum(w * x) / sum(w)
-    # var  = sum(w * (x - mean)^2) / sum(w)
-    # skew = sum(w * ((x - mean)/sigma)^3) / sum(w)
-    # kurt = sum(w * ((x - mean)/sigma)^4) / sum(w) - 3
-    #
-    # The loops below are there to avoid creating another array
-    # in memory with the same shape as `weights`.
 
-    with numpy.errstate(invalid="ignore", divide="ignore"):
-        mean = sum(
-            w * x
-            for x, w in zip(
-                display_progress(values, desc="Moments: compute mean 1/4"), data
-            )
-        )
-        mean /= wsum
+def compute_mean_and_std(values, data) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Compute the weighted mean and standard deviation of data on values, without smoothing.
 
-        var = sum(
-            w * ((x - mean) ** 2)
-            for x, w in zip(
-                display_progress(values, desc="Moments: compute var 2/4"), data
-            )
-        )
-        var /= wsum
-        sigma = numpy.sqrt(var)
-        fwhm = darfix.config.FWHM_VAL * sigma
-
-        skew = sum(
-            w * (((x - mean) / sigma) ** 3)
-            for x, w in zip(
-                display_progress(values, desc="Moments: compute skew 3/4"), data
-            )
-        )
-        skew /= wsum
+    Both are obtained from the power sums of the values centered on their mean,
+    accumulated along axis 0 of data with a tensor product.
 
-        kurt = sum(
-            w * (((x - mean) / sigma) ** 4)
-            for x, w in zip(
-                display_progress(values, desc="Moments: compute kurt 4/4"), data
-            )
-        )
-        kurt /= wsum
-        kurt -= 3  # Fisher’s definition
+    :param values: 1D array of X-values
+    :param data: nD array of Y-values with `len(data) == len(values)`
+    :returns: mean and standard deviation of the distribution Y(X)
+    """
+    if len(values) != len(data):
+        raise ValueError("the length of 'values' and 'data' is not equal")
 
-    if smooth:
-        mean = medfilt2d(mean)
-        fwhm = medfilt2d(fwhm)
-        skew = medfilt2d(skew)
-        kurt = medfilt2d(kurt)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    data = numpy.asarray(data)
+    center = values.mean()
+    centered_values = values - center
+
+    wsum = numpy.sum(data, axis=0, dtype=numpy.float64)
+    sum_1 = numpy.tensordot(centered_values, data, axes=(0, 0))
+    sum_2 = numpy.tensordot(centered_values**2, data, axes=(0, 0))
 
-    return mean, fwhm, skew, kurt
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        centered_mean = sum_1 / wsum
+        var = sum_2 / wsum - centered_mean**2
+        # Rounding errors can make the variance of a single point slightly negative
+        var[(var < 0) & (sum_2 >= 0) & (wsum > 0)] = 0
+        return centered_mean + center, numpy.sqrt(var)
 
 
 def compute_peak_position(data, values=None, center_data=False):
@@ -105,6 +232,19 @@ def compute_peak_position(data, values=None, center_data=False):
     return image
 
 
+def _rsm_axes(
+    H: int, W: int, d: float, ffz: float, rotate: bool = False
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Separable coordinates (y, z) of the pixels on the detector, as a row and a column"""
+    if rotate:
+        y = (numpy.arange(H) - H / 2) * d
+        z = ffz - (W / 2 - numpy.arange(W)) * d
+        return y[:, numpy.newaxis], z[numpy.newaxis, :]
+    y = (numpy.arange(W) - W / 2) * d
+    z = ffz - (H / 2 - numpy.arange(H)) * d
+    return y[numpy.newaxis, :], z[:, numpy.newaxis]
+
+
 def compute_rsm(
     H: int, W: int, d: float, ffz: float, mainx: float, rotate: bool = False
 ) -> Tuple[numpy.ndarray, numpy.ndarray]:
@@ -120,17 +260,64 @@ def compute_rsm(
     :returns: Tuple of two arrays of size (W, H)
     :rtype: (X1, X2) : ndarray
     """
-    if rotate:
-        y = (numpy.arange(H) - H / 2) * d
-        z = ffz - (W / 2 - numpy.arange(W)) * d
-        y, z = numpy.meshgrid(y, z, indexing="ij")
+    transformation = RSMTransformation(*_rsm_axes(H, W, d, ffz, rotate), mainx, rotate)
+    return transformation.x.copy(), transformation.y.copy()
+
+
+@functools.lru_cache(maxsize=_TRANSFORMATION_CACHE_SIZE)
+def _cached_axes(axes_function, *args) -> Tuple[numpy.ndarray, ...]:
+    """
+    Separable axes computed by `axes_function(*args)`, cached and read-only.
+
+    Only the compact axes are cached, not the transformations: the dense coordinates
+    computed by a transformation are released with it.
+    """
+    axes = axes_function(*args)
+    for axis in axes:
+        axis.flags.writeable = False
+    return axes
+
+
+def rsm_transformation(
+    H: int, W: int, d: float, ffz: float, mainx: float, rotate: bool = False
+) -> RSMTransformation:
+    """
+    Compact transformation to azimuthal coordinates (see :func:`compute_rsm`).
+
+    The separable axes are cached and shared by the transformations with the same
+    frame shape, pixel size and motor values.
+    """
+    return RSMTransformation(
+        *_cached_axes(_rsm_axes, H, W, d, ffz, rotate), mainx, rotate
+    )
+
+
+def _magnification_axes(
+    H: int,
+    W: int,
+    d: float,
+    obx: float,
+    obpitch: float,
+    mainx: float,
+    topography_orientation: int | None = None,
+    center: bool = True,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Separable coordinates (x, y) of the pixels, as a row and a column"""
+    d1 = obx / numpy.cos(numpy.radians(obpitch))
+    d2 = mainx / numpy.cos(numpy.radians(obpitch)) - d1
+    M = d2 / d1
+    d /= M
+    if center:
+        x = (numpy.arange(H) - W / 2) * d
+        y = (H / 2 - numpy.arange(W)) * d
     else:
-        y = (numpy.arange(W) - W / 2) * d
-        z = ffz - (H / 2 - numpy.arange(H)) * d
-        z, y = numpy.meshgrid(z, y, indexing="ij")
-    eta = numpy.arctan2(y, z)
-    twotheta = numpy.arctan2(numpy.sqrt(y * y + z * z), mainx)
-    return numpy.degrees(eta), numpy.degrees(twotheta)
+        x = numpy.arange(H) * d
+        y = (H - 1 - numpy.arange(W)) * d
+    if topography_orientation == 0:
+        x /= numpy.sin(numpy.radians(obpitch))
+    elif topography_orientation == 1:
+        y /= numpy.sin(numpy.radians(obpitch))
+    return x[numpy.newaxis, :], y[:, numpy.newaxis]
 
 
 def compute_magnification(
@@ -154,21 +341,47 @@ def compute_magnification(
     :returns: Tuple of two arrays of size (H, W)
     :rtype: (X1, X2) : ndarray
     """
+    x, y = numpy.broadcast_arrays(
+        *_magnification_axes(
+            H, W, d, obx, obpitch, mainx, topography_orientation, center
+        )
+    )
+    return x.copy(), y.copy()
 
-    pix_arr = list(numpy.meshgrid(numpy.arange(H), numpy.arange(W)))
-    d1 = obx / numpy.cos(numpy.radians(obpitch))
-    d2 = mainx / numpy.cos(numpy.radians(obpitch)) - d1
-    M = d2 / d1
-    d /= M
-    if center:
-        pix_arr[0] = (pix_arr[0] - W / 2) * d
-        pix_arr[1] = (H / 2 - pix_arr[1]) * d
-    else:
-        pix_arr[0] = pix_arr[0] * d
-        pix_arr[1] = (H - 1 - pix_arr[1]) * d
-    if topography_orientation is not None:
-        pix_arr[topography_orientation] /= numpy.sin(numpy.radians(obpitch))
-    return pix_arr[0], pix_arr[1]
+
+def magnification_transformation(
+    H: int,
+    W: int,
+    d: float,
+    obx: float,
+    obpitch: float,
+    mainx: float,
+    topography_orientation: int | None = None,
+    center: bool = True,
+    rotate: bool = False,
+) -> Transformation:
+    """
+    Compact magnification transformation (see :func:`compute_magnification`):
+    the separable axes are stored as a row and a column.
+
+    The separable axes are cached and shared by the transformations with the same
+    frame shape, pixel size and motor values.
+    """
+    return Transformation(
+        "magnification",
+        *_cached_axes(
+            _magnification_axes,
+            H,
+            W,
+            d,
+            obx,
+            obpitch,
+            mainx,
+            topography_orientation,
+            center,
+        ),
+        rotate,
+    )
 
 
 def rescale_data(data, scale):
@@ -181,6 +394,342 @@ def rescale_data(data, scale):
     return new_data
 
 
+class RSMAccumulator(ThreadedOperation):
+    """
+    ***Geometry originally written by Mads Carslen***
+
+    Reciprocal space map of a 'diffry' scan without the objective lens, computed as
+    a multidimensional histogram of the intensity of the pixels in q-space
+    (see :func:`calculate_RSM_histogram`).
+
+    The bin of a pixel only depends on the geometry and on the diffry value of the frame:
+    the flat bin indices of the pixels are computed once per diffry value of a chunk
+    of frames, for the sum of the frames of the chunk with this value, and the
+    intensities are accumulated with `numpy.bincount`. The chunks are processed
+    in parallel by threads.
+
+    The number of pixels per bin (frequency histogram) only depends on the geometry:
+    it is computed once and reused for all the stacks of frames binned by this object.
+
+    Only the pixels that can land in the range of the histogram for a diffry value of
+    the sweep are binned (see :meth:`reachable_pixels`), and the pixels of zero
+    intensity are skipped when binning the frames. Narrow ranges and thresholded
+    frames are therefore binned much faster.
+
+    :param diffry_values: diffry value of each frame
+    :param twotheta:
+    :param eta:
+    :param Q: Scattering vector in oriented pseudocubic coordinates.
+    :param a: pseudocubic lattice parameter
+    :param map_range: range (in all 3 directions) of the histogram. Center-to edge-distance.
+    :param units: either 'poulsen'  [10.1107/S1600576717011037] or 'gorfman' [https://arxiv.org/pdf/2110.14311.pdf]. Default: 'poulsen'
+    :param map_shape: Number of bins in each direction
+    :param n: surface normal of the sample in oriented pseudocubic hkl
+    :param E: energy
+    :param n_threads: Number of threads. If None, the number of CPUs is used.
+    """
+
+    def __init__(
+        self,
+        diffry_values: numpy.ndarray,
+        twotheta: numpy.ndarray,
+        eta: numpy.ndarray,
+        Q: Vector3D,
+        a: float,
+        map_range: float,
+        units: Literal["poulsen", "gorfman"] | None = None,
+        map_shape: Vector3D | None = None,
+        n: Vector3D | None = None,
+        E: float | None = None,
+        n_threads: int | None = None,
+    ):
+        if units is None:
+            units = "poulsen"
+        if map_shape is None:
+            map_shape = (50, 50, 50)
+        if n is None:
+            n = (1, 0, 0)
+        if E is None:
+            E = 17.0
+        ThreadedOperation.__init__(self, n_threads, "darfix-rsm")
+        self._units = units
+        self.map_shape = tuple(int(size) for size in map_shape)
+        self._diffry_values = numpy.asarray(diffry_values, dtype=numpy.float64).ravel()
+        self._diffry_center = numpy.mean(self._diffry_values)
+
+        k = 2 * numpy.pi / (12.391 / E)
+
+        if units == "gorfman":
+            # Build orientation matrix
+            sampl_z = numpy.array(Q) / numpy.linalg.norm(
+                numpy.array(Q)
+            )  # assume scattering vector is z
+            sampl_x = n - sampl_z * numpy.dot(sampl_z, n) / numpy.linalg.norm(
+                n
+            )  # orthogonalize
+            sampl_x /= numpy.linalg.norm(sampl_x)  # nomalize
+
+            sampl_y = numpy.cross(sampl_z, sampl_x)
+            self._lab_to_lat = numpy.stack((sampl_x, sampl_y, sampl_z))
+        elif units == "poulsen":
+            self._lab_to_lat = numpy.identity(3)
+
+        # Calculate lab frame q vector for each pixel
+        k0 = numpy.array([k, 0, 0])  # Lab frame incidetn wavevector
+        twotheta = numpy.radians(twotheta)
+        eta = numpy.radians(eta)
+        kh = k * numpy.stack(
+            [
+                numpy.cos(twotheta),
+                numpy.sin(twotheta) * numpy.sin(eta),
+                numpy.sin(twotheta) * numpy.cos(eta),
+            ]
+        )  # Lab frame scattered wavevector
+        q = kh - k0[:, numpy.newaxis, numpy.newaxis]
+        if units == "gorfman":
+            q = q * a / 2 / numpy.pi
+        elif units == "poulsen":
+            q = q * a / 2 / numpy.pi / numpy.linalg.norm(Q)
+
+        # flatten to one q vector per pixel
+        q = q.reshape(3, -1)
+        # Rotate from lab frame to sample frame
+        theta_ref = numpy.arcsin(2 * numpy.pi * numpy.linalg.norm(Q) / a / k / 2)
+        self._q = numpy.stack(
+            [
+                q[0, ...] * numpy.cos(theta_ref) + q[2, ...] * numpy.sin(theta_ref),
+                q[1, ...],
+                q[2, ...] * numpy.cos(theta_ref) - q[0, ...] * numpy.sin(theta_ref),
+            ]
+        )
+
+        # Make histogram ranges
+        q_mean = numpy.mean(self._q, axis=1)
+        diffry_mean = numpy.radians(
+            numpy.mean(self._diffry_values) - self._diffry_center
+        )
+        q_mean = numpy.stack(
+            [
+                q_mean[0] * numpy.cos(diffry_mean) - q_mean[2] * numpy.sin(diffry_mean),
+                q_mean[1],
+                q_mean[2] * numpy.cos(diffry_mean) + q_mean[0] * numpy.sin(diffry_mean),
+            ]
+        )
+
+        if units == "gorfman":
+            q_mean = self._lab_to_lat.transpose() @ q_mean
+
+        self.ranges = tuple(
+            (q_mean[axis] - map_range, q_mean[axis] + map_range) for axis in range(3)
+        )  # hkl units
+        # Same edges as numpy.histogramdd
+        self._bin_edges = [
+            numpy.linspace(start, stop, size + 1)
+            for (start, stop), size in zip(self.ranges, self.map_shape)
+        ]
+        self._pixels = self.reachable_pixels()
+        self._pixels_q = self._q[:, self._pixels]
+        self._frequency = None
+
+    @property
+    def edges(self) -> List[numpy.ndarray]:
+        """Edges of the bins of the histogram in each direction"""
+        edges = [edges.copy() for edges in self._bin_edges]
+        if self._units == "poulsen":
+            edges[2] = edges[2] - 1
+        return edges
+
+    def reachable_pixels(self) -> numpy.ndarray:
+        """
+        Flat indices of the pixels that can be in the range of the histogram for a
+        diffry value between the minimum and the maximum of the sweep.
+
+        Each component of the q vector of a pixel in the lattice frame is a sinusoid
+        of the diffry angle: a pixel is kept if, in each direction, the range of its
+        sinusoid over the sweep intersects the range of the histogram.
+        """
+        start, stop = numpy.radians(
+            (self._diffry_values.min(), self._diffry_values.max())
+        ) - numpy.radians(self._diffry_center)
+        span = stop - start
+        q0, q1, q2 = self._q
+        reachable = numpy.ones(q0.size, dtype=bool)
+        for axis, (low, high) in enumerate(self.ranges):
+            # value(angle) = cos_coef * cos(angle) + sin_coef * sin(angle) + offset
+            col = self._lab_to_lat[:, axis]
+            cos_coef = col[0] * q0 + col[2] * q2
+            sin_coef = col[2] * q0 - col[0] * q2
+            offset = col[1] * q1
+            values = [
+                cos_coef * numpy.cos(angle) + sin_coef * numpy.sin(angle)
+                for angle in (start, stop)
+            ]
+            lowest = numpy.minimum(*values)
+            highest = numpy.maximum(*values)
+            # Extrema of the sinusoid reached inside the sweep
+            amplitude = numpy.hypot(cos_coef, sin_coef)
+            phase = numpy.arctan2(sin_coef, cos_coef)
+            highest = numpy.where(
+                numpy.mod(phase - start, 2 * numpy.pi) <= span, amplitude, highest
+            )
+            lowest = numpy.where(
+                numpy.mod(phase + numpy.pi - start, 2 * numpy.pi) <= span,
+                -amplitude,
+                lowest,
+            )
+            # Margin for the rounding errors of the rotation
+            margin = 1e-6 * (high - low)
+            reachable &= (lowest + offset <= high + margin) & (
+                highest + offset >= low - margin
+            )
+        return numpy.flatnonzero(reachable)
+
+    def _rotate(self, q: numpy.ndarray, diffry: float) -> numpy.ndarray:
+        # rotate q back to zero-motor frame
+        angle = numpy.radians(diffry - self._diffry_center)
+        q_rot = numpy.stack(
+            [
+                q[0, ...] * numpy.cos(angle) - q[2, ...] * numpy.sin(angle),
+                q[1, ...],
+                q[2, ...] * numpy.cos(angle) + q[0, ...] * numpy.sin(angle),
+            ]
+        )
+        # Rotate into lattice frame
+        return self._lab_to_lat.transpose() @ q_rot
+
+    def rotated_q(self, diffry: float) -> numpy.ndarray:
+        """q vectors (of shape (3, n_pixels)) of the pixels of a frame at `diffry`, in the lattice frame"""
+        return self._rotate(self._q, diffry)
+
+    def _flat_indices(
+        self, q: numpy.ndarray, diffry: float
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Positions (in `q`) of the vectors in the range of the histogram and their flat bin index"""
+        q_rot = self._rotate(q, diffry)
+        flat_indices = numpy.zeros(q_rot.shape[1], dtype=numpy.intp)
+        in_range = numpy.ones(q_rot.shape[1], dtype=bool)
+        for values, edges, size in zip(q_rot, self._bin_edges, self.map_shape):
+            indices = numpy.searchsorted(edges, values, side="right")
+            # Values on the last edge are in the last bin
+            indices[values == edges[-1]] -= 1
+            in_range &= (indices >= 1) & (indices <= size)
+            flat_indices *= size
+            flat_indices += indices - 1
+        positions = numpy.flatnonzero(in_range)
+        return positions, flat_indices[positions]
+
+    def bin_indices(self, diffry: float) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Flat bin index of the pixels of a frame at `diffry`, with the same binning as
+        `numpy.histogramdd`.
+
+        :returns: Indices of the pixels in the range of the histogram and their flat bin index
+        """
+        positions, flat_indices = self._flat_indices(self._pixels_q, diffry)
+        return self._pixels[positions], flat_indices
+
+    def _histogram(self, weighted_steps) -> numpy.ndarray:
+        """
+        Histogram of the pixels of frames at several diffry values.
+
+        :param weighted_steps: List of (diffry, weights): the weights are a frame
+            (or a sum of frames) or a number of frames
+        """
+        all_indices = []
+        all_weights = []
+        for diffry, weights in weighted_steps:
+            if numpy.ndim(weights) == 0:
+                _, indices = self._flat_indices(self._pixels_q, diffry)
+                all_indices.append(indices)
+                all_weights.append(numpy.full(len(indices), weights, numpy.float64))
+                continue
+            # Only the reachable pixels of non-zero intensity are binned
+            weights = numpy.ravel(weights)[self._pixels]
+            nonzero = numpy.flatnonzero(weights)
+            if len(nonzero) < len(weights):
+                q = self._pixels_q[:, nonzero]
+                weights = weights[nonzero]
+            else:
+                q = self._pixels_q
+            positions, indices = self._flat_indices(q, diffry)
+            all_indices.append(indices)
+            all_weights.append(weights[positions])
+        return numpy.bincount(
+            numpy.concatenate(all_indices),
+            weights=numpy.concatenate(all_weights),
+            minlength=numpy.prod(self.map_shape),
+        )
+
+    def _sum_histograms(self, weighted_steps) -> numpy.ndarray:
+        """Sum of the histograms of the steps, computed in parallel by chunks of steps"""
+        if self.n_threads == 1 or len(weighted_steps) == 1:
+            return self._histogram(weighted_steps)
+        chunks = [weighted_steps[i :: self.n_threads] for i in range(self.n_threads)]
+        futures = [
+            self.executor.submit(self._histogram, chunk) for chunk in chunks if chunk
+        ]
+        total = futures[0].result()
+        for future in futures[1:]:
+            total += future.result()
+        return total
+
+    @property
+    def frequency(self) -> numpy.ndarray:
+        """Number of pixels of the stack in each bin"""
+        if self._frequency is None:
+            diffry, counts = numpy.unique(self._diffry_values, return_counts=True)
+            frequency = numpy.zeros(numpy.prod(self.map_shape))
+            steps = list(zip(diffry, counts.astype(numpy.float64)))
+            chunk_size = 4 * self.n_threads
+            for start in range(0, len(steps), chunk_size):
+                frequency += self._sum_histograms(steps[start : start + chunk_size])
+            self._frequency = frequency.reshape(self.map_shape)
+        return self._frequency
+
+    def intensity(self, data: Iterable[numpy.ndarray]) -> numpy.ndarray:
+        """
+        Sum of the intensity of the pixels of the stack in each bin.
+
+        :param data: Frames of the stack, in the order of the diffry values.
+            Frames on disk (:class:`darfix.core.data.Data` not in memory) are read one by one.
+        """
+        intensity = numpy.zeros(numpy.prod(self.map_shape))
+        chunk_size = 4 * self.n_threads
+        chunk = {}
+        n_frames = 0
+        for diffry, frame in zip(
+            self._diffry_values, display_progress(data, desc="Computing RSM")
+        ):
+            # Frames of a chunk at the same diffry are binned once
+            if diffry in chunk:
+                chunk[diffry] += frame
+            else:
+                chunk[diffry] = numpy.array(frame, dtype=numpy.float64)
+            n_frames += 1
+            if n_frames == chunk_size:
+                intensity += self._sum_histograms(list(chunk.items()))
+                chunk = {}
+                n_frames = 0
+        if chunk:
+            intensity += self._sum_histograms(list(chunk.items()))
+        return intensity.reshape(self.map_shape)
+
+    def compute(
+        self, data: Iterable[numpy.ndarray]
+    ) -> Tuple[numpy.ndarray, List[numpy.ndarray]]:
+        """
+        :returns: the mean intensity in each bin (NaN in the empty bins) and the edges of the bins
+        """
+        try:
+            sum_inte = self.intensity(data)
+            sum_freq = self.frequency.copy()
+        finally:
+            self.close()
+        # Setting sum_freq to NaN where it is 0 to avoid division by 0 (`arr` will be NaN there)
+        sum_freq[sum_freq == 0] = numpy.nan
+        return sum_inte / sum_freq, self.edges
+
+
 def calculate_RSM_histogram(
     data: numpy.ndarray,
     diffry_values: numpy.ndarray,
@@ -193,6 +742,7 @@ def calculate_RSM_histogram(
     map_shape: Vector3D | None = None,
     n: Vector3D | None = None,
     E: float | None = None,
+    n_threads: int | None = None,
 ):
     """
     ***Code originally written by Mads Carslen***
@@ -211,116 +761,18 @@ def calculate_RSM_histogram(
     :param map_shape: Number of bins in each direction
     :param n: surface normal of the sample in oriented pseudocubic hkl
     :param E: energy
+    :param n_threads: Number of threads. If None, the number of CPUs is used.
     """
-
-    if units is None:
-        units = "poulsen"
-    if map_shape is None:
-        map_shape = (50, 50, 50)
-    if n is None:
-        n = (1, 0, 0)
-    if E is None:
-        E = 17.0
-
-    k = 2 * numpy.pi / (12.391 / E)
-
-    diffry_center = numpy.mean(diffry_values)
-    img_shape = data[0].shape
-    if units == "gorfman":
-        # Build orientation matrix
-        sampl_z = numpy.array(Q) / numpy.linalg.norm(
-            numpy.array(Q)
-        )  # assume scattering vector is z
-        sampl_x = n - sampl_z * numpy.dot(sampl_z, n) / numpy.linalg.norm(
-            n
-        )  # orthogonalize
-        sampl_x /= numpy.linalg.norm(sampl_x)  # nomalize
-
-        sampl_y = numpy.cross(sampl_z, sampl_x)
-        lab_to_lat = numpy.stack((sampl_x, sampl_y, sampl_z))
-    elif units == "poulsen":
-        lab_to_lat = numpy.identity(3)
-
-    # Calculate lab frame q vector for each pixel
-    k0 = numpy.array([k, 0, 0])  # Lab frame incidetn wavevector
-    twotheta = numpy.radians(twotheta)
-    eta = numpy.radians(eta)
-    kh = k * numpy.stack(
-        [
-            numpy.cos(twotheta),
-            numpy.sin(twotheta) * numpy.sin(eta),
-            numpy.sin(twotheta) * numpy.cos(eta),
-        ]
-    )  # Lab frame scattered wavevector
-    q = kh - k0[:, numpy.newaxis, numpy.newaxis]
-    if units == "gorfman":
-        q = q * a / 2 / numpy.pi
-    elif units == "poulsen":
-        q = q * a / 2 / numpy.pi / numpy.linalg.norm(Q)
-
-    # flatten to match syntax for histogramdd
-    q = q.reshape(3, img_shape[0] * img_shape[1])
-    # Rotate from lab frame to sample frame
-    theta_ref = numpy.arcsin(2 * numpy.pi * numpy.linalg.norm(Q) / a / k / 2)
-    q = numpy.stack(
-        [
-            q[0, ...] * numpy.cos(theta_ref) + q[2, ...] * numpy.sin(theta_ref),
-            q[1, ...],
-            q[2, ...] * numpy.cos(theta_ref) - q[0, ...] * numpy.sin(theta_ref),
-        ]
-    )
-
-    # Make histogram ranges
-    q_mean = numpy.mean(q, axis=1)
-    diffry_mean = numpy.radians(numpy.mean(diffry_values) - diffry_center)
-    q_mean = numpy.stack(
-        [
-            q_mean[0] * numpy.cos(diffry_mean) - q_mean[2] * numpy.sin(diffry_mean),
-            q_mean[1],
-            q_mean[2] * numpy.cos(diffry_mean) + q_mean[0] * numpy.sin(diffry_mean),
-        ]
-    )
-
-    if units == "gorfman":
-        q_mean = lab_to_lat.transpose() @ q_mean
-
-    ranges = (
-        (q_mean[0] - map_range, q_mean[0] + map_range),
-        (q_mean[1] - map_range, q_mean[1] + map_range),
-        (q_mean[2] - map_range, q_mean[2] + map_range),
-    )  # hkl units
-
-    # initialize sum arrays
-    sum_inte = numpy.zeros(map_shape)
-    sum_freq = numpy.zeros(map_shape)
-
-    loop = tqdm.tqdm(data)
-    # Loop through images
-    for i, image in enumerate(loop):
-        # read angle
-        diffry = numpy.radians(diffry_values[i] - diffry_center)
-        # rotate q back to zero-motor frame
-        q_rot = numpy.stack(
-            [
-                q[0, ...] * numpy.cos(diffry) - q[2, ...] * numpy.sin(diffry),
-                q[1, ...],
-                q[2, ...] * numpy.cos(diffry) + q[0, ...] * numpy.sin(diffry),
-            ]
-        )
-        # Rotate into lattice frame
-        q_rot = lab_to_lat.transpose() @ q_rot
-        # Do binning
-        sum_inte += numpy.histogramdd(
-            q_rot.transpose(), map_shape, ranges, weights=image.flatten()
-        )[0]
-        sum_freq += numpy.histogramdd(q_rot.transpose(), map_shape, ranges)[0]
-
-    edges = numpy.histogramdd(q_rot.transpose(), map_shape, ranges)[1]
-    # Setting sum_freq to NaN where it is 0 to avoid division by 0 (`arr` will be NaN there)
-    sum_freq[sum_freq == 0] = numpy.nan
-    arr = sum_inte / sum_freq
-
-    if units == "poulsen":
-        edges[2] = edges[2] - 1
-
-    return arr, edges
+    return RSMAccumulator(
+        diffry_values,
+        twotheta,
+        eta,
+        Q,
+        a,
+        map_range,
+        units=units,
+        map_shape=map_shape,
+        n=n,
+        E=E,
+        n_threads=n_threads,
+    ).compute(data)
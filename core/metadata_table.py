@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import logging
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+import numpy
+from silx.io import fabioh5
+
+_logger = logging.getLogger(__file__)
+
+POSITIONER_METADATA = fabioh5.FabioReader.POSITIONER
+
+
+class MetadataTable:
+    """
+    Columnar store of the positioner metadata of the frames of a scan.
+
+    Each positioner is stored as one array with a value per frame and a mask of the
+    frames where the value is missing. Static positioners (scalars) are stored once.
+
+    It behaves like a numpy array of per-frame metadata for indexing and reshaping
+    so that it can be sliced like the frames of a :class:`darfix.core.data.Data`,
+    while :meth:`values` returns the values of all selected frames at once.
+
+    :param columns: Values of each positioner (array with the shape of the scan)
+    :param missing: Mask of the missing values of each positioner (same keys as `columns`)
+    :param scalars: Value of each static positioner
+    :param keys: Names of the positioners defined for the scan, in order
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, numpy.ndarray],
+        missing: Dict[str, numpy.ndarray],
+        scalars: Dict[str, Any],
+        keys: List[str],
+        shape: Tuple[int, ...],
+    ):
+        self._columns = columns
+        self._missing = missing
+        self._scalars = scalars
+        self._keys = list(keys)
+        self._shape = tuple(shape)
+
+    @classmethod
+    def from_columns(
+        cls, datasets: Dict[str, numpy.ndarray | Any], nframes: int
+    ) -> MetadataTable:
+        """
+        Build the table from one dataset per positioner.
+
+        :param datasets: 1D array of values per frame or scalar for static positioners.
+            Values missing at the end of a 1D array are marked as missing.
+        :param nframes: Number of frames of the scan
+        """
+        columns = {}
+        missing = {}
+        scalars = {}
+        keys = []
+        for name, values in datasets.items():
+            if numpy.isscalar(values) or numpy.ndim(values) == 0:
+                scalars[name] = values
+                keys.append(name)
+                continue
+            values = numpy.asarray(values)[:nframes]
+            if len(values) == 0:
+                _logger.warning(f"No value for the dataset {name}")
+                continue
+            column_missing = numpy.zeros(nframes, dtype=bool)
+            if len(values) < nframes:
+                _logger.warning(
+                    f"Unable to access indices {len(values)} to {nframes - 1} of the dataset {name}"
+                )
+                column_missing[len(values) :] = True
+                padding = numpy.zeros(nframes - len(values), dtype=values.dtype)
+                values = numpy.concatenate((values, padding))
+            columns[name] = values
+            missing[name] = column_missing
+            keys.append(name)
+        return cls(columns, missing, scalars, keys, (nframes,))
+
+    @classmethod
+    def from_readers(cls, readers) -> MetadataTable:
+        """
+        Build the table from an array of per-frame metadata readers
+        (:class:`silx.io.fabioh5.EdfFabioReader` or any object with the same
+        `get_keys` and `get_value` methods).
+        """
+        readers = numpy.asarray(readers, dtype=object)
+        flat_readers = readers.ravel()
+        nframes = len(flat_readers)
+        keys = []
+        if nframes:
+            keys = list(flat_readers[0].get_keys(POSITIONER_METADATA))
+
+        per_frame_values: Dict[str, List[Any]] = {}
+        for frame_index, reader in enumerate(flat_readers):
+            for name in reader.get_keys(POSITIONER_METADATA):
+                value = reader.get_value(kind=POSITIONER_METADATA, name=name)
+                if isinstance(value, numpy.ndarray) and value.ndim > 0:
+                    # silx FabioReader returns an array of a single element
+                    value = value[0]
+                per_frame_values.setdefault(name, [None] * nframes)[frame_index] = value
+
+        columns = {}
+        missing = {}
+        for name, values in per_frame_values.items():
+            column_missing = numpy.array([value is None for value in values])
+            if column_missing.any():
+                default = next(value for value in values if value is not None)
+                values = [default if value is None else value for value in values]
+            columns[name] = numpy.asarray(values).reshape(readers.shape)
+            missing[name] = column_missing.reshape(readers.shape)
+        return cls(columns, missing, {}, keys, readers.shape)
+
+    @staticmethod
+    def is_metadata_readers(metadata) -> bool:
+        """Whether `metadata` is a non-empty array of per-frame metadata readers"""
+        flat_metadata = numpy.asarray(metadata, dtype=object).ravel()
+        return len(flat_metadata) > 0 and all(
+            hasattr(item, "get_keys") and hasattr(item, "get_value")
+            for item in flat_metadata
+        )
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._shape
+
+    @property
+    def size(self) -> int:
+        return int(numpy.prod(self._shape))
+
+    @property
+    def ndim(self) -> int:
+        return len(self._shape)
+
+    def __len__(self) -> int:
+        return self._shape[0]
+
+    def keys(self) -> List[str]:
+        """Names of the positioners of the first frame"""
+        if self.size == 0:
+            return []
+        return [
+            name
+            for name in self._keys
+            if name in self._scalars or not self._missing[name].flat[0]
+        ]
+
+    def values(
+        self,
+        key: str,
+        missing_value=numpy.nan,
+        take_previous_when_missing: bool = True,
+    ) -> numpy.ndarray | Any:
+        """
+        Values of the positioner `key` for all frames (flattened).
+
+        :param missing_value: Value of the frames without value for `key`
+        :param take_previous_when_missing: If True, frames without value take the value of
+            the previous frame (or `missing_value` if there is none).
+        :returns: 1D array of the values of each frame
+        """
+        if key in self._scalars:
+            return numpy.full(self.size, self._scalars[key])
+        if key not in self._columns:
+            if self.size:
+                _logger.warning(
+                    "Missing value(s) filled with %s for kind '%s' and key '%s'",
+                    missing_value,
+                    POSITIONER_METADATA,
+                    key,
+                )
+            return numpy.full(self.size, missing_value)
+
+        values = self._columns[key].ravel()
+        missing = self._missing[key].ravel()
+        if not missing.any():
+            return values.copy()
+
+        if take_previous_when_missing:
+            # Index of the last frame with a value, for each frame
+            last_defined = numpy.where(missing, 0, numpy.arange(len(values)))
+            numpy.maximum.accumulate(last_defined, out=last_defined)
+            leading_missing = numpy.logical_and.accumulate(missing)
+            values = values[last_defined]
+            _logger.warning(
+                "Missing value(s) filled to previous value for kind '%s' and key '%s'",
+                POSITIONER_METADATA,
+                key,
+            )
+        else:
+            leading_missing = missing
+            _logger.warning(
+                "Missing value(s) filled with %s for kind '%s' and key '%s'",
+                missing_value,
+                POSITIONER_METADATA,
+                key,
+            )
+        if leading_missing.any():
+            values = values.astype(numpy.result_type(values, missing_value))
+            values[leading_missing] = missing_value
+        return values
+
+    def _map(self, func) -> MetadataTable:
+        columns = {name: func(values) for name, values in self._columns.items()}
+        missing = {name: func(mask) for name, mask in self._missing.items()}
+        shape = func(numpy.empty(self._shape, dtype=bool)).shape
+        return MetadataTable(columns, missing, self._scalars, self._keys, shape)
+
+    def __getitem__(self, indices) -> MetadataTable | Dict[str, Any]:
+        if numpy.ndim(numpy.empty(self._shape, dtype=bool)[indices]) == 0:
+            # Single frame
+            frame = {
+                name: values[indices]
+                for name, values in self._columns.items()
+                if not self._missing[name][indices]
+            }
+            frame.update(self._scalars)
+            return frame
+        return self._map(lambda array: array[indices])
+
+    def __setitem__(self, indices, table: MetadataTable) -> None:
+        if set(table._columns) != set(self._columns) or table._scalars != (
+            self._scalars
+        ):
+            raise ValueError("Metadata tables must define the same positioners")
+        for name, values in table._columns.items():
+            self._columns[name][indices] = values
+            self._missing[name][indices] = table._missing[name]
+
+    def __iter__(self) -> Iterable[MetadataTable | Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MetadataTable):
+            return False
+        return (
+            self._shape == other._shape
+            and self._keys == other._keys
+            and self._scalars == other._scalars
+            and all(
+                numpy.array_equal(self._missing[name], other._missing[name])
+                and numpy.array_equal(values, other._columns[name])
+                for name, values in self._columns.items()
+            )
+        )
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"MetadataTable(shape={self._shape}, keys={self._keys})"
+
+    def copy(self) -> MetadataTable:
+        return self._map(numpy.copy)
+
+    def reshape(self, shape, order="C") -> MetadataTable:
+        return self._map(lambda array: array.reshape(shape, order=order))
+
+    def flatten(self) -> MetadataTable:
+        return self._map(lambda array: array.flatten())
+
+    def ravel(self) -> MetadataTable:
+        """Flattened table, with views of the columns when possible (no copy)"""
+        return self._map(numpy.ravel)
+
+    def take(self, indices, axis=None, out=None, mode="raise") -> MetadataTable:
+        return self._map(lambda array: numpy.take(array, indices, axis, mode=mode))
+
+    def swapaxes(self, axis1: int, axis2: int) -> MetadataTable:
+        return self._map(lambda array: numpy.swapaxes(array, axis1, axis2))
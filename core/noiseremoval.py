@@ -9,6 +9,10 @@ from silx.utils.enum import Enum as _Enum
 from ..dtypes import Dataset
 from .data import Operation
 from .dataset import ImageDataset
+from .imageOperations import background_subtraction_2D
+from .imageOperations import hot_pixel_removal_2D
+from .imageOperations import mask_removal
+from .imageOperations import threshold_removal
 
 
 class BackgroundType(_Enum):
@@ -53,23 +57,104 @@ def apply_noise_removal_operation(dataset: Dataset, operation: NoiseRemovalOpera
     return None
 
 
-def apply_background_subtraction(
-    dataset: Dataset, method=None, step=None, chunks=None, background_type=None
+def apply_noise_removal_operations(
+    dataset: Dataset, operations: list[NoiseRemovalOperation]
 ) -> ImageDataset | None:
+    """
+    Apply a list of noise removal operations to the dataset, reading and writing the data once.
+
+    The operations are compiled into a chain of functions applied to each image.
+    Background images are computed first, from the images processed by the previous operations
+    as when the operations are applied one after the other with :func:`apply_noise_removal_operation`.
+
+    :returns: The new dataset or None if the processing was stopped.
+    """
     darfix_dataset = dataset.dataset
+    funcs = []
+    operation_types = []
+    for operation in operations:
+        if operation["type"] == Operation.BS:
+            parameters = operation["parameters"]
+            bg = _compute_background_image(
+                dataset,
+                funcs,
+                method=parameters.get("method"),
+                step=parameters.get("step"),
+                background_type=parameters.get("background_type"),
+            )
+            if bg is None:
+                return None
+            funcs.append((background_subtraction_2D, [bg]))
+            operation_types.append(Operation.BS)
+
+        elif operation["type"] == Operation.HP:
+            kernel_size = operation["parameters"].get("kernel_size")
+            funcs.append(
+                (hot_pixel_removal_2D, [3 if kernel_size is None else kernel_size])
+            )
+            operation_types.append(Operation.HP)
+
+        elif operation["type"] == Operation.THRESHOLD:
+            funcs.append(
+                (
+                    threshold_removal,
+                    [
+                        operation["parameters"].get("bottom"),
+                        operation["parameters"].get("top"),
+                    ],
+                )
+            )
+            operation_types.append(Operation.THRESHOLD)
+
+        elif operation["type"] == Operation.MASK:
+            mask = operation["parameters"].get("mask")
+            if mask is not None and numpy.any(mask):
+                funcs.append((mask_removal, [mask]))
+                operation_types.append(Operation.MASK)
+
+    if not funcs:
+        return darfix_dataset
+    return darfix_dataset.apply_frame_functions(
+        funcs,
+        indices=dataset.indices,
+        operations=operation_types,
+    )
 
-    if method is None:
-        method = "median"
 
+def _get_background(dataset: Dataset, background_type=None):
     if background_type is not None:
         background_type = BackgroundType.from_value(background_type)
 
     if background_type == BackgroundType.DARK_DATA:
-        bg = dataset.bg_dataset
-    elif background_type == BackgroundType.UNUSED_DATA:
-        bg = dataset.bg_indices
-    else:
-        bg = None
+        return dataset.bg_dataset
+    if background_type == BackgroundType.UNUSED_DATA:
+        return dataset.bg_indices
+    return None
+
+
+def _compute_background_image(
+    dataset: Dataset, funcs, method=None, step=None, background_type=None
+) -> numpy.ndarray | None:
+    darfix_dataset = dataset.dataset
+    with darfix_dataset.state_of_operations.run_context(Operation.BS):
+        return darfix_dataset.compute_background_image(
+            background=_get_background(dataset, background_type),
+            method="median" if method is None else method,
+            indices=dataset.indices,
+            step=step,
+            funcs=funcs,
+        )
+
+
+def apply_background_subtraction(
+    dataset: Dataset, method=None, step=None, chunks=None, background_type=None
+) -> ImageDataset | None:
+    darfix_dataset = dataset.dataset
+
+    if method is None:
+        method = "median"
+
+    bg = _get_background(dataset, background_type)
 
     return darfix_dataset.apply_background_subtraction(
         indices=dataset.indices,
@@ -0,0 +1,136 @@
+"""
+Process-wide pool of worker processes shared by the parallel operations of darfix
+(rocking curves fit, moments, background subtraction...).
+
+The pool is started lazily on first use and reused by all the following operations
+so that worker processes are not spawned again for every operation or image chunk.
+Its size is defined by `darfix.config.NUMBER_OF_PROCESSES`.
+
+Input arrays can be handed to the workers through shared memory (:class:`SharedArray`)
+instead of being pickled with every task.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from multiprocessing.pool import Pool
+from typing import Generator
+from typing import Tuple
+
+import numpy
+
+import darfix
+
+_logger = logging.getLogger(__file__)
+
+SharedArrayDescriptor = Tuple[str, Tuple[int, ...], str]
+"""Name of the shared memory block, shape and dtype of a :class:`SharedArray`"""
+
+_pool: Pool | None = None
+_pool_size: int | None = None
+_pool_lock = threading.Lock()
+
+
+def get_number_of_processes() -> int:
+    """Number of worker processes of the pool, as defined by `darfix.config.NUMBER_OF_PROCESSES`"""
+    n_processes = darfix.config.NUMBER_OF_PROCESSES
+    if n_processes is None:
+        return max(1, multiprocessing.cpu_count() - 1)
+    return max(1, int(n_processes))
+
+
+def get_pool() -> Pool:
+    """
+    Return the process-wide pool of workers, starting it if needed.
+
+    The pool is restarted if the configured number of processes changed since it was started.
+    It must not be closed or terminated by the caller: use :func:`shutdown_pool` instead.
+    """
+    global _pool, _pool_size
+    with _pool_lock:
+        n_processes = get_number_of_processes()
+        if _pool is not None and _pool_size != n_processes:
+            _terminate_pool()
+        if _pool is None:
+            _logger.debug("Start pool of %d worker processes", n_processes)
+            _pool = multiprocessing.Pool(n_processes)
+            _pool_size = n_processes
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """Stop the worker processes of the pool. A new pool is started by the next :func:`get_pool` call."""
+    with _pool_lock:
+        _terminate_pool()
+
+
+def _terminate_pool() -> None:
+    global _pool, _pool_size
+    if _pool is None:
+        return
+    _pool.terminate()
+    _pool.join()
+    _pool = None
+    _pool_size = None
+
+
+atexit.register(shutdown_pool)
+
+
+class SharedArray:
+    """
+    Copy of a numpy array in shared memory that worker processes can access
+    from its :attr:`descriptor` with :func:`attach_shared_array`.
+
+    The shared memory is released by :meth:`close` or when leaving the context manager.
+    """
+
+    def __init__(self, data: numpy.ndarray):
+        data = numpy.asarray(data)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+        self.array = numpy.ndarray(data.shape, dtype=data.dtype, buffer=self._shm.buf)
+        self.array[...] = data
+
+    @property
+    def descriptor(self) -> SharedArrayDescriptor:
+        return self._shm.name, self.array.shape, self.array.dtype.str
+
+    def close(self) -> None:
+        if self._shm is None:
+            return
+        del self.array
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self) -> SharedArray:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+@contextmanager
+def attach_shared_array(
+    descriptor: SharedArrayDescriptor,
+) -> Generator[numpy.ndarray, None, None]:
+    """
+    Access the array of a :class:`SharedArray` from a worker process.
+
+    The array must not be used after leaving the context manager.
+    """
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    array = None
+    try:
+        array = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        yield array
+    finally:
+        # The view must be released before closing, even on error
+        del array
+        shm.close()
@@ -1,10 +1,9 @@
 from __future__ import annotations
 
-import multiprocessing
 from functools import partial
-from multiprocessing import Pool
 from numbers import Number
 from typing import Any
+from typing import Callable
 from typing import Generator
 from typing import List
 from typing import Tuple
@@ -15,10 +14,18 @@ import tqdm
 from silx.utils.enum import Enum as _Enum
 
 from ..io.utils import create_nxdata_dict
+from ..processing.batched_rocking_curves import fit_2d_rocking_curves_batched
+from ..processing.batched_rocking_curves import fit_rocking_curves_batched
 from ..processing.rocking_curves import FitMethod
 from ..processing.rocking_curves import fit_2d_rocking_curve
 from ..processing.rocking_curves import fit_rocking_curve
 from .data import Data
+from .mapping import compute_mean_and_std
+from .process_pool import SharedArray
+from .process_pool import SharedArrayDescriptor
+from .process_pool import attach_shared_array
+from .process_pool import get_number_of_processes
+from .process_pool import get_pool
 from .utils import NoDimensionsError
 from .utils import TooManyDimensionsForRockingCurvesError
 
@@ -50,6 +57,15 @@ class Maps_2D(_Enum):
 MAPS_1D: Tuple[Maps_1D] = Maps_1D.values()
 MAPS_2D: Tuple[Maps_2D] = Maps_2D.values()
 
+POOL_FIT_MAX_BATCH_SIZE = 1000
+"""Maximal number of rocking curves fitted by a worker process in one task."""
+
+BATCHED_FIT_BLOCK_SIZE = 16384
+"""Maximal number of rocking curves fitted together by the `batched` fit method."""
+
+BATCHED_FIT_MAX_BYTES = 2**28
+"""Memory budget of the jacobians of a block of rocking curves fitted by the `batched` fit method."""
+
 
 def generator(
     data: DataLike, moments: numpy.ndarray | None = None, indices=None
@@ -61,7 +77,7 @@ def generator(
     Generator that returns the rocking curve for every pixel
 
     :param ndarray data: data to analyse
-    :param moments: array of same shape as data with the moments values per pixel and image, optional
+    :param moments: array of shape (n_moments, data.shape[1], data.shape[2]) with the moments values per pixel, optional
     :type moments: Union[None, ndarray]
     """
     for i in range(data.shape[1]):
@@ -73,7 +89,72 @@ def generator(
                 new_data[indices] = data[indices, i, j]
             if moments is not None:
                 yield new_data, moments[:, i, j]
-            yield new_data, None
+            else:
+                yield new_data, None
+
+
+def _fit_pixels(
+    fit_pixel: Callable,
+    data_descriptor: SharedArrayDescriptor,
+    indices: Indices | None,
+    pixels_and_moments: Tuple[int, int, numpy.ndarray | None],
+) -> List[Tuple[numpy.ndarray, numpy.ndarray | list]]:
+    """Fit the rocking curves of a range of pixels of the shared data. Run by the worker processes."""
+    start, stop, moments = pixels_and_moments
+    with attach_shared_array(data_descriptor) as data:
+        block = numpy.array(data.reshape(len(data), 1, -1)[:, :, start:stop])
+    return [
+        fit_pixel(y_values)
+        for y_values in generator(
+            block, None if moments is None else moments[:, None, :], indices
+        )
+    ]
+
+
+def _fit_in_pool(
+    data: DataLike,
+    moments: numpy.ndarray | None,
+    indices: Indices | None,
+    fit_pixel: Callable,
+) -> Tuple[list, list]:
+    """
+    Fit the rocking curve of every pixel with `fit_pixel` in the worker processes of the shared pool.
+    The data is handed to the workers through shared memory, which then process ranges of pixels.
+    """
+    n_pixels = data.shape[1] * data.shape[2]
+    batch_size = max(
+        1,
+        min(
+            POOL_FIT_MAX_BATCH_SIZE,
+            n_pixels // (4 * get_number_of_processes()),
+        ),
+    )
+    if moments is not None:
+        moments = numpy.asarray(moments).reshape(len(moments), -1)
+    curves, maps = [], []
+    with SharedArray(data) as shared_data:
+        batches = (
+            (
+                start,
+                min(start + batch_size, n_pixels),
+                (
+                    None
+                    if moments is None
+                    else moments[:, start : min(start + batch_size, n_pixels)]
+                ),
+            )
+            for start in range(0, n_pixels, batch_size)
+        )
+        with tqdm.tqdm(total=n_pixels) as progress:
+            for results in get_pool().imap(
+                partial(_fit_pixels, fit_pixel, shared_data.descriptor, indices),
+                batches,
+            ):
+                for curve, pars in results:
+                    curves.append(list(curve))
+                    maps.append(list(pars))
+                progress.update(len(results))
+    return curves, maps
 
 
 def fit_data(
@@ -86,31 +167,84 @@ def fit_data(
     method: FitMethod | None = None,
 ):
     """Fit data in axis 0 of data"""
+    if method == "batched":
+        return _fit_data_batched(
+            data, values=values, int_thresh=int_thresh, moments=moments
+        )
 
-    g = generator(data, moments)
-    cpus = multiprocessing.cpu_count()
-    curves, maps = [], []
-    with Pool(cpus - 1) as p:
-        for curve, pars in tqdm.tqdm(
-            p.imap(
-                partial(
-                    fit_rocking_curve,
-                    x_values=values,
-                    int_thresh=int_thresh,
-                    method=method,
-                ),
-                g,
-            ),
-            total=data.shape[1] * data.shape[2],
-        ):
-            curves.append(list(curve))
-            maps.append(list(pars))
+    curves, maps = _fit_in_pool(
+        data,
+        moments,
+        None,
+        partial(
+            fit_rocking_curve,
+            x_values=values,
+            int_thresh=int_thresh,
+            method=method,
+        ),
+    )
 
     return numpy.array(curves).T.reshape(data.shape), numpy.array(maps).T.reshape(
         (4, data.shape[-2], data.shape[-1])
     )
 
 
+def _fit_by_blocks(
+    rocking_curves: numpy.ndarray,
+    moments: numpy.ndarray | None,
+    n_params: int,
+    fit_block: Callable,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Fit rocking curves of shape (n_points, n_pixels) by blocks of pixels with a vectorized fit function.
+
+    :param moments: starting values of shape (n_moments, n_pixels), optional
+    :param fit_block: function taking rocking curves of shape (n_curves, n_points) and the `moments`
+        keyword of shape (n_curves, n_moments), returning the fitted curves and
+        the parameters of shape (n_curves, n_params)
+    """
+    n_points, n_pixels = rocking_curves.shape
+    block_size = max(
+        1,
+        min(
+            BATCHED_FIT_BLOCK_SIZE,
+            BATCHED_FIT_MAX_BYTES // (n_points * n_params * rocking_curves.itemsize),
+        ),
+    )
+    curves = numpy.empty((n_points, n_pixels))
+    maps = numpy.empty((n_params, n_pixels))
+    with tqdm.tqdm(total=n_pixels) as progress:
+        for start in range(0, n_pixels, block_size):
+            stop = min(start + block_size, n_pixels)
+            block_curves, block_maps = fit_block(
+                rocking_curves[:, start:stop].T,
+                moments=None if moments is None else moments[:, start:stop].T,
+            )
+            curves[:, start:stop] = block_curves.T
+            maps[:, start:stop] = block_maps.T
+            progress.update(stop - start)
+    return curves, maps
+
+
+def _fit_data_batched(
+    data: DataLike,
+    values: List[numpy.ndarray] | numpy.ndarray | None = None,
+    int_thresh: Number | None = 15,
+    moments: numpy.ndarray | None = None,
+):
+    """Fit data in axis 0 of data by blocks of pixels with the vectorized solver"""
+    rocking_curves = numpy.asarray(data, dtype=numpy.float64).reshape(data.shape[0], -1)
+    curves, maps = _fit_by_blocks(
+        rocking_curves,
+        None if moments is None else moments.reshape(len(moments), -1),
+        len(MAPS_1D),
+        partial(fit_rocking_curves_batched, x_values=values, int_thresh=int_thresh),
+    )
+    return curves.reshape(data.shape), maps.reshape(
+        (len(MAPS_1D), data.shape[-2], data.shape[-1])
+    )
+
+
 def fit_2d_data(
     data: DataLike,
     values: List[numpy.ndarray] | numpy.ndarray,
@@ -121,25 +255,27 @@ def fit_2d_data(
     method: FitMethod | None = None,
 ):
     """Fit data in axis 0 of data"""
-    g = generator(data, moments, indices)
-    cpus = multiprocessing.cpu_count()
-    curves, maps = [], []
-    with Pool(cpus - 1) as p:
-        for curve, pars in tqdm.tqdm(
-            p.imap(
-                partial(
-                    fit_2d_rocking_curve,
-                    x_values=values,
-                    shape=shape,
-                    int_thresh=int_thresh,
-                    method=method,
-                ),
-                g,
-            ),
-            total=data.shape[-2] * data.shape[-1],
-        ):
-            curves.append(list(curve))
-            maps.append(list(pars))
+    if method == "batched":
+        return _fit_2d_data_batched(
+            data,
+            values=values,
+            shape=shape,
+            int_thresh=int_thresh,
+            indices=indices,
+            moments=moments,
+        )
+    curves, maps = _fit_in_pool(
+        data,
+        moments,
+        indices,
+        partial(
+            fit_2d_rocking_curve,
+            x_values=values,
+            shape=shape,
+            int_thresh=int_thresh,
+            method=method,
+        ),
+    )
 
     curves = numpy.array(curves).T
     if indices is not None:
@@ -149,6 +285,66 @@ def fit_2d_data(
     )
 
 
+def _fit_2d_data_batched(
+    data: DataLike,
+    values: List[numpy.ndarray] | numpy.ndarray,
+    shape: Tuple[int, int],
+    int_thresh: int | None = 15,
+    indices: Indices | None = None,
+    moments: numpy.ndarray | None = None,
+):
+    """Fit data in axis 0 of data by blocks of pixels with the vectorized solver"""
+    rocking_curves = numpy.asarray(data, dtype=numpy.float64).reshape(data.shape[0], -1)
+    if indices is not None:
+        # Frames that are not selected count as zeros, as in `generator`
+        selected = numpy.zeros(data.shape[0], dtype=bool)
+        selected[indices] = True
+        rocking_curves = rocking_curves.copy()
+        rocking_curves[~selected] = 0
+    curves, maps = _fit_by_blocks(
+        rocking_curves,
+        None if moments is None else moments.reshape(len(moments), -1),
+        len(MAPS_2D),
+        partial(
+            fit_2d_rocking_curves_batched,
+            x_values=values,
+            shape=shape,
+            int_thresh=int_thresh,
+        ),
+    )
+    if indices is not None:
+        curves = curves[indices]
+    return curves.reshape(data[indices].shape), maps.reshape(
+        (len(MAPS_2D), data.shape[-2], data.shape[-1])
+    )
+
+
+def compute_starting_values(
+    data: DataLike,
+    values: List[numpy.ndarray] | numpy.ndarray,
+    indices: Indices | None = None,
+) -> numpy.ndarray:
+    """
+    Compute the center of mass and the standard deviation of the rocking curve of every pixel
+    in one vectorized pass, to be used as starting values of the fit (`moments` argument of
+    `fit_data` and `fit_2d_data`).
+
+    :param data: stack of images of shape (n_frames, height, width)
+    :param values: motor values of each frame. A list of arrays for 2D rocking curves.
+    :param indices: indices of the frames to take into account, optional
+    :returns: array of shape (2 * n_dims, height, width): the means along each
+        dimension followed by the standard deviations along each dimension
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if values.ndim == 1:
+        values = values[numpy.newaxis]
+    if indices is not None:
+        data = data[indices]
+        values = values[:, indices]
+    means, stds = zip(*(compute_mean_and_std(v, data) for v in values))
+    return numpy.stack(means + stds)
+
+
 def generate_rocking_curves_nxdict(
     dataset,  # ImageDataset. Cannot type due to circular import
     maps: numpy.ndarray,
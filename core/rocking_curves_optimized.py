@@ -5,6 +5,7 @@ Optimized curve fitting implementation with batching and shared memory support.
 from __future__ import annotations
 
 import multiprocessing as mp
+from collections import deque
 from functools import partial
 from typing import Any, List, Tuple, Union, Optional
 import numpy as np
@@ -13,7 +14,8 @@ import psutil
 import tqdm
 
 from ..processing.rocking_curves import FitMethod, fit_rocking_curve, fit_2d_rocking_curve
-from .rocking_curves import Maps_1D, Maps_2D, Indices, DataLike, fit_2d_data
+from .rocking_curves import Maps_1D, Maps_2D, Indices, DataLike, fit_data, fit_2d_data
+from .process_pool import get_number_of_processes, get_pool
 
 # Determine optimal batch size based on system resources
 def get_optimal_batch_size(total_curves: int, data_shape: tuple) -> int:
@@ -64,7 +66,8 @@ def fit_batch_1d(args: Tuple[int, int, tuple, np.dtype, str, Optional[List[np.nd
         i = idx // data_shape[2]
         j = idx % data_shape[2]
         
-        curve_data = data[:, i, j]
+        # Copy: the results must not refer to the shared memory closed below
+        curve_data = np.array(data[:, i, j])
         curve, pars = fit_rocking_curve(
             (curve_data, None),
             x_values=values,
@@ -91,6 +94,10 @@ def fit_data_optimized(
 ) -> Tuple[np.ndarray, np.ndarray]:
     """Optimized version of fit_data with batching and shared memory."""
     
+    # The batched solver is vectorized over pixels and does not need worker processes
+    if method == "batched":
+        return fit_data(data, values=values, int_thresh=int_thresh, method=method)
+
     total_curves = data.shape[1] * data.shape[2]
     
     # For small datasets, use single-threaded approach
@@ -133,20 +140,18 @@ def fit_data_optimized(
                 method
             ))
         
-        # Process batches in parallel
-        cpus = mp.cpu_count() - 1
+        # Process batches in parallel in the shared pool of workers
         curves, maps = [], []
         
-        with mp.Pool(cpus) as pool:
-            # Use imap for progress tracking
-            for batch_results in tqdm.tqdm(
-                pool.imap(fit_batch_1d, batches),
-                total=len(batches),
-                desc="Fitting curves (batched)"
-            ):
-                for curve, pars in batch_results:
-                    curves.append(list(curve))
-                    maps.append(list(pars))
+        # Use imap for progress tracking
+        for batch_results in tqdm.tqdm(
+            get_pool().imap(fit_batch_1d, batches),
+            total=len(batches),
+            desc="Fitting curves (batched)"
+        ):
+            for curve, pars in batch_results:
+                curves.append(list(curve))
+                maps.append(list(pars))
         
         return np.array(curves).T.reshape(data.shape), np.array(maps).T.reshape(
             (4, data.shape[-2], data.shape[-1])
@@ -176,13 +181,15 @@ class BatchedCurveFitter:
         self.data = data
         self.kwargs = kwargs
         self._cancelled = mp.Event()
-        self._pool = None
         
     def cancel(self):
-        """Cancel the fitting operation."""
+        """
+        Cancel the fitting operation.
+
+        No more batches are submitted to the shared pool of workers: only the batches
+        already running are completed, the tasks of the other users of the pool are not affected.
+        """
         self._cancelled.set()
-        if self._pool:
-            self._pool.terminate()
             
     def fit(self, progress_callback=None) -> Tuple[np.ndarray, np.ndarray]:
         """Perform fitting with optional progress callback."""
@@ -195,29 +202,41 @@ class BatchedCurveFitter:
             batch_size = get_optimal_batch_size(total_curves, self.data.shape)
             batches = self._create_batches(total_curves, batch_size, shm.name)
             
-            cpus = mp.cpu_count() - 1
-            self._pool = mp.Pool(cpus)
+            pool = get_pool()
+            # Batches are submitted progressively so that cancelling leaves no task in the pool
+            max_pending = 2 * get_number_of_processes()
+            pending = deque()
+            batches = iter(batches)
             
             curves, maps = [], []
             completed = 0
             
             try:
-                for batch_results in self._pool.imap(fit_batch_1d, batches):
+                while not self._cancelled.is_set():
+                    while len(pending) < max_pending:
+                        batch = next(batches, None)
+                        if batch is None:
+                            break
+                        pending.append(pool.apply_async(fit_batch_1d, (batch,)))
+                    if not pending:
+                        break
+
+                    batch_results = pending.popleft().get()
                     if self._cancelled.is_set():
                         break
-                        
+
                     for curve, pars in batch_results:
                         curves.append(list(curve))
                         maps.append(list(pars))
-                    
+
                     completed += len(batch_results)
                     if progress_callback:
                         progress_callback(completed, total_curves)
-                        
             finally:
-                self._pool.close()
-                self._pool.join()
-                
+                # The running batches use the shared memory released below
+                for result in pending:
+                    result.wait()
+
             if self._cancelled.is_set():
                 raise InterruptedError("Fitting cancelled by user")
                 
@@ -336,8 +355,9 @@ def fit_2d_data_optimized(
     
     total_curves = data.shape[1] * data.shape[2]
     
-    # For small datasets, use original implementation
-    if use_single_thread_for_small and total_curves < 100:
+    # For small datasets, use original implementation.
+    # The batched solver is vectorized over pixels and does not need worker processes either.
+    if method == "batched" or (use_single_thread_for_small and total_curves < 100):
         return fit_2d_data(data, values, shape, moments, int_thresh, indices, method)
     
     # Create shared memory for data
@@ -362,19 +382,17 @@ def fit_2d_data_optimized(
                 method
             ))
         
-        # Process batches in parallel
-        cpus = mp.cpu_count() - 1
+        # Process batches in parallel in the shared pool of workers
         curves, maps = [], []
         
-        with mp.Pool(cpus) as pool:
-            for batch_results in tqdm.tqdm(
-                pool.imap(fit_batch_2d, batches),
-                total=len(batches),
-                desc="Fitting 2D curves (batched)"
-            ):
-                for curve, pars in batch_results:
-                    curves.append(list(curve))
-                    maps.append(list(pars))
+        for batch_results in tqdm.tqdm(
+            get_pool().imap(fit_batch_2d, batches),
+            total=len(batches),
+            desc="Fitting 2D curves (batched)"
+        ):
+            for curve, pars in batch_results:
+                curves.append(list(curve))
+                maps.append(list(pars))
         
         curves = np.array(curves).T
         if indices is not None:
@@ -1,18 +1,125 @@
 from __future__ import annotations
 
+import enum
 from typing import Tuple
 
 import numpy
+from silx.utils.enum import Enum as _Enum
 
 from ..dtypes import Dataset
 from .dataset import ImageDataset
+from .geneticShiftDetection import GeneticShiftDetection
+from .imageRegistration import random_search
+
+
+@enum.unique
+class ShiftRefinement(_Enum):
+    """
+    Optimizers refining the shift of each frame around a linear shift.
+    """
+
+    RANDOM = "random"
+    GENETIC = "genetic"
+
+
+def refine_shift(
+    data: numpy.ndarray,
+    n_shift: numpy.ndarray,
+    refinement: ShiftRefinement | str,
+    iterations: int = 100,
+    population_size: int = 20,
+    tol: float | None = None,
+    n_workers: int | None = None,
+) -> numpy.ndarray:
+    """
+    Refine the shift of each frame with a random search or a genetic algorithm.
+    The candidate shifts are scored in Fourier space, in parallel.
+
+    :param data: Stack of images.
+    :param n_shift: Shift of each frame (2 rows, y and x), for example a linear shift.
+    :param refinement: Optimizer to use.
+    :param iterations: Number of iterations of the random search or of generations
+        of the genetic algorithm.
+    :param population_size: Number of individuals of the genetic algorithm.
+    :param tol: If not None, the optimizer stops when the best score did not improve
+        by more than `tol` (relative) during 10 iterations.
+    :param n_workers: Number of candidates scored in parallel. If None, the number
+        of CPUs is used.
+    :returns: The refined shift of each frame.
+    """
+    refinement = ShiftRefinement.from_value(refinement)
+    n_shift = numpy.asarray(n_shift, dtype=numpy.float64)
+    if len(data) < 2 or not numpy.any(n_shift):
+        return n_shift
+    # Using shift from second image
+    sigma = abs(n_shift[:, 1] / 3)
+
+    if refinement == ShiftRefinement.RANDOM:
+        return random_search(
+            data,
+            n_shift,
+            iterations,
+            sigma=sigma,
+            shift_approach="fft",
+            n_workers=n_workers,
+            tol=tol,
+        )
+    ga = GeneticShiftDetection(data, n_shift, n_workers=n_workers)
+    ga.fit((0, 0), sigma, iterations, population_size, shift_approach="fft", tol=tol)
+    return n_shift + ga.support_
+
+
+def find_shift(
+    input_dataset: Dataset,
+    dimension_idx: int | None = None,
+    pyramid_levels: int = 0,
+) -> numpy.ndarray:
+    """
+    Find the linear shift between consecutive frames of a dataset.
+
+    :param input_dataset: Dataset whose shift is found.
+    :param dimension_idx: If not None, a shift is found for each value of this dimension.
+    :param pyramid_levels: If not 0, number of levels of the multi-resolution
+        shift detection. See :func:`darfix.core.imageRegistration.find_shift_pyramid`
+    :returns: The shift (y and x), or an array with the shift for each value
+        of the dimension, as expected by :func:`apply_shift`.
+    """
+    dataset = input_dataset.dataset
+    indices = input_dataset.indices
+
+    if dimension_idx is None:
+        n_shift = dataset.find_shift(indices=indices, pyramid_levels=pyramid_levels)
+        return n_shift[:, 1]
+
+    shifts = []
+    for n_shift in dataset.find_shift_along_dimension(
+        (dimension_idx,), indices=indices, pyramid_levels=pyramid_levels
+    ):
+        try:
+            shifts.append(n_shift[:, 1])
+        except (IndexError, TypeError):
+            # Less than 2 frames for this value of the dimension
+            shifts.append([0, 0])
+    return numpy.array(shifts)
 
 
 def apply_shift(
     input_dataset: Dataset,
     shift: Tuple[float, float] | numpy.ndarray,
     dimension_idx: int | None = None,
+    refinement: ShiftRefinement | str | None = None,
+    **refinement_options,
 ) -> ImageDataset:
+    """
+    Apply a linear shift to the frames of a dataset: frame ``i`` is shifted by ``i * shift``.
+
+    :param input_dataset: Dataset to shift.
+    :param shift: Shift between two consecutive frames (y and x).
+    :param dimension_idx: If not None, the shift is applied along this dimension.
+    :param refinement: If not None, the shift of each frame is refined
+        with this optimizer before being applied. Not supported with `dimension_idx`.
+    :param refinement_options: Options of the optimizer. See :func:`refine_shift`.
+    """
     if not isinstance(shift, numpy.ndarray):
         shift = numpy.array(shift)
 
@@ -20,6 +127,8 @@ def apply_shift(
     indices = input_dataset.indices
 
     if dimension_idx is not None:
+        if refinement is not None:
+            raise ValueError("Shift refinement is not supported along a dimension")
         return dataset.apply_shift_along_dimension(
             shift, dimension=(dimension_idx,), indices=indices
         )
@@ -27,4 +136,11 @@ def apply_shift(
     frames_indices = numpy.arange(dataset.get_data(indices).shape[0])
     # Cumulative shift: frame 0 shift is 0, frame 1 shift is `shift`, frame 2 shift is `2*shift`, ...
     cumulative_shift_per_frames = numpy.outer(shift, frames_indices)
+    if refinement is not None:
+        cumulative_shift_per_frames = refine_shift(
+            dataset.get_data(indices),
+            cumulative_shift_per_frames,
+            refinement,
+            **refinement_options,
+        )
     return dataset.apply_shift(cumulative_shift_per_frames, indices=indices)
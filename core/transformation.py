@@ -4,17 +4,105 @@ from numbers import Number
 
 import numpy
 
+from .roi import TwoDVector
+from .roi import apply_2D_ROI
+
+
+def _as_2d(array) -> numpy.ndarray:
+    array = numpy.asarray(array)
+    if array.ndim < 2:
+        array = array.reshape((1,) * (2 - array.ndim) + array.shape)
+    return array
+
 
 class Transformation:
+    """
+    Coordinates (x, y) of the pixels of the frames.
+
+    The coordinates can be given as arrays broadcastable to the shape of the frames:
+    separable axes are stored as a row and a column, and the dense arrays `x` and `y`
+    are read-only views of them (no copy).
+
+    :param kind: 'magnification' or 'rsm'
+    :param x: x coordinates, broadcastable to the shape (sy, sx) of the frames
+    :param y: y coordinates, broadcastable to the shape (sy, sx) of the frames
+    :param rotate: True if the images are displayed rotated by 90 degrees
+    """
+
     def __init__(self, kind: str, x: numpy.ndarray, y: numpy.ndarray, rotate: bool):
-        self.x = x  # shape (sy, sx)
-        self.y = y  # shape (sy, sx)
+        self._axes = (_as_2d(x), _as_2d(y))
         self.rotate = rotate
         self.kind = kind
+        self._dense = None
+
+    def _coordinates(self, *axes) -> tuple:
+        """Coordinates (x, y) of the pixels from the stored axes"""
+        return axes
+
+    def _from_axes(self, *axes) -> Transformation:
+        """Transformation of the same kind built from cropped axes"""
+        return Transformation(self.kind, *axes, self.rotate)
+
+    def _dense_coordinates(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        if self._dense is None:
+            dense = []
+            for coordinates in self._coordinates(*self._axes):
+                coordinates = numpy.broadcast_to(coordinates, self.shape)
+                coordinates.flags.writeable = False
+                dense.append(coordinates)
+            self._dense = tuple(dense)
+        return self._dense
+
+    @property
+    def x(self) -> numpy.ndarray:
+        """x coordinates of the pixels (read-only array of shape (sy, sx))"""
+        return self._dense_coordinates()[0]
+
+    @property
+    def y(self) -> numpy.ndarray:
+        """y coordinates of the pixels (read-only array of shape (sy, sx))"""
+        return self._dense_coordinates()[1]
+
+    def _pixel(self, row: int, column: int) -> tuple[Number, Number]:
+        """Coordinates (x, y) of one pixel, without computing the dense arrays"""
+        axes = [
+            numpy.broadcast_to(axis, self.shape)[row, column] for axis in self._axes
+        ]
+        return tuple(self._coordinates(*axes))
+
+    def crop(
+        self,
+        origin: TwoDVector | None = None,
+        size: TwoDVector | None = None,
+        center: TwoDVector | None = None,
+    ) -> Transformation:
+        """Transformation of a ROI of the frames (see :func:`darfix.core.roi.apply_2D_ROI`)"""
+        rows = apply_2D_ROI(
+            numpy.broadcast_to(numpy.arange(self.sy)[:, numpy.newaxis], self.shape),
+            origin,
+            size,
+            center,
+        )
+        columns = apply_2D_ROI(
+            numpy.broadcast_to(numpy.arange(self.sx), self.shape), origin, size, center
+        )
+        if rows.size == 0:
+            return self._from_axes(*(axis[:0, :0] for axis in self._axes))
+        rows = slice(rows[0, 0], rows[0, 0] + rows.shape[0])
+        columns = slice(columns[0, 0], columns[0, 0] + columns.shape[1])
+        return self._from_axes(
+            *(
+                axis[
+                    rows if axis.shape[0] > 1 else slice(None),
+                    columns if axis.shape[1] > 1 else slice(None),
+                ]
+                for axis in self._axes
+            )
+        )
 
     @property
     def shape(self) -> tuple[int, int]:
-        return self.x.shape
+        return numpy.broadcast_shapes(*(axis.shape for axis in self._axes))
 
     @property
     def sx(self) -> int:
@@ -38,26 +126,50 @@ class Transformation:
 
     @property
     def xorigin(self) -> Number:
-        return self.x[0][0]
+        return self._pixel(0, 0)[0]
 
     @property
     def yorigin(self) -> Number:
-        return self.y[0][0]
+        return self._pixel(0, 0)[1]
 
     @property
     def origin(self) -> tuple[Number, Number]:
-        return self.xorigin, self.yorigin
+        return self._pixel(0, 0)
 
     @property
     def xscale(self) -> Number:
-        x = self.x
-        return (x[-1][-1] - x[0][0]) / self.sx
+        return (self._pixel(-1, -1)[0] - self.xorigin) / self.sx
 
     @property
     def yscale(self) -> Number:
-        y = self.y
-        return (y[-1][-1] - y[0][0]) / self.sy
+        return (self._pixel(-1, -1)[1] - self.yorigin) / self.sy
 
     @property
     def scale(self) -> tuple[Number, Number]:
         return self.xscale, self.yscale
+
+
+class RSMTransformation(Transformation):
+    """
+    Azimuthal coordinates (eta, 2theta) in degrees of the pixels, computed from the
+    separable coordinates of the pixels on the detector.
+
+    The dense arrays `x` (eta) and `y` (2theta) are only computed when accessed.
+
+    :param y: horizontal coordinates on the detector, broadcastable to the shape of the frames
+    :param z: vertical coordinates on the detector, broadcastable to the shape of the frames
+    :param mainx: motor 'mainx' value (distance to the detector)
+    :param rotate: True if the images are displayed rotated by 90 degrees
+    """
+
+    def __init__(self, y: numpy.ndarray, z: numpy.ndarray, mainx: float, rotate: bool):
+        super().__init__("rsm", y, z, rotate)
+        self._mainx = mainx
+
+    def _coordinates(self, y, z) -> tuple:
+        eta = numpy.arctan2(y, z)
+        twotheta = numpy.arctan2(numpy.sqrt(y * y + z * z), self._mainx)
+        return numpy.degrees(eta), numpy.degrees(twotheta)
+
+    def _from_axes(self, y, z) -> RSMTransformation:
+        return RSMTransformation(y, z, self._mainx, self.rotate)
@@ -1,4 +1,8 @@
+from __future__ import annotations
+
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 
@@ -22,6 +26,44 @@ class TooManyDimensionsForRockingCurvesError(ValueError):
         )
 
 
+class ThreadedOperation:
+    """
+    Base class of the operations using a pool of threads, started on first use
+    and stopped by :meth:`close` or when leaving the context manager.
+
+    :param n_threads: Number of threads. If None, the number of CPUs is used.
+    :param thread_name_prefix: Prefix of the names of the threads
+    """
+
+    def __init__(self, n_threads: int | None, thread_name_prefix: str):
+        if n_threads is None:
+            n_threads = os.cpu_count() or 1
+        self.n_threads = max(int(n_threads), 1)
+        self._thread_name_prefix = thread_name_prefix
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Pool of `n_threads` threads"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.n_threads, thread_name_prefix=self._thread_name_prefix
+            )
+        return self._executor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the threads"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 def wrapTo2pi(x):
     """
     Python implementation of Matlab method `wrapTo2pi`.
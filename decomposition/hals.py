@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import logging
+
+from .nmf import _EPSILON
+from .nmf import NMF
+
+_logger = logging.getLogger(__file__)
+
+
+class HALSNMF(NMF):
+    """
+    Non-Negative Matrix Factorization by hierarchical alternating least squares
+    (Cichocki and Phan, `Fast local algorithms for large scale nonnegative matrix and
+    tensor factorizations`, https://doi.org/10.1587/transfun.E92.A.708).
+
+    Each column of W and each row of H is in turn set to the non-negative solution of its
+    least squares problem, the other ones being fixed. It usually converges in much fewer
+    iterations than the multiplicative updates of :class:`NMF`, whose interface (warm
+    start, blocked reads of the data in a single pass per iteration, error tracking and
+    convergence-based stopping) it shares.
+    """
+
+    def _update_w_block(self, W_block, VHt, HHt):
+        for j in range(W_block.shape[1]):
+            W_block[:, j] += (VHt[:, j] - W_block @ HHt[:, j]) / (HHt[j, j] + _EPSILON)
+            W_block[W_block[:, j] < _EPSILON, j] = _EPSILON
+
+    def _update_h(self, WtV, WtW):
+        H = self.H
+        for j in range(H.shape[0]):
+            H[j] += (WtV[j] - WtW[j] @ H) / (WtW[j, j] + _EPSILON)
+            H[j, H[j] < _EPSILON] = _EPSILON
@@ -0,0 +1,89 @@
+"""
+Matrix views of a stack of frames for the decomposition methods: the frames are the rows
+of the matrix and the pixels its columns.
+
+The decomposition classes accept any object with a `shape` (n_frames, n_pixels), a
+`len` and numpy-like indexing of the rows (index, slice or array of indices) and of a
+slice of columns: a numpy array (e.g. a reshaped view of the frames in memory), a 2D
+HDF5 dataset or a :class:`FlattenedStack`.
+"""
+
+from __future__ import annotations
+
+import h5py
+import numpy
+
+
+class FlattenedStack:
+    """
+    Matrix view of frames of a 3D HDF5 dataset, flattened on the fly when read.
+
+    Only the rows of the frames covering the requested columns are read.
+
+    :param dataset: HDF5 dataset of shape (n, height, width)
+    :param frame_indices: Indices in `dataset` of the frames (rows of the matrix).
+        If None, all the frames of the dataset.
+    """
+
+    def __init__(
+        self, dataset: h5py.Dataset, frame_indices: numpy.ndarray | None = None
+    ):
+        if dataset.ndim != 3:
+            raise ValueError(f"Expected a 3D dataset of frames. Got {dataset.shape}")
+        self._dataset = dataset
+        if frame_indices is None:
+            frame_indices = numpy.arange(len(dataset))
+        self._frame_indices = numpy.asarray(frame_indices, dtype=numpy.intp)
+        self._width = dataset.shape[2]
+        self.shape = (len(self._frame_indices), dataset.shape[1] * self._width)
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        return self._dataset.dtype
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> numpy.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2:
+            raise IndexError("Too many indices for a matrix")
+        columns = key[1] if len(key) == 2 else slice(None)
+        if not isinstance(columns, slice):
+            raise TypeError("Only slices of columns are supported")
+
+        frame_indices = self._frame_indices[key[0]]
+        single_row = numpy.ndim(frame_indices) == 0
+        frame_indices = numpy.atleast_1d(frame_indices)
+
+        start, stop, step = columns.indices(self.shape[1])
+        if step < 0 or stop <= start or len(frame_indices) == 0:
+            flat = numpy.empty((len(frame_indices), 0), dtype=self.dtype)
+        else:
+            first_row = start // self._width
+            last_row = -(-stop // self._width)
+            frames = self._read(frame_indices, slice(first_row, last_row))
+            offset = first_row * self._width
+            flat = frames.reshape(len(frame_indices), -1)[
+                :, start - offset : stop - offset : step
+            ]
+        return flat[0] if single_row else flat
+
+    def _read(self, frame_indices: numpy.ndarray, rows: slice) -> numpy.ndarray:
+        # h5py requires increasing indices: read each frame once and reorder afterwards
+        unique_indices, inverse = numpy.unique(frame_indices, return_inverse=True)
+        if unique_indices[-1] - unique_indices[0] + 1 == len(unique_indices):
+            selection = slice(unique_indices[0], unique_indices[-1] + 1)
+        else:
+            selection = unique_indices
+        frames = self._dataset[selection, rows]
+        if len(unique_indices) == len(frame_indices) and numpy.all(
+            frame_indices[:-1] < frame_indices[1:]
+        ):
+            return frames
+        return frames[inverse]
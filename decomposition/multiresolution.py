@@ -0,0 +1,185 @@
+"""
+Multiresolution ("waterfall") initialization of the non-negative matrix factorization.
+
+The frames are block-averaged at several binning factors (powers of 2) in a single read.
+The block-averaged frames are kept in memory or, if they do not fit in
+`darfix.config.WATERFALL_MAX_NBYTES`, saved in a temporary HDF5 file.
+The NMF is computed from the coarsest level to the finest one: W is kept between the
+levels and the components H are upsampled by repeating their pixels, which is consistent
+with the block averaging (the block average of the upsampled components are the coarse
+components).
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from contextlib import ExitStack
+from typing import Iterable
+from typing import Sequence
+from typing import Tuple
+
+import h5py
+import numpy
+
+import darfix
+
+from ..io.hdf5 import ChunkLayout
+from ..io.hdf5 import create_stack_dataset
+from .nmf import NMF
+
+
+def block_average(frame: numpy.ndarray, factor: int) -> numpy.ndarray:
+    """
+    Average of the blocks of `factor` x `factor` pixels of a frame.
+    The blocks on the bottom and right edges can be smaller.
+    """
+    height, width = frame.shape
+    rows = numpy.arange(0, height, factor)
+    columns = numpy.arange(0, width, factor)
+    sums = numpy.add.reduceat(
+        numpy.add.reduceat(frame, rows, axis=0, dtype=numpy.float64), columns, axis=1
+    )
+    counts = numpy.outer(
+        numpy.diff(numpy.append(rows, height)),
+        numpy.diff(numpy.append(columns, width)),
+    )
+    return sums / counts
+
+
+def binned_shape(frame_shape: Tuple[int, int], factor: int) -> Tuple[int, int]:
+    """Shape of the frames block-averaged by `factor`"""
+    return tuple(-(-size // factor) for size in frame_shape)
+
+
+def build_pyramid(
+    frames: Iterable[numpy.ndarray],
+    n_frames: int,
+    frame_shape: Tuple[int, int],
+    factors: Sequence[int],
+    dtype=numpy.float64,
+    group: h5py.Group | None = None,
+) -> list[numpy.ndarray | h5py.Dataset]:
+    """
+    Block-averaged frames at each binning factor, computed in a single read of the frames.
+
+    :param group: If not None, the matrices are saved as datasets of this HDF5 group
+        instead of being kept in memory.
+    :returns: For each factor, a matrix of shape (n_frames, n_pixels) with the flattened
+        block-averaged frames in the rows
+    """
+    shapes = [
+        (n_frames, int(numpy.prod(binned_shape(frame_shape, factor))))
+        for factor in factors
+    ]
+    if group is None:
+        levels = [numpy.empty(shape, dtype) for shape in shapes]
+    else:
+        levels = [
+            create_stack_dataset(
+                group, f"level_{factor}", shape, dtype, auto_layout=ChunkLayout.FRAME
+            )
+            for factor, shape in zip(factors, shapes)
+        ]
+    for i, frame in enumerate(frames):
+        for level, factor in zip(levels, factors):
+            level[i] = block_average(numpy.asarray(frame), factor).ravel()
+    return levels
+
+
+def upsample_components(
+    H: numpy.ndarray,
+    coarse_shape: Tuple[int, int],
+    fine_shape: Tuple[int, int],
+    ratio: int,
+) -> numpy.ndarray:
+    """
+    Upsample the flattened components by repeating each pixel `ratio` x `ratio` times.
+
+    :param H: Components of shape (n_components, coarse pixels)
+    :param coarse_shape: Shape of the components
+    :param fine_shape: Shape of the upsampled components
+    :param ratio: Ratio between the binning factors of the coarse and fine components
+    """
+    rows = numpy.arange(fine_shape[0]) // ratio
+    columns = numpy.arange(fine_shape[1]) // ratio
+    H = H.reshape((len(H),) + tuple(coarse_shape))
+    return H[:, rows[:, numpy.newaxis], columns].reshape(len(H), -1)
+
+
+def pyramid_nbytes(
+    n_frames: int, frame_shape: Tuple[int, int], factors: Sequence[int], dtype
+) -> int:
+    """Number of bytes of the block-averaged frames returned by :func:`build_pyramid`"""
+    n_pixels = sum(numpy.prod(binned_shape(frame_shape, factor)) for factor in factors)
+    return int(n_frames * n_pixels * numpy.dtype(dtype).itemsize)
+
+
+def multiresolution_nmf(
+    frames: Iterable[numpy.ndarray],
+    n_frames: int,
+    frame_shape: Tuple[int, int],
+    num_components: int | None,
+    iterations: Sequence[int],
+    model_class=NMF,
+    vstep: int = 100,
+    dtype=None,
+    tol: float | None = None,
+    max_nbytes: int | None = None,
+    tmp_dir: str | None = None,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Compute the NMF of the frames at decreasing binning factors (2**n, ..., 2), each level
+    starting from the result of the previous one.
+
+    :param frames: Frames to decompose, read once
+    :param n_frames: Number of frames
+    :param frame_shape: Shape of the frames
+    :param num_components: Number of components
+    :param iterations: Number of iterations of each level, from the coarsest one.
+        The number of levels is the length of `iterations`.
+    :param model_class: NMF solver (:class:`darfix.decomposition.nmf.NMF` or a subclass)
+    :param vstep: Number of full resolution frames per block
+    :param dtype: Type of the computation
+    :param tol: Tolerance of the convergence-based stopping of each level
+    :param max_nbytes: Memory budget of the block-averaged frames. If they do not fit,
+        they are saved in a temporary HDF5 file.
+        If None, `darfix.config.WATERFALL_MAX_NBYTES` is used.
+    :param tmp_dir: Directory of the temporary HDF5 file.
+        If None, the default temporary directory is used.
+    :returns: (H, W): The components at full resolution and the mixing matrix,
+        to initialize the NMF of the frames
+    """
+    n_levels = len(iterations)
+    factors = [2 ** (n_levels - i) for i in range(n_levels)]
+    pyramid_dtype = numpy.float64 if dtype is None else dtype
+    if max_nbytes is None:
+        max_nbytes = darfix.config.WATERFALL_MAX_NBYTES
+
+    with ExitStack() as stack:
+        group = None
+        if pyramid_nbytes(n_frames, frame_shape, factors, pyramid_dtype) > max_nbytes:
+            directory = stack.enter_context(tempfile.TemporaryDirectory(dir=tmp_dir))
+            group = stack.enter_context(
+                h5py.File(os.path.join(directory, "pyramid.h5"), "w")
+            )
+        levels = build_pyramid(
+            frames, n_frames, frame_shape, factors, pyramid_dtype, group=group
+        )
+
+        H = W = None
+        for i, (factor, level, max_iter) in enumerate(zip(factors, levels, iterations)):
+            model = model_class(level, num_components, dtype=dtype)
+            model.fit_transform(
+                H=H, W=W, max_iter=max_iter, vstep=vstep * factor**2, tol=tol
+            )
+            num_components = model.num_components
+            next_factor = factors[i + 1] if i + 1 < n_levels else 1
+            H = upsample_components(
+                model.H,
+                binned_shape(frame_shape, factor),
+                binned_shape(frame_shape, next_factor),
+                factor // next_factor,
+            )
+            W = model.W
+    return H, W
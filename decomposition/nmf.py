@@ -5,11 +5,29 @@ __date__ = "06/04/2020"
 import logging
 
 import numpy
+from silx.utils.enum import Enum as _Enum
+
+from darfix.io import utils
 
 from .base import Base
 
 _logger = logging.getLogger(__file__)
 
+_EPSILON = 10**-9
+"""Added to the denominators of the updates"""
+
+
+class NMFSolver(_Enum):
+    """
+    Solvers of the non-negative matrix factorization
+    """
+
+    MU = "mu"
+    """Multiplicative updates (:class:`NMF`)"""
+
+    HALS = "hals"
+    """Hierarchical alternating least squares (:class:`darfix.decomposition.hals.HALSNMF`)"""
+
 
 class NMF(Base):
     """
@@ -17,60 +35,108 @@ class NMF(Base):
 
     Find two non-negative matrices whose product approximates the non-negative
     matrix data.
+
+    Each iteration reads the data once, by blocks of rows (images): the rows of W of a
+    block are updated, then the block contributes with the updated W to the products
+    `W.T @ data` and `W.T @ W` used to update H at the end of the iteration. The squared
+    Frobenius error is derived from the same products with the trace identity
+    ||V - WH||² = ||V||² - 2 tr(H.T W.T V) + tr(W.T W H H.T).
+
+    :param dtype: Type of the computation (float64 or float32), defaults to float64
     """
 
+    def __init__(
+        self, data, num_components=None, indices=None, epsilon=1e-7, dtype=None
+    ):
+        Base.__init__(
+            self, data, num_components=num_components, indices=indices, epsilon=epsilon
+        )
+        self._dtype = numpy.dtype(numpy.float64 if dtype is None else dtype)
+        self._squared_norm = None
+
     def _init_w(self):
         if self.W is None:
             Base._init_w(self)
-        self.W = numpy.abs(self.W)
+        self.W = numpy.abs(self.W).astype(self._dtype)
 
     def _init_h(self):
         if self.H is None:
             Base._init_h(self)
-        self.H = numpy.abs(self.H)
-
-    def _update_h(self):
-        _logger.info("Updating H")
-        V, W, H = self.data, self.W, self.H
-        if self.indices is None:
-            for column in range(0, self.H.shape[1], self._hstep):
-                mult = numpy.matmul(W.T, V[:, column : column + self._hstep]) / (
-                    numpy.matmul(
-                        numpy.matmul(W.T, W), H[:, column : column + self._hstep]
-                    )
-                    + 10**-9
-                )
-                self.H[:, column : column + self._hstep] *= mult
-        else:
-            for column in range(0, self.H.shape[1], self._hstep):
-                mult = numpy.matmul(
-                    W.T, V[self.indices, column : column + self._hstep]
-                ) / (
-                    numpy.matmul(
-                        numpy.matmul(W.T, W), H[:, column : column + self._hstep]
-                    )
-                    + 10**-9
-                )
-                self.H[:, column : column + self._hstep] *= mult
-
-    def _update_w(self):
-        _logger.info("Updating W")
-        V, W, H = self.data, self.W, self.H
-        if self.indices is None:
-            for row in range(0, len(self.W), self._vstep):
-                mult = numpy.matmul(V[row : row + self._vstep], H.T) / (
-                    numpy.matmul(numpy.matmul(W[row : row + self._vstep], H), H.T)
-                    + 10**-9
-                )
-                self.W[row : row + self._vstep] *= mult
-        else:
-            for row in range(0, len(self.W), self._vstep):
-                indx = self.indices[row : row + self._vstep]
-                mult = numpy.matmul(V[indx], H.T) / (
-                    numpy.matmul(numpy.matmul(W[row : row + self._vstep], H), H.T)
-                    + 10**-9
-                )
-                self.W[row : row + self._vstep] *= mult
+        self.H = numpy.abs(self.H).astype(self._dtype)
+
+    def _block_size(self, vstep: int) -> int:
+        """Number of rows per block, aligned with the chunks of an HDF5 dataset"""
+        chunks = getattr(self.data, "chunks", None)
+        if chunks and chunks[0] > 1:
+            return max(vstep // chunks[0], 1) * chunks[0]
+        return max(vstep, 1)
+
+    def _iter_blocks(self, block_size: int):
+        """Blocks of rows of the data with their position in W"""
+        indices = numpy.asarray(self.indices)
+        contiguous = numpy.array_equal(indices, numpy.arange(self.num_samples))
+        for start in range(0, self.num_samples, block_size):
+            stop = min(start + block_size, self.num_samples)
+            if contiguous:
+                block = self.data[start:stop]
+            else:
+                block = self.data[list(indices[start:stop])]
+            yield slice(start, stop), numpy.asarray(block, dtype=self._dtype)
+
+    def _update_w_block(self, W_block, VHt, HHt):
+        """
+        Update in place the rows `W_block` of W.
+
+        :param VHt: Product of the rows of the data by H.T
+        :param HHt: H @ H.T
+        """
+        W_block *= VHt / (W_block @ HHt + _EPSILON)
+
+    def _update_h(self, WtV, WtW):
+        """
+        Update H in place.
+
+        :param WtV: W.T @ data
+        :param WtW: W.T @ W
+        """
+        self.H *= WtV / (WtW @ self.H + _EPSILON)
+
+    def _iterate(self, block_size, compute_w, compute_h, compute_error):
+        """
+        One iteration of the multiplicative updates in a single read of the data.
+
+        :returns: The squared Frobenius error after the iteration if `compute_error`, else None
+        """
+        W, H = self.W, self.H
+        HHt = H @ H.T
+        accumulate = compute_h or compute_error
+        if accumulate:
+            WtV = numpy.zeros_like(H)
+            WtW = numpy.zeros_like(HHt)
+        squared_norm = 0.0
+        need_norm = compute_error and self._squared_norm is None
+
+        for rows, block in self._iter_blocks(block_size):
+            if compute_w:
+                self._update_w_block(W[rows], block @ H.T, HHt)
+            if accumulate:
+                WtV += W[rows].T @ block
+                WtW += W[rows].T @ W[rows]
+            if need_norm:
+                squared_norm += numpy.sum(numpy.square(block), dtype=numpy.float64)
+
+        if compute_h:
+            self._update_h(WtV, WtW)
+        if need_norm:
+            self._squared_norm = squared_norm
+        if not compute_error:
+            return None
+        error = (
+            self._squared_norm
+            - 2 * numpy.sum(WtV * H, dtype=numpy.float64)
+            + numpy.sum(WtW * (H @ H.T), dtype=numpy.float64)
+        )
+        return max(float(error), 0.0)
 
     def fit_transform(
         self,
@@ -82,10 +148,14 @@ class NMF(Base):
         vstep=100,
         hstep=1000,
         error_step=None,
+        tol=None,
     ):
         """
-        Find the two non-negative matrices (H, W) using Lee and Seung's multiplicative update rule (https://proceedings.neurips.cc/paper/2000/file/f9d1152547c0bde01830b7e8bd60024c-Paper.pdf).
-        The images are loaded from disk in chunks.
+        Find the two non-negative matrices (H, W) by alternating updates of W and H
+        (:meth:`_update_w_block` and :meth:`_update_h`): Lee and Seung's multiplicative
+        update rule (https://proceedings.neurips.cc/paper/2000/file/f9d1152547c0bde01830b7e8bd60024c-Paper.pdf)
+        for :class:`NMF`, the rules of the solver for its subclasses.
+        The images are loaded from disk in blocks, once per iteration.
 
         :param H: If not None, used as initial guess for the solution.
         :type H: array_like, shape (n_components, n_features), optional
@@ -98,31 +168,56 @@ class NMF(Base):
         :type compute_w: bool, optional
         :param compute_h: If False, H is not computes.
         :type compute_h: bool, optional
-        :param vstep: vertical size of the chunks to take from data.
-            When updating W, `vstep` images are retrieved from disk per iteration,
+        :param vstep: vertical size of the blocks to take from data.
+            `vstep` images (rounded to the HDF5 chunks) are retrieved from disk at once,
             defaults to 100.
         :type vstep: int, optional
-        :param hstep: horizontal size of the chunks to take from fata.
-            When updating H, `hstep` pixels are retrieved from disk per iteration,
-            defaults to 1000.
+        :param hstep: Not used: the images are read in blocks of full rows.
         :type hstep: int, optional
-        :param error_step: If None, error is not computed, else compute error for
-            every `error_step` iterations.
+        :param error_step: If None, error is not computed, else compute the squared
+            Frobenius error every `error_step` iterations.
         :type error_step: Union[None,int], optional
+        :param tol: If not None, stop when the decrease of the error during an iteration,
+            relative to the error after the first iteration, is below `tol`. The error is
+            then computed at each iteration (without additional read of the data).
+        :type tol: Union[None,float], optional
         """
 
         self.H = H
         self.W = W
-        self._vstep = vstep
-        self._hstep = hstep
+        self.ferr = []
+        block_size = self._block_size(vstep)
 
         _logger.info("Starting NMF algorithm")
 
-        Base.fit_transform(
-            self,
-            max_iter=max_iter,
-            error_step=error_step,
-            compute_w=compute_w,
-            compute_h=compute_h,
-            norm="squared_frobenius",
-        )
+        if compute_w:
+            self._init_w()
+        if compute_h:
+            self._init_h()
+        self.W = numpy.asarray(self.W, dtype=self._dtype)
+        self.H = numpy.asarray(self.H, dtype=self._dtype)
+
+        if max_iter > 1:
+            utils.advancement_display(0, max_iter, "Updating decomposition matrices")
+
+        first_error = previous_error = None
+        for i in range(max_iter):
+            record_error = bool(error_step) and not i % error_step
+            error = self._iterate(
+                block_size, compute_w, compute_h, record_error or tol is not None
+            )
+            if record_error:
+                self.ferr.append(error)
+                if i > error_step and self._converged(int(i / error_step)):
+                    break
+            if tol is not None:
+                if first_error is None:
+                    first_error = error
+                elif previous_error - error <= tol * first_error:
+                    _logger.info("NMF converged after %d iterations", i + 1)
+                    break
+                previous_error = error
+            if max_iter > 1:
+                utils.advancement_display(
+                    i + 1, max_iter, "Updating decomposition matrices"
+                )
@@ -0,0 +1,153 @@
+"""
+Principal component analysis by randomized singular value decomposition
+(Halko, Martinsson and Tropp, `Finding structure with randomness`, https://arxiv.org/abs/0909.4061).
+"""
+
+from __future__ import annotations
+
+import numpy
+from silx.utils.enum import Enum as _Enum
+
+from darfix.io import utils
+
+from .base import Base
+
+
+class PCASolver(_Enum):
+    """
+    Solvers of the principal component analysis
+    """
+
+    FULL = "full"
+    """Full SVD in memory (scikit-learn), incremental PCA for data on disk"""
+
+    RANDOMIZED = "randomized"
+    """Randomized SVD with a few passes over the data, in memory or on disk"""
+
+
+class RandomizedPCA(Base):
+    """
+    Compute the first principal components of the (centered) data with a randomized SVD.
+
+    A random projection of the data on `num_components + oversampling` vectors finds an
+    approximate basis of the range of the data, refined by power iterations. The data is
+    only read by chunks of rows: the computation takes `2 * power_iterations + 2` passes
+    over the data.
+
+    The results are the ones of :class:`sklearn.decomposition.PCA`: `H` holds the
+    components (shape (num_components, num_features)), `W` the projection of the
+    samples on the components (shape (num_samples, num_components)).
+
+    :param data: array of shape (n_samples, n_features), in memory or on disk
+    :param num_components: Number of components to keep, defaults to None
+    :param indices: The indices of the samples to use, defaults to None
+    :param oversampling: Number of additional random vectors of the projection
+    :param power_iterations: Number of power iterations. Increase it for data
+        with a slowly decaying spectrum.
+    :param chunk_size: Number of samples read at once
+    :param random_state: Seed or random state of the random projection
+    """
+
+    def __init__(
+        self,
+        data,
+        num_components=None,
+        indices=None,
+        oversampling: int = 10,
+        power_iterations: int = 2,
+        chunk_size: int = 500,
+        random_state=None,
+    ):
+        Base.__init__(self, data, num_components=num_components, indices=indices)
+        self._num_components = min(
+            self._num_components, self.num_samples, self.num_features
+        )
+        self._oversampling = max(int(oversampling), 0)
+        self._power_iterations = max(int(power_iterations), 0)
+        self._chunk_size = max(int(chunk_size), 1)
+        self._random_state = numpy.random.default_rng(random_state)
+        self._singular_values = None
+        self.mean = None
+
+    @property
+    def singular_values(self):
+        """
+        The singular values corresponding to each of the selected components.
+
+        :retuns: array, shape (n_components,)
+        """
+        return self._singular_values
+
+    def _iter_chunks(self):
+        """Chunks of rows of the data (as float64) with their position in the samples"""
+        contiguous = numpy.array_equal(self.indices, numpy.arange(self.num_samples))
+        for start in range(0, self.num_samples, self._chunk_size):
+            stop = min(start + self._chunk_size, self.num_samples)
+            if contiguous:
+                rows = self.data[start:stop]
+            else:
+                rows = self.data[list(self.indices[start:stop])]
+            yield slice(start, stop), numpy.asarray(rows, dtype=numpy.float64)
+
+    def _project_rows(self, vectors, desc):
+        """(data - mean) @ vectors, in one pass over the data"""
+        product = numpy.empty((self.num_samples, vectors.shape[1]))
+        for rows, chunk in self._iter_chunks():
+            product[rows] = chunk @ vectors
+            utils.advancement_display(rows.stop, self.num_samples, desc)
+        return product - self.mean @ vectors
+
+    def _project_columns(self, vectors, desc):
+        """(data - mean).T @ vectors, in one pass over the data"""
+        product = numpy.zeros((self.num_features, vectors.shape[1]))
+        for rows, chunk in self._iter_chunks():
+            product += chunk.T @ vectors[rows]
+            utils.advancement_display(rows.stop, self.num_samples, desc)
+        return product - numpy.outer(self.mean, vectors.sum(axis=0))
+
+    def fit_transform(self, max_iter=1, error_step=None):
+        """
+        Compute the components (H), the projections of the samples (W)
+        and the singular values.
+        """
+        self.ferr = []
+        n_vectors = min(
+            self.num_components + self._oversampling,
+            self.num_samples,
+            self.num_features,
+        )
+        omega = self._random_state.standard_normal((self.num_features, n_vectors))
+
+        # First pass: mean of the samples and random projection
+        desc = "Computing randomized PCA"
+        total = numpy.zeros(self.num_features)
+        sketch = numpy.empty((self.num_samples, n_vectors))
+        for rows, chunk in self._iter_chunks():
+            total += chunk.sum(axis=0)
+            sketch[rows] = chunk @ omega
+            utils.advancement_display(rows.stop, self.num_samples, desc)
+        self.mean = total / self.num_samples
+        sketch -= self.mean @ omega
+
+        for _ in range(self._power_iterations):
+            basis, _ = numpy.linalg.qr(sketch)
+            basis, _ = numpy.linalg.qr(self._project_columns(basis, desc))
+            sketch = self._project_rows(basis, desc)
+
+        basis, _ = numpy.linalg.qr(sketch)
+        # Small matrix (n_vectors, num_features) whose SVD gives the one of the data
+        small = self._project_columns(basis, desc).T
+        u, s, vt = numpy.linalg.svd(small, full_matrices=False)
+        u = basis @ u
+
+        k = self.num_components
+        u, s, vt = u[:, :k], s[:k], vt[:k]
+        # Deterministic signs: the largest coefficient of each column of u is positive
+        signs = numpy.sign(u[numpy.argmax(numpy.abs(u), axis=0), numpy.arange(k)])
+        signs[signs == 0] = 1
+        u *= signs
+        vt *= signs[:, numpy.newaxis]
+
+        self.H = vt
+        self.W = u * s
+        self._singular_values = s
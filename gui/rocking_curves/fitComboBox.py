@@ -4,7 +4,7 @@ from silx.gui import qt
 class FitComboBox(qt.QComboBox):
     def __init__(self) -> None:
         super().__init__()
-        self.addItems(("trf", "dogbox", "lm"))
+        self.addItems(("trf", "dogbox", "lm", "batched"))
         self.setItemData(
             self.findText("trf"),
             "Bounded - Trust Region Reflective algorithm, particularly suitable for large sparse problems with bounds. Generally robust method.",
@@ -17,5 +17,9 @@ class FitComboBox(qt.QComboBox):
             self.findText("lm"),
             "Unbounded Levenberg-Marquardt algorithm as implemented in MINPACK. Doesn’t handle bounds and sparse Jacobians. Usually the most efficient method for small unconstrained problems.",
         )
+        self.setItemData(
+            self.findText("batched"),
+            "Bounded - Levenberg-Marquardt algorithm vectorized over all the pixels. Fits the whole dataset at once without worker processes. Usually much faster than the other methods on large datasets.",
+        )
 
         self.setCurrentText("lm")
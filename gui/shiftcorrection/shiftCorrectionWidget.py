@@ -101,8 +101,9 @@ class ShiftCorrectionDialog(qt.QDialog):
         self,
         dimension: int | None,
         shift: tuple[Any, Any] | tuple[tuple[Any, Any], ...],
+        pyramid_levels: int = 0,
     ):
-        self._mainWindow.setCorrectionInputs(dimension, shift)
+        self._mainWindow.setCorrectionInputs(dimension, shift, pyramid_levels)
 
     def abort(self):
         self._setIsComputing(False)
@@ -202,14 +203,22 @@ class _ShiftCorrectionWidget(qt.QMainWindow):
 
     def _findShiftThread(self, dataset: ImageDataset):
         thread = OperationThread(self, dataset.find_shift)
-        thread.setArgs(self._dimension, indices=self.indices)
+        thread.setArgs(
+            self._dimension,
+            indices=self.indices,
+            pyramid_levels=self._shiftWidget.getPyramidLevels(),
+        )
         thread.finished.connect(self._updateShift)
 
         return thread
 
     def _findShiftAlongDimThread(self, dataset: ImageDataset):
         thread = OperationThread(self, dataset.find_shift_along_dimension)
-        thread.setArgs(self._dimension[0], indices=self.indices)
+        thread.setArgs(
+            self._dimension[0],
+            indices=self.indices,
+            pyramid_levels=self._shiftWidget.getPyramidLevels(),
+        )
         thread.finished.connect(self._updateShiftAlongDim)
 
         return thread
@@ -232,22 +241,34 @@ class _ShiftCorrectionWidget(qt.QMainWindow):
         self.setShift(self._filtered_shift[self._dimension[1][0]])
 
     def getCorrectionInputs(self) -> Dict[str, Any]:
+        pyramid_levels = self._shiftWidget.getPyramidLevels()
         if not self._shiftWidget.filterCB.isChecked():
-            return {"shift": self.getShift(), "dimension": None}
-
-        return {"shift": self._filtered_shift, "dimension": self._dimension[0][0]}
+            return {
+                "shift": self.getShift(),
+                "dimension": None,
+                "pyramid_levels": pyramid_levels,
+            }
+
+        return {
+            "shift": self._filtered_shift,
+            "dimension": self._dimension[0][0],
+            "pyramid_levels": pyramid_levels,
+        }
 
     def setCorrectionInputs(
         self,
         dimension_idx: int | None,
         shift: tuple[Any, Any] | tuple[tuple[Any, Any], ...],
+        pyramid_levels: int = 0,
     ):
         """
         Set widget parameters from .ows save
 
         :param dimension_idx: dimension_idx is the index of the chosen dimension
         :param shift : shift is (shift_x, shift_y) when dimension_idx is None, else this is (shift_x1, shift_y1), ..., (shift_xn, shift_yn) with n = the dimension size
+        :param pyramid_levels: Number of levels of the multi-resolution shift detection
         """
+        self._shiftWidget.setPyramidLevels(pyramid_levels)
         if dimension_idx is not None:
             # Temporary code to warn user (only once) that this feature is not yet implemented.
             _logger.warning(
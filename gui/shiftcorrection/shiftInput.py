@@ -19,6 +19,14 @@ class ShiftInput(qt.QDockWidget):
 
         widget = qt.QWidget()
 
+        pyramidLevelsLabel = qt.QLabel("Pyramid levels")
+        self._pyramidLevelsSB = qt.QSpinBox()
+        self._pyramidLevelsSB.setRange(0, 6)
+        self._pyramidLevelsSB.setValue(0)
+        self._pyramidLevelsSB.setToolTip(
+            "Number of times the images are binned to find a first estimation of the shift.\n"
+            "Faster for large images. 0 to find the shift on full resolution images only."
+        )
         self.findShiftB = qt.QPushButton("Find shift")
         # First dim is displayed on vertical axis, second on horizontal
         firstDimLabel = qt.QLabel("Vertical shift per frame (pixels)")
@@ -38,13 +46,15 @@ class ShiftInput(qt.QDockWidget):
 
         layout = qt.QGridLayout()
 
-        layout.addWidget(self.findShiftB, 0, 0, 1, 2)
-        layout.addWidget(firstDimLabel, 1, 0)
-        layout.addWidget(secondDimLabel, 2, 0)
-        layout.addWidget(self._firstDimLE, 1, 1)
-        layout.addWidget(self._secondDimLE, 2, 1)
-        layout.addWidget(self.correctionB, 4, 0, 1, 2)
-        layout.addWidget(self.filterCB, 3, 1)
+        layout.addWidget(pyramidLevelsLabel, 0, 0)
+        layout.addWidget(self._pyramidLevelsSB, 0, 1)
+        layout.addWidget(self.findShiftB, 1, 0, 1, 2)
+        layout.addWidget(firstDimLabel, 2, 0)
+        layout.addWidget(secondDimLabel, 3, 0)
+        layout.addWidget(self._firstDimLE, 2, 1)
+        layout.addWidget(self._secondDimLE, 3, 1)
+        layout.addWidget(self.correctionB, 5, 0, 1, 2)
+        layout.addWidget(self.filterCB, 4, 1)
 
         layout.addWidget(VSpacer())
 
@@ -55,6 +65,12 @@ class ShiftInput(qt.QDockWidget):
     def getShift(self) -> Tuple[float, float]:
         return float(self._firstDimLE.text()), float(self._secondDimLE.text())
 
+    def getPyramidLevels(self) -> int:
+        return self._pyramidLevelsSB.value()
+
+    def setPyramidLevels(self, levels: int):
+        self._pyramidLevelsSB.setValue(levels)
+
     def setShift(self, shift: Tuple[float, float]):
         first_dim_shift, second_dim_shift = shift
         self._firstDimLE.setText(str(first_dim_shift))
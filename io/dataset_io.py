@@ -6,11 +6,11 @@ import json
 
 import numpy
 from silx.io import fabioh5
-from silx.io.url import DataUrl
 
 from darfix.core.dataset import Data
 from darfix.core.dataset import ImageDataset
 from darfix.core.dimension import AcquisitionDims
+from darfix.io.frame_urls import FrameUrls
 
 
 def save_to_json(
@@ -18,13 +18,11 @@ def save_to_json(
 ):
     my_dict = {}
     my_dict["dir"] = dataset.dir
-    my_dict["dataset"] = [url.file_path() for url in dataset.get_data().urls]
+    my_dict["dataset"] = dataset.get_data().urls.file_paths()
     my_dict["shape"] = dataset.data.shape
     my_dict["in_memory"] = dataset.in_memory
     if original_dataset is not None:
-        my_dict["original_dataset"] = [
-            url.file_path() for url in original_dataset.get_data().urls
-        ]
+        my_dict["original_dataset"] = original_dataset.get_data().urls.file_paths()
     if hi_indices is not None:
         my_dict["hi_indices"] = hi_indices.tolist()
     if li_indices is not None:
@@ -39,9 +37,7 @@ def load_from_json(filename):
     hi_indices = li_indices = dims = None
     with open(filename + ".json", "r") as f:
         distro = json.load(f)
-        urls = numpy.array(
-            [DataUrl(file_path=url, scheme="fabio") for url in distro["dataset"]]
-        )
+        urls = FrameUrls.from_files(distro["dataset"], scheme="fabio")
         if "original_dataset" in distro:
             original_dataset = distro["original_dataset"]
         else:
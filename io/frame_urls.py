@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+from typing import Generator
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+import numpy
+from silx.io.url import DataUrl
+
+_NO_SLICE = -1
+"""Slice index of the urls pointing to a whole file or dataset"""
+
+
+class FrameUrls:
+    """
+    Compact array of the urls of the frames of a scan.
+
+    Instead of one :class:`DataUrl` per frame, the urls are stored as tables of the
+    distinct files (with their scheme) and dataset paths, and integer arrays with,
+    for each frame, the index of its file, the index of its dataset path and its
+    slice index in the dataset.
+
+    It behaves like a numpy object array of :class:`DataUrl` for indexing, reshaping
+    and iteration. :class:`DataUrl` instances are only created when a single url is
+    accessed.
+
+    :param file_paths: File path of each file
+    :param schemes: Scheme of each file
+    :param data_paths: Distinct dataset paths (None for urls without dataset path)
+    :param file_ids: Index of the file of each frame
+    :param path_ids: Index of the dataset path of each frame
+    :param slices: Index of each frame in its dataset or -1 if the url has no slice
+    """
+
+    def __init__(
+        self,
+        file_paths: List[str],
+        schemes: List[str | None],
+        data_paths: List[str | None],
+        file_ids: numpy.ndarray,
+        path_ids: numpy.ndarray,
+        slices: numpy.ndarray,
+    ):
+        self._file_paths = list(file_paths)
+        self._schemes = list(schemes)
+        self._data_paths = list(data_paths)
+        self._file_ids = numpy.asarray(file_ids, dtype=numpy.int32)
+        self._path_ids = numpy.asarray(path_ids, dtype=numpy.int32)
+        self._slices = numpy.asarray(slices, dtype=numpy.int64)
+
+    @classmethod
+    def from_hdf5_dataset(
+        cls,
+        file_path: str,
+        data_path: str,
+        slices: Iterable[int] | numpy.ndarray,
+        scheme: str = "silx",
+    ) -> FrameUrls:
+        """Urls of frames of a single HDF5 dataset"""
+        slices = numpy.asarray(slices, dtype=numpy.int64)
+        zeros = numpy.zeros(slices.shape, dtype=numpy.int32)
+        return cls([file_path], [scheme], [data_path], zeros, zeros, slices)
+
+    @classmethod
+    def from_files(cls, file_paths: List[str], scheme: str = "fabio") -> FrameUrls:
+        """Urls of frames stored each in its own file"""
+        files = {}
+        file_ids = numpy.array(
+            [files.setdefault(file_path, len(files)) for file_path in file_paths],
+            dtype=numpy.int32,
+        )
+        return cls(
+            list(files),
+            [scheme] * len(files),
+            [None],
+            file_ids,
+            numpy.zeros(file_ids.shape, dtype=numpy.int32),
+            numpy.full(file_ids.shape, _NO_SLICE, dtype=numpy.int64),
+        )
+
+    @classmethod
+    def from_urls(cls, urls) -> FrameUrls:
+        """
+        Convert an array of :class:`DataUrl` (or url strings) into a :class:`FrameUrls`.
+        A :class:`FrameUrls` is returned as is.
+        """
+        if isinstance(urls, FrameUrls):
+            return urls
+        if isinstance(urls, DataUrl):
+            url = urls
+            urls = numpy.empty((), dtype=object)
+            urls[()] = url
+        urls = numpy.asarray(urls, dtype=object)
+
+        files = {}
+        data_paths = {}
+        file_ids = numpy.empty(urls.shape, dtype=numpy.int32)
+        path_ids = numpy.empty(urls.shape, dtype=numpy.int32)
+        slices = numpy.empty(urls.shape, dtype=numpy.int64)
+        for index, url in numpy.ndenumerate(urls):
+            if not isinstance(url, DataUrl):
+                url = DataUrl(path=url)
+            file_ids[index] = files.setdefault(
+                (url.file_path(), url.scheme()), len(files)
+            )
+            path_ids[index] = data_paths.setdefault(url.data_path(), len(data_paths))
+            slices[index] = _slice_index(url.data_slice())
+        return cls(
+            [file_path for file_path, _ in files],
+            [scheme for _, scheme in files],
+            list(data_paths),
+            file_ids,
+            path_ids,
+            slices,
+        )
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._slices.shape
+
+    @property
+    def size(self) -> int:
+        return self._slices.size
+
+    @property
+    def ndim(self) -> int:
+        return self._slices.ndim
+
+    def __len__(self) -> int:
+        return len(self._slices)
+
+    def _new(self, file_ids, path_ids, slices) -> FrameUrls:
+        return FrameUrls(
+            self._file_paths,
+            self._schemes,
+            self._data_paths,
+            file_ids,
+            path_ids,
+            slices,
+        )
+
+    def _url(self, file_id: int, path_id: int, slice_index: int) -> DataUrl:
+        return DataUrl(
+            file_path=self._file_paths[file_id],
+            data_path=self._data_paths[path_id],
+            data_slice=None if slice_index == _NO_SLICE else int(slice_index),
+            scheme=self._schemes[file_id],
+        )
+
+    def __getitem__(self, indices) -> DataUrl | FrameUrls:
+        slices = self._slices[indices]
+        if not isinstance(slices, numpy.ndarray):
+            return self._url(self._file_ids[indices], self._path_ids[indices], slices)
+        return self._new(self._file_ids[indices], self._path_ids[indices], slices)
+
+    def __setitem__(self, indices, urls) -> None:
+        urls = FrameUrls.from_urls(urls)
+        file_ids = numpy.array(
+            [
+                self._add_file(file_path, scheme)
+                for file_path, scheme in zip(urls._file_paths, urls._schemes)
+            ],
+            dtype=numpy.int32,
+        )
+        path_ids = numpy.array(
+            [self._add_data_path(data_path) for data_path in urls._data_paths],
+            dtype=numpy.int32,
+        )
+        self._file_ids[indices] = file_ids[urls._file_ids]
+        self._path_ids[indices] = path_ids[urls._path_ids]
+        self._slices[indices] = urls._slices
+
+    def _add_file(self, file_path: str, scheme: str | None) -> int:
+        for file_id, file in enumerate(zip(self._file_paths, self._schemes)):
+            if file == (file_path, scheme):
+                return file_id
+        self._file_paths.append(file_path)
+        self._schemes.append(scheme)
+        return len(self._file_paths) - 1
+
+    def _add_data_path(self, data_path: str | None) -> int:
+        if data_path in self._data_paths:
+            return self._data_paths.index(data_path)
+        self._data_paths.append(data_path)
+        return len(self._data_paths) - 1
+
+    def __iter__(self) -> Generator[DataUrl | FrameUrls, None, None]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def flat(self) -> Generator[DataUrl, None, None]:
+        """Iterate over the urls of all frames (as :class:`DataUrl`)"""
+        for file_id, path_id, slice_index in zip(
+            self._file_ids.flat, self._path_ids.flat, self._slices.flat
+        ):
+            yield self._url(file_id, path_id, slice_index)
+
+    def __array__(self, dtype=None, copy=None) -> numpy.ndarray:
+        urls = numpy.empty(self.shape, dtype=object)
+        for index, url in zip(numpy.ndindex(self.shape), self.flat):
+            urls[index] = url
+        return urls
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FrameUrls):
+            return False
+        return self.shape == other.shape and all(
+            url == other_url for url, other_url in zip(self.flat, other.flat)
+        )
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"FrameUrls(shape={self.shape}, files={len(self._file_paths)})"
+
+    def copy(self) -> FrameUrls:
+        return self._new(
+            self._file_ids.copy(), self._path_ids.copy(), self._slices.copy()
+        )
+
+    def reshape(self, shape, order="C") -> FrameUrls:
+        return self._new(
+            self._file_ids.reshape(shape, order=order),
+            self._path_ids.reshape(shape, order=order),
+            self._slices.reshape(shape, order=order),
+        )
+
+    def flatten(self) -> FrameUrls:
+        return self._new(
+            self._file_ids.flatten(), self._path_ids.flatten(), self._slices.flatten()
+        )
+
+    def take(self, indices, axis=None, mode="raise") -> FrameUrls:
+        return self._new(
+            numpy.take(self._file_ids, indices, axis, mode=mode),
+            numpy.take(self._path_ids, indices, axis, mode=mode),
+            numpy.take(self._slices, indices, axis, mode=mode),
+        )
+
+    def file_paths(self) -> List[str]:
+        """File path of each frame (flattened)"""
+        return [self._file_paths[file_id] for file_id in self._file_ids.flat]
+
+    def contiguous_runs(self) -> List[Tuple[int, int]]:
+        """
+        Split the (flattened) frames in runs of consecutive frames that are consecutive
+        slices of the same dataset.
+
+        :returns: The start and stop (flat) indices of each run
+        """
+        if self.size == 0:
+            return []
+        file_ids = self._file_ids.ravel()
+        path_ids = self._path_ids.ravel()
+        slices = self._slices.ravel()
+        breaks = (
+            (file_ids[1:] != file_ids[:-1])
+            | (path_ids[1:] != path_ids[:-1])
+            | (slices[1:] != slices[:-1] + 1)
+            | (slices[1:] == _NO_SLICE)
+        )
+        bounds = numpy.concatenate(([0], numpy.flatnonzero(breaks) + 1, [self.size]))
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    def hdf5_dataset(self) -> Tuple[str, str, numpy.ndarray] | None:
+        """
+        Return the file path, dataset path and frame indices if all frames
+        are slices of the same HDF5 dataset, else None.
+        """
+        if self.size == 0:
+            return None
+        file_ids = numpy.unique(self._file_ids)
+        path_ids = numpy.unique(self._path_ids)
+        if len(file_ids) != 1 or len(path_ids) != 1:
+            return None
+        file_id, path_id = file_ids[0], path_ids[0]
+        if self._schemes[file_id] not in (None, "silx", "h5py"):
+            return None
+        if self._data_paths[path_id] is None or numpy.any(self._slices < 0):
+            return None
+        return (
+            self._file_paths[file_id],
+            self._data_paths[path_id],
+            self._slices.flatten(),
+        )
+
+
+def _slice_index(data_slice) -> int:
+    if data_slice is None:
+        return _NO_SLICE
+    if isinstance(data_slice, tuple) and len(data_slice) == 1:
+        data_slice = data_slice[0]
+    if isinstance(data_slice, (int, numpy.integer)) and data_slice >= 0:
+        return int(data_slice)
+    raise ValueError(f"Only urls to a single frame are supported. Got {data_slice}")
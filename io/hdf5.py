@@ -6,8 +6,122 @@ from contextlib import AbstractContextManager
 from typing import Union
 
 import h5py
+import numpy
 from silx.io import utils
 from silx.io.url import DataUrl
+from silx.utils.enum import Enum as _Enum
+
+import darfix
+
+from .frame_urls import FrameUrls
+from .progress import display_progress
+
+CHUNK_CACHE_NBYTES = 64 * 1024**2
+"""Size of the chunk cache of the HDF5 datasets read and written by darfix.
+
+It is large enough to hold a complete layer of tile chunks for common frame sizes
+so that datasets with tile chunks are still efficiently read and written frame by frame.
+"""
+
+_CHUNK_TARGET_NBYTES = 1024**2
+"""Target size of a tile chunk"""
+
+
+class ChunkLayout(_Enum):
+    """
+    Layout of the chunks of the stacks of frames saved by darfix (see `darfix.config.HDF5_CHUNK_LAYOUT`)
+    """
+
+    AUTO = "auto"
+    """Layout chosen depending on how the dataset is read by the operations consuming it"""
+    FRAME = "frame"
+    """One chunk per frame: efficient for operations processing the stack frame by frame"""
+    TILE = "tile"
+    """Chunks covering a tile of a few consecutive frames: efficient for operations processing
+    the stack pixel tile by pixel tile (moments, fit, median background...)"""
+    CONTIGUOUS = "contiguous"
+    """No chunking (contiguous layout, no compression)"""
+
+
+def get_chunk_shape(
+    shape: tuple[int, ...],
+    dtype: numpy.typing.DTypeLike,
+    layout: ChunkLayout | str | None = None,
+    auto_layout: ChunkLayout | str = ChunkLayout.TILE,
+) -> tuple[int, ...] | None:
+    """
+    Chunk shape of a stack of frames.
+
+    :param shape: Shape of the stack: number of frames then frame shape (1D or 2D)
+    :param dtype: Type of the stack values
+    :param layout: Chunk layout. If None, `darfix.config.HDF5_CHUNK_LAYOUT` is used.
+    :param auto_layout: Layout used when `layout` is `ChunkLayout.AUTO`
+    :returns: The chunk shape or None for a contiguous layout
+    """
+    if layout is None:
+        layout = darfix.config.HDF5_CHUNK_LAYOUT
+    layout = ChunkLayout.from_value(layout)
+    if layout is ChunkLayout.AUTO:
+        layout = ChunkLayout.from_value(auto_layout)
+    if layout is ChunkLayout.CONTIGUOUS or 0 in shape or len(shape) < 2:
+        return None
+
+    nframes, frame_shape = shape[0], tuple(shape[1:])
+    if layout is ChunkLayout.FRAME:
+        return (1,) + frame_shape
+
+    # Tile chunks: a layer of chunks along the frames must fit in the chunk cache
+    itemsize = numpy.dtype(dtype).itemsize
+    frame_nbytes = int(numpy.prod(frame_shape)) * itemsize
+    depth = int(min(nframes, max(1, CHUNK_CACHE_NBYTES // frame_nbytes)))
+    tile_size = max(1, _CHUNK_TARGET_NBYTES // (depth * itemsize))
+    if len(frame_shape) == 1:
+        return (depth, min(frame_shape[0], tile_size))
+    tile_height = min(frame_shape[0], max(1, int(numpy.sqrt(tile_size))))
+    tile_width = min(frame_shape[1], max(1, tile_size // tile_height))
+    return (depth, tile_height, tile_width)
+
+
+def create_stack_dataset(
+    parent: h5py.Group,
+    name: str,
+    shape: tuple[int, ...],
+    dtype: numpy.typing.DTypeLike,
+    auto_layout: ChunkLayout | str = ChunkLayout.TILE,
+) -> h5py.Dataset:
+    """
+    Create a dataset for a stack of frames with the chunk layout and compression
+    defined by `darfix.config.HDF5_CHUNK_LAYOUT` and `darfix.config.HDF5_COMPRESSION`.
+
+    :param auto_layout: Layout to use when `darfix.config.HDF5_CHUNK_LAYOUT` is `ChunkLayout.AUTO`.
+        It should match the way the dataset is read by the operations consuming it.
+    """
+    chunks = get_chunk_shape(shape, dtype, auto_layout=auto_layout)
+    options = {}
+    if chunks is not None:
+        options["chunks"] = chunks
+        if darfix.config.HDF5_COMPRESSION is not None:
+            options["compression"] = darfix.config.HDF5_COMPRESSION
+            options["compression_opts"] = darfix.config.HDF5_COMPRESSION_OPTS
+    return parent.create_dataset(
+        name,
+        shape=shape,
+        dtype=dtype,
+        rdcc_nbytes=CHUNK_CACHE_NBYTES,
+        rdcc_w0=1,
+        **options,
+    )
+
+
+def get_stack_source(urls: FrameUrls) -> tuple[str, str, numpy.ndarray] | None:
+    """
+    Return the file path, data path and frame indices of the HDF5 dataset
+    if all urls point to a frame of the same HDF5 dataset, else None.
+    """
+    source = FrameUrls.from_urls(urls).hdf5_dataset()
+    if source is None or not h5py.is_hdf5(source[0]):
+        return None
+    return source
 
 
 def is_hdf5(url: Union[DataUrl, str]) -> bool:
@@ -63,7 +177,7 @@ class hdf5_file_cache(AbstractContextManager):
     def open_file(self, file_path: str):
         """cache the latest HDF5 file open"""
         self.close_h5_file()
-        self.__h5_file = h5py.File(file_path, mode="r")
+        self.__h5_file = h5py.File(file_path, mode="r", rdcc_nbytes=CHUNK_CACHE_NBYTES)
         return self.__h5_file
 
     @functools.lru_cache(maxsize=1)
@@ -78,6 +192,50 @@ class hdf5_file_cache(AbstractContextManager):
             raise KeyError(f"Data path from URL '{data_path}' not found")
         return h5f[data_path]
 
+    def read_frames(
+        self,
+        urls: FrameUrls,
+        out: numpy.ndarray,
+        max_slab_nbytes: int | None = None,
+        desc: str = "Loading data",
+    ) -> None:
+        """
+        Read the frames of `urls` into `out`.
+
+        Consecutive urls pointing to consecutive frames of the same HDF5 dataset are read
+        together with a single hyperslab selection directly into `out`.
+
+        :param urls: Urls of the frames
+        :param out: C-contiguous array of shape (number of frames, frame height, frame width)
+        :param max_slab_nbytes: Maximum number of bytes read at once.
+            If None, `darfix.config.HDF5_MAX_SLAB_NBYTES` is used.
+        """
+        if max_slab_nbytes is None:
+            max_slab_nbytes = darfix.config.HDF5_MAX_SLAB_NBYTES
+        frame_nbytes = max(1, out[0].nbytes) if len(out) else 1
+        max_slab_frames = max(1, int(max_slab_nbytes // frame_nbytes))
+
+        urls = urls.flatten()
+        slabs = []
+        for start, stop in urls.contiguous_runs():
+            for slab_start in range(start, stop, max_slab_frames):
+                slabs.append((slab_start, min(slab_start + max_slab_frames, stop)))
+
+        for start, stop in display_progress(slabs, desc=desc):
+            url = urls[start]
+            if url.scheme() == "silx" and isinstance(url.data_slice(), int):
+                dataset = self._get_h5py_object(url.file_path(), url.data_path())
+                if isinstance(dataset, h5py.Dataset) and dataset.ndim == 3:
+                    first_frame = url.data_slice()
+                    dataset.read_direct(
+                        out,
+                        source_sel=numpy.s_[first_frame : first_frame + stop - start],
+                        dest_sel=numpy.s_[start:stop],
+                    )
+                    continue
+            for index in range(start, stop):
+                out[index] = self.get_data(urls[index])
+
     def get_data(self, url: DataUrl):
         """
         Retrieve data contained in 'url'.
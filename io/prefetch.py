@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Generator
+from typing import Iterable
+from typing import TypeVar
+
+import numpy
+
+import darfix
+
+T = TypeVar("T")
+
+_POLL_INTERVAL = 0.1
+"""Interval (in seconds) at which the reading thread checks if it must stop"""
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def prefetch(
+    iterable: Iterable[T],
+    depth: int | None = None,
+    max_nbytes: int | None = None,
+) -> Generator[T, None, None]:
+    """
+    Iterate over `iterable` while the next items are read in a background thread.
+
+    This overlaps the reading (and decoding) of frames from disk with their processing.
+    Exceptions raised while reading are raised by the iteration.
+
+    :param iterable: Items to read. It is iterated in the background thread.
+    :param depth: Maximum number of items read ahead.
+        If None, `darfix.config.PREFETCH_DEPTH` is used. If 0, items are not read ahead.
+    :param max_nbytes: Maximum number of bytes of numpy arrays read ahead.
+        If None, `darfix.config.PREFETCH_MAX_NBYTES` is used.
+        At least one item is always read ahead when `depth` is not 0.
+    """
+    if depth is None:
+        depth = darfix.config.PREFETCH_DEPTH
+    if max_nbytes is None:
+        max_nbytes = darfix.config.PREFETCH_MAX_NBYTES
+    if depth <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    # Number of bytes of the items in the queue
+    nbytes = [0]
+    nbytes_changed = threading.Condition()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                item_nbytes = _nbytes(item)
+                with nbytes_changed:
+                    while (
+                        nbytes[0] > 0
+                        and nbytes[0] + item_nbytes > max_nbytes
+                        and not stop.is_set()
+                    ):
+                        nbytes_changed.wait(_POLL_INTERVAL)
+                    nbytes[0] += item_nbytes
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Failure(e))
+        else:
+            put(_END)
+        finally:
+            # Release the resources of the reading (e.g. opened files) in this thread
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=read, name="darfix-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            with nbytes_changed:
+                nbytes[0] -= _nbytes(item)
+                nbytes_changed.notify()
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _nbytes(item) -> int:
+    if isinstance(item, numpy.ndarray):
+        return item.nbytes
+    return 0
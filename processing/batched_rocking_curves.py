@@ -0,0 +1,465 @@
+"""
+Vectorized fit of rocking curves: all the curves of a block of pixels are fitted simultaneously
+with a bounded Levenberg-Marquardt solver working on stacked NumPy arrays.
+
+The skip logic, starting values, bounds and FWHM scaling are the ones of
+:func:`darfix.processing.rocking_curves.fit_rocking_curve` and
+:func:`darfix.processing.rocking_curves.fit_2d_rocking_curve` so that maps match the ones of the
+pixel-by-pixel `scipy.optimize.curve_fit` path.
+"""
+
+from __future__ import annotations
+
+from typing import Callable
+from typing import Tuple
+
+import numpy
+
+import darfix
+
+from ..math import bivariate_gaussian
+from ..math import gaussian
+from .rocking_curves import _ZERO_SUM_RELATIVE_TOLERANCE
+
+_MAX_ITERATIONS = 100
+_FTOL = 1e-8
+_XTOL = 1e-8
+_INITIAL_DAMPING = 1e-1
+_MAX_DAMPING = 1e10
+_BOUND_STEP = 0.9
+"""Fraction of the distance to the bound covered by a step component that would leave the bounds."""
+
+ModelAndJacobian = Callable[[numpy.ndarray], Tuple[numpy.ndarray, numpy.ndarray]]
+
+
+def _solve_normal_equations(
+    jtj: numpy.ndarray,
+    gradient: numpy.ndarray,
+    damping: numpy.ndarray,
+    fixed: numpy.ndarray,
+) -> numpy.ndarray:
+    """
+    Solve the damped normal equations `(JtJ + damping * diag(JtJ)) step = -gradient` for every pixel.
+
+    :param jtj: array of shape (n_pixels, n_params, n_params)
+    :param gradient: array of shape (n_pixels, n_params)
+    :param damping: array of shape (n_pixels,)
+    :param fixed: boolean array of shape (n_pixels, n_params) of the parameters that must not move
+    """
+    diagonal = numpy.diagonal(jtj, axis1=1, axis2=2)
+    # Floor the scaling so that parameters with a null derivative still get a damped step
+    scaling = numpy.maximum(diagonal, 1e-12 * diagonal.max(axis=1, keepdims=True))
+    scaling[scaling == 0] = 1e-12
+    n_params = jtj.shape[-1]
+    free = ~fixed
+    lhs = jtj * (free[:, :, None] & free[:, None, :])
+    damped_diagonal = diagonal + damping[:, None] * scaling
+    damped_diagonal[fixed] = 1
+    lhs[:, range(n_params), range(n_params)] = damped_diagonal
+    rhs = numpy.where(fixed, 0, -gradient)[..., None]
+    try:
+        return numpy.linalg.solve(lhs, rhs)[..., 0]
+    except numpy.linalg.LinAlgError:
+        return (numpy.linalg.pinv(lhs) @ rhs)[..., 0]
+
+
+def levenberg_marquardt(
+    model: ModelAndJacobian,
+    p0: numpy.ndarray,
+    y: numpy.ndarray,
+    lower: numpy.ndarray,
+    upper: numpy.ndarray,
+    max_iter: int = _MAX_ITERATIONS,
+    ftol: float = _FTOL,
+    xtol: float = _XTOL,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Bounded Levenberg-Marquardt least-squares solver running one independent problem per row.
+
+    Every problem has its own damping factor and convergence flag: converged problems are removed
+    from the working set so that the cost of an iteration decreases with the number of remaining problems.
+    Problems whose damping factor exceeds its maximum are stalled: they are removed as well, but
+    not reported as converged.
+    Parameters stay strictly inside the bounds: the components of a step that would leave the
+    feasible box are shortened and the other components are computed with those kept fixed.
+
+    :param model: function returning the model values (n, n_points) and the jacobian
+        (n, n_points, n_params) for parameters of shape (n, n_params)
+    :param p0: starting values of shape (n, n_params)
+    :param y: data to fit of shape (n, n_points)
+    :param lower: lower bounds of shape (n, n_params)
+    :param upper: upper bounds of shape (n, n_params)
+    :param max_iter: maximal number of iterations
+    :param ftol: relative tolerance on the cost decrease
+    :param xtol: relative tolerance on the parameter step
+
+    :returns: the fitted parameters and a boolean array telling which problems converged
+    """
+    params = numpy.clip(numpy.array(p0, dtype=numpy.float64), lower, upper)
+    converged = numpy.zeros(len(params), dtype=bool)
+    if len(params) == 0:
+        return params, converged
+
+    active = numpy.arange(len(params))
+    damping = numpy.full(len(params), _INITIAL_DAMPING)
+    damping_factor = numpy.full(len(params), 2.0)
+    values, jacobian = model(params)
+    residuals = values - y
+    cost = numpy.sum(residuals**2, axis=1)
+
+    for _ in range(max_iter):
+        p = params[active]
+        jtj = numpy.einsum("nmi,nmj->nij", jacobian, jacobian)
+        gradient = numpy.einsum("nmi,nm->ni", jacobian, residuals)
+        with numpy.errstate(invalid="ignore", over="ignore"):
+            # Parameters on a bound and pushed outwards by the gradient are kept fixed
+            fixed = ((p <= lower[active]) & (gradient > 0)) | (
+                (p >= upper[active]) & (gradient < 0)
+            )
+            step = _solve_normal_equations(jtj, gradient, damping[active], fixed)
+            new_p = p + step
+            below = new_p < lower[active]
+            above = new_p > upper[active]
+            truncated = numpy.any(below | above, axis=1)
+            if numpy.any(truncated):
+                # Solve again with the parameters leaving the bounds kept fixed, then move
+                # those only part of the way to their bound so that they stay strictly
+                # feasible (e.g. a standard deviation never collapses to 0)
+                step = _solve_normal_equations(
+                    jtj[truncated],
+                    gradient[truncated],
+                    damping[active[truncated]],
+                    fixed[truncated] | below[truncated] | above[truncated],
+                )
+                new_p[truncated] = p[truncated] + step
+                new_p[below] = (p + _BOUND_STEP * (lower[active] - p))[below]
+                new_p[above] = (p + _BOUND_STEP * (upper[active] - p))[above]
+            new_values, new_jacobian = model(new_p)
+            new_residuals = new_values - y[active]
+            new_cost = numpy.sum(new_residuals**2, axis=1)
+
+        # Gain ratio between the actual and the predicted (linear model) decrease of the cost
+        h = new_p - p
+        predicted = -2 * numpy.einsum("ni,ni->n", h, gradient) - numpy.einsum(
+            "ni,nij,nj->n", h, jtj, h
+        )
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            gain = (cost - new_cost) / predicted
+
+        improved = new_cost < cost
+        # Shortened steps make slow progress that must not be mistaken for convergence
+        small_decrease = ((cost - new_cost) <= ftol * cost) & ~truncated
+        small_step = numpy.all(
+            numpy.abs(new_p - p) <= xtol * (xtol + numpy.abs(p)), axis=1
+        )
+        # A non-finite step can never be accepted
+        improved &= numpy.isfinite(new_cost)
+
+        params[active[improved]] = new_p[improved]
+        residuals[improved] = new_residuals[improved]
+        jacobian[improved] = new_jacobian[improved]
+        cost[improved] = new_cost[improved]
+        # Damping update of Nielsen (1999)
+        accepted = active[improved]
+        damping[accepted] *= numpy.maximum(
+            1 / 3, 1 - (2 * numpy.clip(gain[improved], 0, 1) - 1) ** 3
+        )
+        damping_factor[accepted] = 2
+        rejected = active[~improved]
+        damping[rejected] *= damping_factor[rejected]
+        damping_factor[rejected] *= 2
+
+        done = (improved & small_decrease) | small_step | (cost == 0)
+        converged[active[done]] = True
+        # No step decreases the cost anymore: the problem is stopped without converging
+        stalled = damping[active] > _MAX_DAMPING
+
+        keep = ~(done | stalled)
+        active = active[keep]
+        if active.size == 0:
+            break
+        residuals = residuals[keep]
+        jacobian = jacobian[keep]
+        cost = cost[keep]
+
+    return params, converged
+
+
+def _gaussian_model(x: numpy.ndarray) -> ModelAndJacobian:
+    """Model and jacobian of :func:`darfix.math.gaussian` for parameters (amplitude, x0, std_dev, background)."""
+
+    def model(params: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        amplitude, x0, std_dev, background = (p[:, None] for p in params.T)
+        d = x[None, :] - x0
+        g = numpy.exp(-(d**2) / (2 * std_dev**2))
+        jacobian = numpy.empty(d.shape + (4,))
+        jacobian[..., 0] = g
+        jacobian[..., 1] = amplitude * g * d / std_dev**2
+        jacobian[..., 2] = jacobian[..., 1] * d / std_dev
+        jacobian[..., 3] = 1
+        return background + amplitude * g, jacobian
+
+    return model
+
+
+def _bivariate_gaussian_model(X0: numpy.ndarray, X1: numpy.ndarray) -> ModelAndJacobian:
+    """
+    Model and jacobian of :func:`darfix.math.bivariate_gaussian` for parameters
+    (x0_0, x1_0, sigma_x0, sigma_x1, amplitude, correlation, background).
+    """
+
+    def model(params: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        x0_0, x1_0, sigma_x0, sigma_x1, amplitude, correlation, background = (
+            p[:, None] for p in params.T
+        )
+        u = (X0[None, :] - x0_0) / sigma_x0
+        v = (X1[None, :] - x1_0) / sigma_x1
+        d = 1 - correlation**2
+        q = (u**2 + v**2 - 2 * correlation * u * v) / d
+        g = numpy.exp(-q / 2)
+        half_ag = amplitude * g / 2
+        dq_du = 2 * (u - correlation * v) / d
+        dq_dv = 2 * (v - correlation * u) / d
+        jacobian = numpy.empty(u.shape + (7,))
+        jacobian[..., 0] = half_ag * dq_du / sigma_x0
+        jacobian[..., 1] = half_ag * dq_dv / sigma_x1
+        jacobian[..., 2] = jacobian[..., 0] * u
+        jacobian[..., 3] = jacobian[..., 1] * v
+        jacobian[..., 4] = g
+        jacobian[..., 5] = -half_ag * 2 * (correlation * q - u * v) / d
+        jacobian[..., 6] = 1
+        return background + amplitude * g, jacobian
+
+    return model
+
+
+def fit_rocking_curves_batched(
+    y: numpy.ndarray,
+    x_values: numpy.ndarray | None = None,
+    num_points: int | None = None,
+    int_thresh: float | None = None,
+    moments: numpy.ndarray | None = None,
+    max_iter: int = _MAX_ITERATIONS,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Fit a Gaussian (:func:`darfix.math.gaussian`) to every rocking curve of `y` at once.
+
+    :param y: rocking curves, of shape (n_curves, n_points)
+    :param x_values: The independent variable where the data is measured, optional
+    :param num_points: Number of points to evaluate the fitted curves on, optional
+    :param int_thresh: Intensity threshold. If not None, only the rocking curves with
+        higher ptp (range of values) are fitted.
+    :param moments: mean and standard deviation of each rocking curve of shape (n_curves, 2)
+        to use as starting values, optional
+    :param max_iter: maximal number of iterations of the solver
+
+    :returns: the fitted curves of shape (n_curves, num_points) and the parameters
+        (amplitude, peak position, FWHM, background) of shape (n_curves, 4)
+    """
+    y = numpy.asarray(y, dtype=numpy.float64)
+    n_curves, n_points = y.shape
+    x = (
+        numpy.asarray(x_values, dtype=numpy.float64)
+        if x_values is not None
+        else numpy.arange(n_points, dtype=numpy.float64)
+    )
+    if num_points is None:
+        num_points = n_points
+
+    curves = numpy.empty((n_curves, num_points))
+    if num_points == n_points:
+        curves[:] = y
+    pars = numpy.empty((n_curves, 4))
+    if n_curves == 0:
+        return curves, pars
+
+    min_y = y.min(axis=1)
+    max_y = y.max(axis=1)
+    ptp_y = max_y - min_y
+
+    _sum = y.sum(axis=1)
+    if moments is not None:
+        mean = numpy.array(moments[:, 0], dtype=numpy.float64)
+        sigma = numpy.array(moments[:, 1], dtype=numpy.float64)
+    else:
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            mean = y @ x / _sum
+            sigma = numpy.sqrt(
+                numpy.sum(y * (x[None, :] - mean[:, None]) ** 2, axis=1) / _sum
+            )
+    mean[~(_sum > 0)] = numpy.nan
+    sigma[~(_sum > 0)] = numpy.nan
+
+    pars[:, 0] = ptp_y
+    pars[:, 1] = mean
+    pars[:, 2] = sigma
+    pars[:, 3] = min_y
+
+    below_thresh = (
+        ptp_y < int_thresh if int_thresh is not None else numpy.zeros(n_curves, bool)
+    )
+    pars[below_thresh] = numpy.stack(
+        [
+            numpy.zeros(n_curves),
+            numpy.full(n_curves, x[0]),
+            numpy.zeros(n_curves),
+            min_y,
+        ],
+        axis=1,
+    )[below_thresh]
+    to_fit = (
+        ~below_thresh
+        & ~numpy.isnan(mean)
+        & ~numpy.isnan(sigma)
+        & ~numpy.isclose(sigma, 0)
+    )
+    if num_points != n_points:
+        curves[~to_fit] = numpy.nan
+    fit_idx = numpy.flatnonzero(to_fit)
+    if fit_idx.size == 0:
+        return curves, pars
+
+    epsilon = 1e-2
+    lower = numpy.empty((fit_idx.size, 4))
+    upper = numpy.empty((fit_idx.size, 4))
+    lower[:, 0] = numpy.minimum(ptp_y, min_y)[fit_idx] - epsilon
+    upper[:, 0] = numpy.maximum(max_y, ptp_y)[fit_idx] + epsilon
+    lower[:, 1] = x.min() - epsilon
+    upper[:, 1] = x.max() + epsilon
+    # Strictly positive standard deviation to keep the model defined
+    lower[:, 2] = numpy.finfo(numpy.float64).eps * max(numpy.ptp(x), 1.0)
+    upper[:, 2] = numpy.inf
+    lower[:, 3] = -numpy.inf
+    upper[:, 3] = numpy.inf
+
+    p0 = numpy.clip(pars[fit_idx], lower, upper)
+    fitted, converged = levenberg_marquardt(
+        _gaussian_model(x), p0, y[fit_idx], lower, upper, max_iter=max_iter
+    )
+
+    x_eval = numpy.linspace(x[0], x[-1], num_points)
+    success = fit_idx[converged]
+    y_gauss = gaussian(x_eval[None, :], *(p[:, None] for p in fitted[converged].T))
+    y_gauss[numpy.isnan(y_gauss)] = 0
+    y_gauss[y_gauss < 0] = 0
+    curves[success] = y_gauss
+    pars[success] = fitted[converged]
+    # Failed fits keep the (clipped) starting values, as for `fit_rocking_curve`
+    pars[fit_idx[~converged]] = p0[~converged]
+    if num_points != n_points:
+        curves[fit_idx[~converged]] = numpy.nan
+    pars[fit_idx, 2] *= darfix.config.FWHM_VAL
+
+    return curves, pars
+
+
+def fit_2d_rocking_curves_batched(
+    y: numpy.ndarray,
+    x_values: list | numpy.ndarray,
+    shape: Tuple[int, ...],
+    int_thresh: float | None = None,
+    moments: numpy.ndarray | None = None,
+    max_iter: int = _MAX_ITERATIONS,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Fit a bivariate Gaussian (:func:`darfix.math.bivariate_gaussian`) to every 2D rocking curve of `y` at once.
+
+    :param y: rocking curves, of shape (n_curves, n_points) with n_points = shape[0] * shape[1]
+    :param x_values: values of the two motors for each point, of shape (2, n_points)
+    :param shape: shape of the 2D scan
+    :param int_thresh: Intensity threshold. If not None, only the rocking curves with
+        higher ptp (range of values) are fitted.
+    :param moments: mean along each dimension then standard deviation along each dimension
+        of each rocking curve, of shape (n_curves, 4), to use as starting values, optional
+    :param max_iter: maximal number of iterations of the solver
+
+    :returns: the fitted curves of shape (n_curves, n_points) and the parameters
+        (x0_0, x1_0, FWHM_x0, FWHM_x1, amplitude, correlation, background) of shape (n_curves, 7)
+    """
+    y = numpy.asarray(y, dtype=numpy.float64)
+    x_values = numpy.asarray(x_values, dtype=numpy.float64)
+    n_curves = len(y)
+
+    curves = y.copy()
+    pars = numpy.zeros((n_curves, 7))
+    if n_curves == 0:
+        return curves, pars
+
+    min_y = y.min(axis=1)
+    max_y = y.max(axis=1)
+    ptp_y = max_y - min_y
+    sum_y = y.sum(axis=1)
+    zero_sum = numpy.isclose(sum_y, 0, rtol=_ZERO_SUM_RELATIVE_TOLERANCE)
+    if moments is not None:
+        x0_0, x1_0, x0_alpha, x1_alpha = numpy.asarray(moments, dtype=numpy.float64).T
+    else:
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            x0_0 = y @ x_values[0] / sum_y
+            x1_0 = y @ x_values[1] / sum_y
+            x0_alpha = numpy.sqrt(
+                numpy.sum(y * (x_values[0][None, :] - x0_0[:, None]) ** 2, axis=1)
+                / sum_y
+            )
+            x1_alpha = numpy.sqrt(
+                numpy.sum(y * (x_values[1][None, :] - x1_0[:, None]) ** 2, axis=1)
+                / sum_y
+            )
+    pars[:, 0] = x0_0
+    pars[:, 1] = x1_0
+    pars[:, 2] = x0_alpha
+    pars[:, 3] = x1_alpha
+    pars[:, 4] = ptp_y
+    pars[zero_sum, :4] = numpy.nan
+
+    below_thresh = (
+        ptp_y < int_thresh if int_thresh is not None else numpy.zeros(n_curves, bool)
+    )
+    to_fit = ~zero_sum & ~below_thresh & (x0_alpha != 0) & (x1_alpha != 0)
+    fit_idx = numpy.flatnonzero(to_fit)
+    if fit_idx.size == 0:
+        return curves, pars
+
+    X0, X1 = numpy.meshgrid(
+        x_values[0, : shape[0]], x_values[1].reshape(numpy.flip(shape))[:, 0]
+    )
+    X0 = X0.ravel()
+    X1 = X1.ravel()
+
+    epsilon = 1e-3
+    min_x0, min_x1 = numpy.min(x_values, axis=1)
+    max_x0, max_x1 = numpy.max(x_values, axis=1)
+    lower = numpy.empty((fit_idx.size, 7))
+    upper = numpy.empty((fit_idx.size, 7))
+    lower[:, 0] = min_x0 - epsilon
+    upper[:, 0] = max_x0 + epsilon
+    lower[:, 1] = min_x1 - epsilon
+    upper[:, 1] = max_x1 + epsilon
+    # Strictly positive standard deviations to keep the model defined
+    lower[:, 2:4] = 0
+    upper[:, 2:4] = numpy.inf
+    lower[:, 4] = numpy.minimum(min_y, ptp_y)[fit_idx] - epsilon
+    upper[:, 4] = numpy.maximum(max_y, ptp_y)[fit_idx] + epsilon
+    lower[:, 5] = -1
+    upper[:, 5] = 1
+    lower[:, 6] = -numpy.inf
+    upper[:, 6] = numpy.inf
+
+    p0 = pars[fit_idx]
+    fitted, converged = levenberg_marquardt(
+        _bivariate_gaussian_model(X0, X1),
+        p0,
+        y[fit_idx],
+        lower,
+        upper,
+        max_iter=max_iter,
+    )
+
+    success = fit_idx[converged]
+    curves[success] = bivariate_gaussian(
+        (X0[None, :], X1[None, :]), *(p[:, None] for p in fitted[converged].T)
+    )
+    pars[success] = fitted[converged]
+    # Failed fits keep the starting values, as for `fit_2d_rocking_curve`
+    pars[fit_idx, 2:4] *= darfix.config.FWHM_VAL
+
+    return curves, pars
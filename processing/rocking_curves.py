@@ -11,7 +11,7 @@ import darfix
 from ..math import bivariate_gaussian
 from ..math import gaussian
 
-FitMethod = Literal["trf", "lm", "dogbox"]
+FitMethod = Literal["trf", "lm", "dogbox", "batched"]
 
 _ZERO_SUM_RELATIVE_TOLERANCE = 1e-3
 """ Relative tolerance used to check if the sum of values equals 0. Skips fit if it is the case."""
@@ -28,7 +28,7 @@ def fit_rocking_curve(
     Fit rocking curve.
 
     :param y_values: the first element is the dependent data and the second element are
-        the moments to use as starting values for the fit
+        the moments (mean and standard deviation) to use as starting values for the fit, optional
     :param values: The independent variable where the data is measured, optional
     :param num_points: Number of points to evaluate the data on, optional
     :param nt_thresh: Intensity threshold. If not None, only the rocking curves with
@@ -44,17 +44,18 @@ def fit_rocking_curve(
     x = numpy.asanyarray(x_values) if x_values is not None else numpy.arange(len(y))
     ptp_y = numpy.ptp(y)
     if int_thresh is not None and ptp_y < int_thresh:
-        return y, [0, x[0], 0, min(y)]
-    if moments is not None:
-        p0 = [ptp_y, moments[0], moments[1], min(y)]
-    else:
-        _sum = sum(y)
-        if _sum > 0:
-            mean = sum(x * y) / sum(y)
-            sigma = numpy.sqrt(sum(y * (x - mean) ** 2) / sum(y))
+        return y, [0, x[0], 0, numpy.min(y)]
+    min_y = numpy.min(y)
+    _sum = numpy.sum(y)
+    if _sum > 0:
+        if moments is not None:
+            mean, sigma = moments[0], moments[1]
         else:
-            mean, sigma = numpy.nan, numpy.nan
-        p0 = [ptp_y, mean, sigma, min(y)]
+            mean = numpy.sum(x * y) / _sum
+            sigma = numpy.sqrt(numpy.sum(y * (x - mean) ** 2) / _sum)
+    else:
+        mean, sigma = numpy.nan, numpy.nan
+    p0 = [ptp_y, mean, sigma, min_y]
     if numpy.isnan(mean) or numpy.isnan(sigma):
         return y, p0
     if numpy.isclose(p0[2], 0):
@@ -64,8 +65,13 @@ def fit_rocking_curve(
     epsilon = 1e-2
     bounds = numpy.array(
         [
-            [min(ptp_y, min(y)) - epsilon, min(x) - epsilon, 0, -numpy.inf],
-            [max(max(y), ptp_y) + epsilon, max(x) + epsilon, numpy.inf, numpy.inf],
+            [min(ptp_y, min_y) - epsilon, numpy.min(x) - epsilon, 0, -numpy.inf],
+            [
+                max(numpy.max(y), ptp_y) + epsilon,
+                numpy.max(x) + epsilon,
+                numpy.inf,
+                numpy.inf,
+            ],
         ]
     )
 
@@ -128,19 +134,28 @@ def fit_2d_rocking_curve(
     int_thresh: int | None = None,
     method: FitMethod | None = None,
 ) -> Tuple[numpy.ndarray, numpy.ndarray | list]:
+    """
+    Fit 2D rocking curve.
+
+    :param y_values_and_moments: the first element is the dependent data and the second element are
+        the moments (mean and standard deviation along each dimension) to use as starting values for the fit, optional
+    """
     if method is None:
         method = "trf"
     y, moments = y_values_and_moments
     y = numpy.asanyarray(y)
     ptp_y = numpy.ptp(y)
     x_values = numpy.asanyarray(x_values)
-    sum_y = sum(y)
+    sum_y = numpy.sum(y)
     if numpy.isclose(sum_y, 0, rtol=_ZERO_SUM_RELATIVE_TOLERANCE):
         return y, [numpy.nan, numpy.nan, numpy.nan, numpy.nan, ptp_y, 0, 0]
-    x0_0 = sum(x_values[0] * y) / sum_y
-    x1_0 = sum(x_values[1] * y) / sum_y
-    x0_alpha = numpy.sqrt(sum(y * (x_values[0] - x0_0) ** 2) / sum_y)
-    x1_alpha = numpy.sqrt(sum(y * (x_values[1] - x1_0) ** 2) / sum_y)
+    if moments is not None:
+        x0_0, x1_0, x0_alpha, x1_alpha = moments
+    else:
+        x0_0 = numpy.sum(x_values[0] * y) / sum_y
+        x1_0 = numpy.sum(x_values[1] * y) / sum_y
+        x0_alpha = numpy.sqrt(numpy.sum(y * (x_values[0] - x0_0) ** 2) / sum_y)
+        x1_alpha = numpy.sqrt(numpy.sum(y * (x_values[1] - x1_0) ** 2) / sum_y)
     if (
         (int_thresh is not None and ptp_y < int_thresh)
         or x0_alpha == 0
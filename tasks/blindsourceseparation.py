@@ -12,6 +12,8 @@ from pydantic import Field
 from silx.utils.enum import Enum as _Enum
 
 from darfix import dtypes
+from darfix.decomposition.nmf import NMFSolver
+from darfix.decomposition.rsvd import PCASolver
 from darfix.io.utils import write_components
 
 
@@ -70,6 +72,11 @@ class Inputs(BaseInputModel):
     n_comp: int | MissingData = Field(
         default=MISSING_DATA, description="Number of components to extract"
     )
+    pca_solver: PCASolver | MissingData = MISSING_DATA
+    """Solver of the PCA method: 'full' (default) or 'randomized' (randomized SVD)."""
+    nmf_solver: NMFSolver | MissingData = MISSING_DATA
+    """Solver of the NMF method: 'mu' (multiplicative updates, default) or 'hals'
+    (hierarchical alternating least squares). NICA_NMF uses 'hals' by default."""
     save: bool | MissingData = MISSING_DATA
     processing_order: int | MissingData = MISSING_DATA
 
@@ -101,13 +108,25 @@ class BlindSourceSeparation(
         n_comp = self.get_input_value("n_comp", None)
         method = Method.from_value(self.inputs.method)
         if method == Method.PCA:
-            comp, W = dataset.pca(n_comp, indices=indices)
+            comp, W = dataset.pca(
+                n_comp,
+                indices=indices,
+                solver=self.get_input_value("pca_solver", PCASolver.FULL),
+            )
         elif method == Method.NICA:
             comp, W = dataset.nica(n_comp, indices=indices)
         elif method == Method.NMF:
-            comp, W = dataset.nmf(n_comp, indices=indices)
+            comp, W = dataset.nmf(
+                n_comp,
+                indices=indices,
+                solver=self.get_input_value("nmf_solver", NMFSolver.MU),
+            )
         elif method == Method.NICA_NMF:
-            comp, W = dataset.nica_nmf(n_comp, indices=indices)
+            comp, W = dataset.nica_nmf(
+                n_comp,
+                indices=indices,
+                solver=self.get_input_value("nmf_solver", NMFSolver.HALS),
+            )
         else:
             raise ValueError("BSS method not managed")
         n_comp = comp.shape[0]
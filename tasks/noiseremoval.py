@@ -13,6 +13,7 @@ from darfix.dtypes import Dataset
 
 from ..core.noiseremoval import NoiseRemovalOperation
 from ..core.noiseremoval import apply_noise_removal_operation
+from ..core.noiseremoval import apply_noise_removal_operations
 
 
 class Inputs(BaseInputModel):
@@ -37,6 +38,9 @@ class Inputs(BaseInputModel):
         - 'Operation.MASK': Mask removal operation. Parameters: 'mask' (numpy.ndarray 2D containing 0 and 1 where 0 indicates the pixels to be removed).
         """,
     )
+    fused: bool | MissingData = MISSING_DATA
+    """If True (default), all the operations are applied to each image in a single read and write of the data.
+    If False, the operations are applied one after the other, each one saving a new dataset."""
 
 
 class NoiseRemoval(
@@ -53,6 +57,22 @@ class NoiseRemoval(
             for operation in self.get_input_value("operations", [])
         ]
 
+        if self.get_input_value("fused", True):
+            new_darfix_dataset = apply_noise_removal_operations(
+                input_dataset, operations
+            )
+            self.outputs.dataset = (
+                input_dataset
+                if new_darfix_dataset is None
+                else Dataset(
+                    dataset=new_darfix_dataset,
+                    indices=input_dataset.indices,
+                    bg_dataset=input_dataset.bg_dataset,
+                    bg_indices=input_dataset.bg_indices,
+                )
+            )
+            return
+
         dataset = input_dataset
         for operation in operations:
             new_darfix_dataset = apply_noise_removal_operation(dataset, operation)
@@ -7,6 +7,7 @@ from ewokscore.missing_data import is_missing_data
 from ewokscore.model import BaseInputModel
 from pydantic import ConfigDict
 
+from darfix.decomposition.rsvd import PCASolver
 from darfix.dtypes import Dataset
 
 
@@ -18,6 +19,12 @@ class Inputs(BaseInputModel):
     """Number of principal components to compute."""
     chunk_size: int | MissingData = MISSING_DATA
     """Chunk size for PCA computation."""
+    solver: PCASolver | MissingData = MISSING_DATA
+    """'full' (default) or 'randomized' (randomized SVD, faster for a few components of large stacks)."""
+    oversampling: int | MissingData = MISSING_DATA
+    """Number of additional random vectors of the randomized SVD. Default: 10."""
+    power_iterations: int | MissingData = MISSING_DATA
+    """Number of power iterations of the randomized SVD. Default: 2."""
 
 
 class PCA(
@@ -45,6 +52,11 @@ class PCA(
         if not is_missing_data(chunk_size):
             pca_kwargs["chunk_size"] = chunk_size
 
+        for name in ("solver", "oversampling", "power_iterations"):
+            value = self.get_input_value(name)
+            if not is_missing_data(value):
+                pca_kwargs[name] = value
+
         vals = dataset.dataset.pca(**pca_kwargs)
 
         self.outputs.vals = vals
@@ -21,8 +21,8 @@ class Inputs(BaseInputModel):
     """ Input dataset containing a stack of images """
     int_thresh: float | MissingData = MISSING_DATA
     """If provided, only the rocking curves with higher ptp (peak to peak) value > int_thresh are fitted, others are assumed to be noise and will be discarded"""
-    method: Literal["trf", "lm", "dogbox"] = MISSING_DATA
-    "Method to use for the rocking curves fit. 'trf' is the default method.",
+    method: Literal["trf", "lm", "dogbox", "batched"] = MISSING_DATA
+    "Method to use for the rocking curves fit. 'trf' is the default method. 'batched' fits all pixels at once with a vectorized solver.",
     output_filename: str | MissingData = MISSING_DATA
     """Output filename to save the rocking curves results. Result is not saved if not provided"""
 
@@ -29,8 +29,8 @@ class Inputs(BaseInputModel):
     """ Input dataset containing a stack of images """
     int_thresh: float | MissingData = MISSING_DATA
     """If provided, only the rocking curves with higher ptp (peak to peak) value > int_thresh are fitted, others are assumed to be noise and will be discarded"""
-    method: Literal["trf", "lm", "dogbox", "auto"] = "auto"
-    """Method to use for the rocking curves fit. 'auto' automatically selects the best method based on data characteristics."""
+    method: Literal["trf", "lm", "dogbox", "batched", "auto"] = "auto"
+    """Method to use for the rocking curves fit. 'auto' automatically selects the best method based on data characteristics. 'batched' fits all pixels at once with a vectorized solver."""
     output_filename: str | MissingData = MISSING_DATA
     """Output filename to save the rocking curves results. Result is not saved if not provided"""
     use_optimizations: bool = True
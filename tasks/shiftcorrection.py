@@ -9,6 +9,7 @@ from ewokscore.model import BaseInputModel
 from pydantic import ConfigDict
 
 from darfix.core.shiftcorrection import apply_shift
+from darfix.core.shiftcorrection import find_shift
 from darfix.dtypes import Dataset
 
 
@@ -19,6 +20,22 @@ class Inputs(BaseInputModel):
     shift: Sequence[float] | MissingData = MISSING_DATA
     """Shift to apply to the images. If not provided, dataset will be unchanged."""
     dimension: int | MissingData = MISSING_DATA
+    find_shift: bool | MissingData = MISSING_DATA
+    """If True and `shift` is not provided, the shift is found from the images instead. Default: False."""
+    pyramid_levels: int | MissingData = MISSING_DATA
+    """Number of levels of the multi-resolution shift detection, when `find_shift` is True.
+    0 (default) to find the shift on the full resolution images only."""
+    refinement: str | MissingData = MISSING_DATA
+    """If 'random' or 'genetic', the shift of each image is refined by a random search or a genetic algorithm before being applied.
+    Not supported with `dimension`."""
+    refinement_iterations: int | MissingData = MISSING_DATA
+    """Number of iterations of the random search or of generations of the genetic algorithm. Default: 100."""
+    refinement_population_size: int | MissingData = MISSING_DATA
+    """Number of individuals of the genetic algorithm. Default: 20."""
+    refinement_tol: float | MissingData = MISSING_DATA
+    """If provided, the refinement stops when the best score did not improve by more than this relative tolerance during 10 iterations."""
+    n_workers: int | MissingData = MISSING_DATA
+    """Number of candidate shifts scored in parallel by the refinement. Default: number of CPUs."""
 
 
 class ShiftCorrection(
@@ -31,11 +48,30 @@ class ShiftCorrection(
         shift: Sequence[float] = self.get_input_value("shift", None)
         dimension: int | None = self.get_input_value("dimension", None)
 
+        if shift is None and self.get_input_value("find_shift", False):
+            shift = find_shift(
+                dataset, dimension, self.get_input_value("pyramid_levels", 0)
+            )
+
         if shift is None:
             self.outputs.dataset = dataset
             return
 
-        new_image_dataset = apply_shift(dataset, shift, dimension)
+        refinement: str | None = self.get_input_value("refinement", None)
+        refinement_options = {}
+        if refinement is not None:
+            refinement_options = {
+                "iterations": self.get_input_value("refinement_iterations", 100),
+                "population_size": self.get_input_value(
+                    "refinement_population_size", 20
+                ),
+                "tol": self.get_input_value("refinement_tol", None),
+                "n_workers": self.get_input_value("n_workers", None),
+            }
+
+        new_image_dataset = apply_shift(
+            dataset, shift, dimension, refinement, **refinement_options
+        )
 
         self.outputs.dataset = Dataset(
             dataset=new_image_dataset,
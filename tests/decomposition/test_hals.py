@@ -0,0 +1,43 @@
+import h5py
+import numpy
+
+from darfix.decomposition.hals import HALSNMF
+from darfix.decomposition.matrix import FlattenedStack
+from darfix.decomposition.nmf import NMF
+
+
+def _relative_error(model, X):
+    return numpy.linalg.norm(X - model.W @ model.H) / numpy.linalg.norm(X)
+
+
+def test_fit_transform():
+    rstate = numpy.random.RandomState(0)
+    X = rstate.random((80, 4)) @ rstate.random((4, 300))
+    H = rstate.random((4, 300)) + 10**-4
+    W = rstate.random((80, 4)) + 10**-4
+
+    hals = HALSNMF(X, 4)
+    hals.fit_transform(max_iter=50, H=H.copy(), W=W.copy(), vstep=16)
+    assert numpy.all(hals.H >= 0) and numpy.all(hals.W >= 0)
+
+    nmf = NMF(X, 4)
+    nmf.fit_transform(max_iter=50, H=H.copy(), W=W.copy())
+    assert _relative_error(hals, X) < _relative_error(nmf, X) / 2
+
+
+def test_fit_transform_tol(tmp_path):
+    rstate = numpy.random.RandomState(1)
+    X = rstate.random((40, 3)) @ rstate.random((3, 120))
+    H = rstate.random((3, 120)) + 10**-4
+    W = rstate.random((40, 3)) + 10**-4
+
+    with h5py.File(tmp_path / "data.h5", "w") as h5f:
+        h5f["data"] = X.reshape(40, 10, 12)
+        hals = HALSNMF(FlattenedStack(h5f["data"]), 3)
+        hals.fit_transform(max_iter=1000, H=H, W=W, tol=1e-6, error_step=1)
+
+    assert len(hals.ferr) < 1000
+    assert numpy.all(numpy.diff(hals.ferr) <= 1e-8 * hals.ferr[0])
+    numpy.testing.assert_allclose(
+        hals.ferr[-1], numpy.sum((X - hals.W @ hals.H) ** 2), rtol=1e-6
+    )
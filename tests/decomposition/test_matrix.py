@@ -0,0 +1,32 @@
+import h5py
+import numpy
+import pytest
+
+from darfix.decomposition.matrix import FlattenedStack
+
+
+@pytest.mark.parametrize(
+    "key",
+    (
+        3,
+        slice(1, 5),
+        [4, 0, 2, 2],
+        (slice(None), slice(None)),
+        (slice(2, 6), slice(5, 23)),
+        ([5, 1], slice(7, 30, 4)),
+        (numpy.array([0, 3]), slice(40, 48)),
+        (2, slice(0, 13)),
+        (slice(None), slice(10, 10)),
+    ),
+)
+def test_flattened_stack(tmp_path, key):
+    frames = numpy.random.RandomState(0).random((8, 6, 8))
+    frame_indices = numpy.array([7, 0, 1, 2, 4, 5, 6, 3])
+    expected = frames[frame_indices].reshape(len(frame_indices), -1)
+
+    with h5py.File(tmp_path / "data.h5", "w") as h5f:
+        h5f["data"] = frames
+        matrix = FlattenedStack(h5f["data"], frame_indices)
+        assert matrix.shape == expected.shape
+        assert len(matrix) == len(expected)
+        numpy.testing.assert_array_equal(matrix[key], expected[key])
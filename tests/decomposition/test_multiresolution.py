@@ -0,0 +1,86 @@
+import numpy
+
+from darfix.decomposition.hals import HALSNMF
+from darfix.decomposition.multiresolution import block_average
+from darfix.decomposition.multiresolution import build_pyramid
+from darfix.decomposition.multiresolution import multiresolution_nmf
+from darfix.decomposition.multiresolution import upsample_components
+
+
+def test_block_average():
+    frame = numpy.arange(35, dtype=numpy.uint16).reshape(5, 7)
+    binned = block_average(frame, 2)
+    assert binned.shape == (3, 4)
+    assert binned[0, 0] == numpy.mean(frame[:2, :2])
+    assert binned[2, 3] == frame[4, 6]
+    assert binned[1, 3] == numpy.mean(frame[2:4, 6])
+
+    # No overflow of the integer sums
+    frame = numpy.full((8, 8), 65535, dtype=numpy.uint16)
+    numpy.testing.assert_array_equal(block_average(frame, 8), [[65535]])
+
+
+def test_build_pyramid():
+    frames = numpy.random.RandomState(0).random((3, 9, 6))
+    levels = build_pyramid(frames, 3, (9, 6), [4, 2])
+    assert [level.shape for level in levels] == [(3, 6), (3, 15)]
+    numpy.testing.assert_allclose(levels[1][1], block_average(frames[1], 2).ravel())
+
+
+def test_upsample_components():
+    H = numpy.arange(2 * 3 * 2).reshape(2, 6)
+    upsampled = upsample_components(H, (3, 2), (5, 4), 2)
+    assert upsampled.shape == (2, 20)
+    numpy.testing.assert_array_equal(
+        upsampled[1].reshape(5, 4),
+        numpy.repeat(numpy.repeat(H[1].reshape(3, 2), 2, axis=0), 2, axis=1)[:5],
+    )
+    # The block average of the upsampled components are the components
+    numpy.testing.assert_allclose(
+        block_average(upsampled[0].reshape(5, 4), 2).ravel(), H[0]
+    )
+
+
+def test_multiresolution_nmf():
+    rstate = numpy.random.RandomState(0)
+    # Components constant on blocks of 4x4 pixels: exactly represented at each level
+    components = rstate.random((3, 8, 4)).repeat(4, axis=1).repeat(4, axis=2)
+    X = rstate.random((20, 3)) @ components.reshape(3, -1)
+    frames = X.reshape(20, 32, 16)
+
+    H, W = multiresolution_nmf(iter(frames), 20, (32, 16), 3, [20, 10, 5])
+    assert H.shape == (3, 32 * 16)
+    assert W.shape == (20, 3)
+    assert numpy.all(H >= 0) and numpy.all(W >= 0)
+
+    H, W = multiresolution_nmf(
+        iter(frames), 20, (32, 16), 3, [200, 10], model_class=HALSNMF, tol=1e-6
+    )
+    assert numpy.linalg.norm(X - W @ H) < 0.01 * numpy.linalg.norm(X)
+
+
+def test_multiresolution_nmf_on_disk(tmp_path):
+    """Block-averaged frames not fitting in the memory budget are saved in a file"""
+    rstate = numpy.random.RandomState(0)
+    frames = rstate.random((10, 2)) @ rstate.random((2, 12 * 9))
+    frames = frames.reshape(10, 12, 9).astype(numpy.float32)
+
+    results = []
+    for max_nbytes in (None, 0):
+        numpy.random.seed(0)
+        results.append(
+            multiresolution_nmf(
+                iter(frames),
+                10,
+                (12, 9),
+                2,
+                [10, 5],
+                dtype=numpy.float32,
+                max_nbytes=max_nbytes,
+                tmp_dir=tmp_path,
+            )
+        )
+    for in_memory, on_disk in zip(*results):
+        assert on_disk.dtype == numpy.float32
+        numpy.testing.assert_allclose(on_disk, in_memory, rtol=1e-5)
+    assert list(tmp_path.iterdir()) == []
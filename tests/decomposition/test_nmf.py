@@ -1,4 +1,6 @@
+import h5py
 import numpy
+import pytest
 
 from darfix.decomposition.nmf import NMF
 from darfix.tests.decomposition.utils import images
@@ -32,3 +34,28 @@ def test_fit_transform():
                 found = True
                 break
         assert found is True
+
+
+@pytest.mark.parametrize("dtype", (numpy.float64, numpy.float32))
+def test_fit_transform_blocks(tmp_path, dtype):
+    """Blocks of rows read from disk, with the error computed in the same pass"""
+    rstate = numpy.random.RandomState(0)
+    X = rstate.random((60, 3)) @ rstate.random((3, 200))
+    indices = [0, 1, 2, 5, 8, 13, 21, 34, 55]
+    H = rstate.random((3, 200)) + 10**-4
+    W = rstate.random((len(indices), 3)) + 10**-4
+
+    reference = NMF(X[indices], 3)
+    reference.fit_transform(max_iter=20, H=H.copy(), W=W.copy(), vstep=len(X))
+
+    with h5py.File(tmp_path / "data.h5", "w") as h5f:
+        h5f.create_dataset("data", data=X, chunks=(2, 200))
+        nmf = NMF(h5f["data"], 3, indices=indices, dtype=dtype)
+        nmf.fit_transform(max_iter=20, H=H.copy(), W=W.copy(), vstep=3, error_step=1)
+
+    assert nmf.H.dtype == dtype and nmf.W.dtype == dtype
+    rtol = 1e-4 if dtype == numpy.float32 else 1e-10
+    numpy.testing.assert_allclose(nmf.H, reference.H, rtol=rtol)
+    numpy.testing.assert_allclose(nmf.W, reference.W, rtol=rtol)
+    error = numpy.sum((X[indices] - nmf.W.astype(float) @ nmf.H.astype(float)) ** 2)
+    numpy.testing.assert_allclose(nmf.ferr[-1], error, rtol=1e-3)
@@ -0,0 +1,55 @@
+import h5py
+import numpy
+import pytest
+from sklearn.decomposition import PCA
+
+from darfix.decomposition.matrix import FlattenedStack
+from darfix.decomposition.rsvd import RandomizedPCA
+
+
+@pytest.fixture
+def data():
+    rstate = numpy.random.RandomState(seed=1000)
+    return rstate.random((120, 4)) @ rstate.random((4, 600)) + 0.01 * rstate.random(
+        (120, 600)
+    )
+
+
+def _assert_same_pca(model, data, num_components):
+    pca = PCA(num_components)
+    W = pca.fit_transform(data)
+    numpy.testing.assert_allclose(model.singular_values, pca.singular_values_)
+    signs = numpy.sign(numpy.sum(model.H * pca.components_, axis=1))
+    numpy.testing.assert_allclose(
+        model.H, signs[:, numpy.newaxis] * pca.components_, atol=1e-10
+    )
+    numpy.testing.assert_allclose(model.W, signs * W, atol=1e-8)
+
+
+def test_fit_transform(data):
+    model = RandomizedPCA(data, 3, chunk_size=32, random_state=0)
+    assert model.singular_values is None
+    model.fit_transform()
+    assert model.H.shape == (3, data.shape[1])
+    assert model.W.shape == (data.shape[0], 3)
+    _assert_same_pca(model, data, 3)
+
+
+def test_fit_transform_indices(data):
+    indices = [2, 5, 7, 11, 30, 31, 32, 60, 90, 91, 100, 119]
+    model = RandomizedPCA(data, 2, indices=indices, chunk_size=5, random_state=0)
+    model.fit_transform()
+    _assert_same_pca(model, data[indices], 2)
+
+
+def test_fit_transform_on_disk(tmp_path, data):
+    with h5py.File(tmp_path / "data.h5", "w") as h5f:
+        h5f["data"] = data.reshape(len(data), 20, 30)
+        model = RandomizedPCA(
+            FlattenedStack(h5f["data"]),
+            3,
+            oversampling=5,
+            random_state=0,
+        )
+        model.fit_transform()
+    _assert_same_pca(model, data, 3)
@@ -0,0 +1,44 @@
+import numpy
+import pytest
+
+from darfix.core.background import compute_background
+
+
+@pytest.mark.parametrize("dtype", ("uint16", "int32", "float32", "float64"))
+@pytest.mark.parametrize("n_frames", (1, 6, 7))
+@pytest.mark.parametrize("max_nbytes", (100, None))
+def test_median(dtype, n_frames, max_nbytes):
+    rs = numpy.random.RandomState(0)
+    frames = (rs.normal(0, 100, (n_frames, 5, 6)) + 200).astype(dtype)
+    # Repeated values
+    frames[:, 0, 0] = frames[0, 0, 0]
+    frames[: n_frames // 2, 1, 1] = frames[-1, 1, 1]
+
+    median = compute_background(frames, n_frames, "median", max_nbytes=max_nbytes)
+    expected = numpy.median(frames, axis=0)
+    assert median.dtype == expected.dtype
+    numpy.testing.assert_array_equal(median, expected)
+
+
+def test_median_nan():
+    frames = numpy.random.normal(size=(6, 3, 4))
+    frames[2, 1, 1] = numpy.nan
+    median = compute_background(frames, len(frames), "median", max_nbytes=100)
+    numpy.testing.assert_array_equal(median, numpy.median(frames, axis=0))
+
+
+def test_mean():
+    frames = numpy.random.randint(0, 1000, (6, 3, 4)).astype(numpy.uint16)
+    numpy.testing.assert_allclose(
+        compute_background(frames, len(frames), "mean"), frames.mean(axis=0)
+    )
+
+
+def test_stop():
+    frames = numpy.random.normal(size=(6, 3, 4))
+    assert (
+        compute_background(
+            frames, len(frames), "median", max_nbytes=100, is_running=lambda: False
+        )
+        is None
+    )
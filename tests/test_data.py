@@ -1,10 +1,13 @@
 import os
 
+import h5py
 import numpy
 import pytest
 from silx.io.url import DataUrl
 
+import darfix
 from darfix.core.data import Data
+from darfix.io import hdf5
 
 
 @pytest.fixture
@@ -182,3 +185,106 @@ def test_empty_data(in_memory):
     assert data.ndim == 3
     assert data.shape == (0, 0, 0)
     assert data.copy().tolist() == []
+
+
+@pytest.mark.parametrize("layout", ("tile", "frame", "contiguous"))
+def test_iter_tiles_from_hdf5(tmp_path, monkeypatch, layout):
+    test_data = numpy.random.rand(10, 60, 70)
+    data = test_data.view(Data)
+    data.urls = None
+    filename = os.path.join(tmp_path, "data.hdf5")
+    monkeypatch.setattr(darfix.config, "HDF5_CHUNK_LAYOUT", layout)
+    # Tile chunks of 10 frames x 20 x 20 pixels
+    monkeypatch.setattr(hdf5, "_CHUNK_TARGET_NBYTES", 10 * 20 * 20 * 8)
+    data.save(filename)
+    with h5py.File(filename, "r") as h5f:
+        chunks = h5f["dataset"].chunks
+    assert (
+        chunks
+        == {
+            "tile": (10, 20, 20),
+            "frame": (1, 60, 70),
+            "contiguous": None,
+        }[layout]
+    )
+
+    # Reversed order with a repeated frame
+    indices = [9, 7, 7, 3, 0]
+    on_disk = Data(data.urls[indices], [None] * len(indices), in_memory=False)
+    in_memory = Data(data.urls[indices], [None] * len(indices), in_memory=True)
+
+    tiles = on_disk.tile_slices((16, 16))
+    if layout == "tile":
+        assert tiles[1] == (slice(0, 20), slice(20, 40))
+    else:
+        assert tiles == in_memory.tile_slices((16, 16))
+
+    reconstructed = numpy.zeros(test_data[indices].shape)
+    for tile, stack in on_disk.iter_tiles((16, 16)):
+        assert stack.shape[0] == len(indices)
+        reconstructed[(slice(None),) + tile] = stack
+    numpy.testing.assert_array_equal(reconstructed, test_data[indices])
+
+    for tile, stack in in_memory.iter_tiles((16, 16)):
+        numpy.testing.assert_array_equal(
+            stack, test_data[indices][(slice(None),) + tile]
+        )
+
+
+def test_iter_tiles_from_files(test_arrays):
+    urls, metadata, test_data = test_arrays
+    data = Data(urls=urls, metadata=metadata, in_memory=False)
+
+    reconstructed = numpy.zeros(test_data.shape)
+    for tile, stack in data.iter_tiles((30, 40)):
+        reconstructed[(slice(None),) + tile] = stack
+    numpy.testing.assert_array_equal(reconstructed, test_data)
+
+
+def test_iter_on_disk(test_arrays):
+    urls, metadata, test_data = test_arrays
+    data = Data(urls=urls, metadata=metadata, in_memory=False)
+
+    frames = list(data)
+    assert len(frames) == len(test_data)
+    for frame, expected in zip(frames, test_data):
+        numpy.testing.assert_array_equal(frame, expected)
+    numpy.testing.assert_allclose(data.sum(axis=0), test_data.sum(axis=0))
+    numpy.testing.assert_allclose(data.sum(axis=1), test_data.sum(axis=(1, 2)))
+
+
+def test_open_as_matrix(tmp_path, test_arrays):
+    urls, metadata, test_data = test_arrays
+    expected = test_data.reshape(len(test_data), -1)
+
+    # In memory: view of the data
+    data = Data(urls=urls, metadata=metadata)
+    with data.open_as_matrix(str(tmp_path)) as matrix:
+        assert numpy.shares_memory(matrix, data)
+        numpy.testing.assert_array_equal(matrix, expected)
+
+    # Frames of a single HDF5 dataset: flattened when read
+    filename = str(tmp_path / "stack.h5")
+    with h5py.File(filename, "w") as h5f:
+        h5f["data"] = test_data
+    stack_urls = [
+        DataUrl(file_path=filename, data_path="data", data_slice=i, scheme="silx")
+        for i in range(len(test_data))
+    ]
+    data = Data(urls=stack_urls, metadata=metadata, in_memory=False)
+    with data.open_as_matrix(str(tmp_path)) as matrix:
+        assert not isinstance(matrix, h5py.Dataset)
+        numpy.testing.assert_array_equal(matrix[2:5, 150:250], expected[2:5, 150:250])
+    assert not os.path.exists(tmp_path / "data.hdf5")
+
+    # Other files: flattened HDF5 file, reused while the frames are unchanged
+    data = Data(urls=urls, metadata=metadata, in_memory=False)
+    with data.open_as_matrix(str(tmp_path)) as matrix:
+        numpy.testing.assert_array_equal(matrix[:, :], expected)
+        matrix[0] = 0
+    with data.open_as_matrix(str(tmp_path)) as matrix:
+        numpy.testing.assert_array_equal(matrix[0], 0)
+    numpy.save(urls[0].file_path(), test_data[0])
+    os.utime(urls[0].file_path(), ns=(0, 0))
+    with data.open_as_matrix(str(tmp_path)) as matrix:
+        numpy.testing.assert_array_equal(matrix[:, :], expected)
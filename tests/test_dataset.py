@@ -526,6 +526,23 @@ class _BaseDatasetTest:
         self.assertEqual(H.shape, (n_components, len(dataset.data[0].flatten())))
         self.assertEqual(W.shape, (5, n_components))
 
+    def test_pca_randomized(self):
+        """Tests PCA with the randomized solver"""
+
+        for dataset in (
+            self.dataset,
+            self.createRandomDataset(dims=(100, 100), nb_frames=10, in_memory=False),
+        ):
+            n_components = 2
+            H, W = dataset.pca(num_components=n_components, solver="randomized")
+            self.assertEqual(H.shape, (n_components, len(dataset.data[0].flatten())))
+            self.assertEqual(W.shape, (dataset.nframes, n_components))
+
+            vals = dataset.pca(return_vals=True, solver="randomized")
+            numpy.testing.assert_allclose(
+                vals, dataset.pca(return_vals=True)[: len(vals)], atol=1e-10
+            )
+
     def test_nmf_in_memory(self):
         """Tests NMF with data in memory"""
 
@@ -556,6 +573,7 @@ class _BaseDatasetTest:
 
         self.assertEqual(H.shape, (num_components, len(dataset.data[0].flatten())))
         self.assertEqual(W.shape, (dataset.nframes, num_components))
+        self.assertFalse(os.path.exists(os.path.join(dataset.dir, "waterfall")))
 
         n_components = 4
         indices = numpy.random.choice(10, size=8, replace=False)
@@ -564,6 +582,28 @@ class _BaseDatasetTest:
         self.assertEqual(H.shape, (n_components, len(dataset.data[0].flatten())))
         self.assertEqual(W.shape, (len(indices), n_components))
 
+    def test_nmf_hals(self):
+        """Tests NMF with the HALS solver, in memory and on disk"""
+
+        for dataset in (
+            self.dataset,
+            self.createRandomDataset(dims=(100, 100), nb_frames=10, in_memory=False),
+        ):
+            num_components = 2
+            H, W = dataset.nmf(num_components, solver="hals", tol=1e-4)
+            self.assertEqual(H.shape, (num_components, len(dataset.data[0].flatten())))
+            self.assertEqual(W.shape, (dataset.nframes, num_components))
+
+            H, W = dataset.nmf(
+                num_components, solver="hals", waterfall=[20, 10], indices=[0, 2]
+            )
+            self.assertEqual(H.shape, (num_components, len(dataset.data[0].flatten())))
+            self.assertEqual(W.shape, (2, num_components))
+
+            H, W = dataset.nica_nmf(num_components, num_iter=20, indices=[0, 2])
+            self.assertEqual(H.shape[1], len(dataset.data[0].flatten()))
+            self.assertEqual(W.shape, (2, H.shape[0]))
+
     def test_nica_in_memory(self):
         """Tests NICA with data in memory"""
 
@@ -0,0 +1,103 @@
+import pickle
+
+import h5py
+import numpy
+import pytest
+from silx.io.url import DataUrl
+
+from darfix.io.frame_urls import FrameUrls
+from darfix.io.hdf5 import hdf5_file_cache
+
+
+def _hdf5_url(file_path, index):
+    return DataUrl(
+        file_path=file_path, data_path="/dataset", data_slice=index, scheme="silx"
+    )
+
+
+def test_from_urls():
+    urls = numpy.empty((2, 3), dtype=object)
+    for i in range(6):
+        urls.flat[i] = _hdf5_url("/tmp/a.h5" if i % 2 else "/tmp/b.h5", i)
+    urls[1, 2] = DataUrl(file_path="/tmp/c.edf", scheme="fabio")
+
+    frame_urls = FrameUrls.from_urls(urls)
+    assert frame_urls.shape == (2, 3)
+    assert frame_urls[0, 1] == urls[0, 1]
+    assert frame_urls[1, 2] == urls[1, 2]
+    assert list(frame_urls.flat) == list(urls.flat)
+    assert frame_urls.file_paths() == [url.file_path() for url in urls.flat]
+    numpy.testing.assert_array_equal(numpy.array(frame_urls), urls)
+
+    flat = frame_urls.reshape((6,))
+    assert flat == frame_urls.flatten()
+    assert list(flat[::2].flat) == list(urls.flat[::2])
+    assert list(frame_urls.take([0, 2], axis=1).flat) == list(
+        urls.take([0, 2], axis=1).flat
+    )
+
+
+def test_set_urls():
+    frame_urls = FrameUrls.from_hdf5_dataset("/tmp/a.h5", "/dataset", range(5))
+    new_urls = frame_urls.copy()
+    new_urls[[1, 3]] = FrameUrls.from_hdf5_dataset("/tmp/b.h5", "/dataset", [1, 3])
+    new_urls[4] = DataUrl(file_path="/tmp/c.npy", scheme="fabio")
+
+    assert new_urls[0] == frame_urls[0] == _hdf5_url("/tmp/a.h5", 0)
+    assert new_urls[1] == _hdf5_url("/tmp/b.h5", 1)
+    assert new_urls[3] == _hdf5_url("/tmp/b.h5", 3)
+    assert new_urls[4] == DataUrl(file_path="/tmp/c.npy", scheme="fabio")
+    assert frame_urls[1] == _hdf5_url("/tmp/a.h5", 1)
+
+
+def test_hdf5_dataset():
+    frame_urls = FrameUrls.from_hdf5_dataset("/tmp/a.h5", "/dataset", [3, 1, 2])
+    file_path, data_path, indices = frame_urls.hdf5_dataset()
+    assert (file_path, data_path) == ("/tmp/a.h5", "/dataset")
+    numpy.testing.assert_array_equal(indices, [3, 1, 2])
+
+    frame_urls[0] = DataUrl(file_path="/tmp/c.npy", scheme="fabio")
+    assert frame_urls.hdf5_dataset() is None
+    assert FrameUrls.from_files(["/tmp/c.edf"]).hdf5_dataset() is None
+
+
+def test_pickle():
+    frame_urls = FrameUrls.from_hdf5_dataset(
+        "/tmp/a.h5", "/dataset", numpy.arange(100000)
+    )
+    pickled = pickle.dumps(frame_urls)
+    assert len(pickled) < 2 * 16 * frame_urls.size
+    assert pickle.loads(pickled) == frame_urls
+
+
+def test_contiguous_runs():
+    frame_urls = FrameUrls.from_hdf5_dataset(
+        "/tmp/a.h5", "/dataset", [0, 1, 2, 5, 6, 4, 7]
+    )
+    frame_urls[6] = _hdf5_url("/tmp/b.h5", 7)
+    assert frame_urls.contiguous_runs() == [(0, 3), (3, 5), (5, 6), (6, 7)]
+    assert FrameUrls.from_files(["/tmp/a.edf", "/tmp/b.edf"]).contiguous_runs() == [
+        (0, 1),
+        (1, 2),
+    ]
+
+
+@pytest.mark.parametrize("max_slab_nbytes", (None, 2 * 8 * 4 * 5))
+def test_read_frames(tmp_path, max_slab_nbytes):
+    frames = numpy.random.random((10, 4, 5))
+    file_path = str(tmp_path / "frames.h5")
+    with h5py.File(file_path, "w") as h5f:
+        h5f["dataset"] = frames
+    npy_path = str(tmp_path / "frame.npy")
+    numpy.save(npy_path, frames[0] + 1)
+
+    indices = [2, 3, 4, 5, 9, 8, 0, 1]
+    frame_urls = FrameUrls.from_hdf5_dataset(file_path, "/dataset", indices)
+    frame_urls[5] = DataUrl(file_path=npy_path, scheme="fabio")
+    expected = frames[indices]
+    expected[5] = frames[0] + 1
+
+    out = numpy.empty((len(indices), 4, 5))
+    with hdf5_file_cache() as hdf5_cache:
+        hdf5_cache.read_frames(frame_urls, out, max_slab_nbytes=max_slab_nbytes)
+    numpy.testing.assert_array_equal(out, expected)
@@ -142,3 +142,22 @@ def test_fit_scores(ga):
 
     assert len(ga.scores_best) == 10
     assert len(ga.scores_avg) == 10
+
+
+def test_fit_converged(ga):
+    """
+    Tests that the fit stops when the best score does not improve.
+    """
+    ga.fit((0, 0), [0, 0], 10, 10, tol=0, patience=2)
+
+    assert len(ga.scores_best) == 3
+
+
+def test_fit_fft(ga):
+    """
+    Tests the genetic algorithm scoring the individuals in Fourier space.
+    """
+    ga.n_workers = 2
+    ga.fit((0, 0), [0, 0], 5, 10, shift_approach="fft")
+
+    numpy.testing.assert_allclose(ga.support_, ga.optimal_shift, atol=1e-12)
@@ -203,6 +203,27 @@ def test_hot_pixel_removal(data):
     numpy.testing.assert_array_equal(expected, new_data)
 
 
+@pytest.mark.parametrize("dtype", (numpy.uint16, numpy.float64))
+@pytest.mark.parametrize("n_threads", (1, 3))
+def test_hot_pixel_removal_by_blocks(dtype, n_threads):
+    """Tests the hot pixel removal by blocks gives the same result as frame by frame"""
+    data = numpy.random.RandomState(0).randint(0, 100, (10, 20, 30)).astype(dtype)
+    data[:, 5, 7] = 1000
+    expected = numpy.array(
+        [imageOperations.hot_pixel_removal_2D(frame) for frame in data], dtype=dtype
+    )
+
+    new_data = imageOperations.hot_pixel_removal_3D(data, n_threads=n_threads)
+    assert new_data.dtype == data.dtype
+    numpy.testing.assert_array_equal(new_data, expected)
+
+    with imageOperations.HotPixelRemoval(
+        data.shape[1:], data.dtype, n_threads=n_threads
+    ) as remover:
+        remover(data[:7], out=data[:7])
+    numpy.testing.assert_array_equal(data[:7], expected[:7])
+
+
 def test_threshold_removal(data):
     """Tests the threshold of the data"""
 
@@ -7,6 +7,7 @@ except ImportError:
     scipy = None
 
 from darfix.core import imageRegistration
+from darfix.core.autofocus import normalized_variance
 from darfix.tests import utils
 
 
@@ -93,6 +94,21 @@ def test_find_shift(data):
         numpy.testing.assert_allclose(shift, -computed_shift, rtol=1e-04)
 
 
+@pytest.mark.skipif(scipy is None, reason="scipy is missing")
+def test_find_shift_pyramid(rstate):
+    """Tests the multi-resolution shift detection against the full resolution one"""
+    img1 = scipy.ndimage.gaussian_filter(rstate.uniform(0, 1000, (256, 200)), 3)
+    img2 = numpy.fft.ifftn(
+        scipy.ndimage.fourier_shift(numpy.fft.fftn(img1), [-7.337, 12.42])
+    ).real
+
+    shift = imageRegistration.find_shift_pyramid(img1, img2, levels=2)
+    numpy.testing.assert_allclose(shift, [7.337, -12.42], atol=2e-3)
+    numpy.testing.assert_allclose(
+        shift, imageRegistration.find_shift(img1, img2), atol=2e-3
+    )
+
+
 def test_apply_shift(data):
     """Tests the correct apply of the shift"""
     shift = (0, 0)
@@ -218,6 +234,74 @@ def test_shift_detection_float(rstate):
     numpy.testing.assert_allclose(shift, numpy.round(optimal_shift, 1))
 
 
+@pytest.mark.skipif(scipy is None, reason="scipy is missing")
+def test_shift_detection_fourier(rstate):
+    """Tests the shift detection with the search in Fourier space"""
+    first_frame = numpy.zeros((100, 100))
+    first_frame[25:75, 25:75] = rstate.randint(50, 300, size=(50, 50))
+    data = [first_frame]
+    shift = [0.5, 0.2]
+    for i in range(9):
+        data += [
+            numpy.fft.ifftn(
+                scipy.ndimage.fourier_shift(numpy.fft.fftn(data[-1]), shift)
+            ).real
+        ]
+    data = numpy.asanyarray(data, dtype=numpy.int16)
+    optimal_shift = imageRegistration.shift_detection(data, 100, search="fourier")
+    shift = [
+        [0, -0.5, -1, -1.5, -2, -2.5, -3, -3.5, -4, -4.5],
+        [0, -0.2, -0.4, -0.6, -0.8, -1, -1.2, -1.4, -1.6, -1.8],
+    ]
+
+    numpy.testing.assert_allclose(shift, numpy.round(optimal_shift, 1))
+
+
+def test_fourier_shift_score(rstate):
+    """Tests the score of the shifts computed in Fourier space against the shifted images"""
+    # Odd frame sizes: no Nyquist frequency, whose shift is ambiguous
+    data = rstate.uniform(1, 100, (6, 15, 11))
+    v = imageRegistration.normalize(numpy.array([1.0, -0.5]))
+    frames_indices = [0, 2, 3, 5]
+    score = imageRegistration._FourierShiftScore(data, v, frames_indices, 2**30)
+    for h in (0, 0.3, 1.7):
+        result = numpy.zeros(data[0].shape)
+        for iFrame in frames_indices:
+            result += imageRegistration._numpy_fft_shift(
+                data[iFrame], *(h * v * iFrame)[::-1]
+            )
+        numpy.testing.assert_allclose(score(h), normalized_variance(result), rtol=1e-4)
+
+
+def test_shift_score(rstate):
+    """Tests the score of shifts computed in Fourier space against the shifted images"""
+    # Odd frame sizes: no Nyquist frequency, whose shift is ambiguous
+    data = rstate.uniform(1, 100, (5, 15, 11))
+    population = rstate.uniform(-2, 2, (3, 2, len(data)))
+    with imageRegistration.ShiftScore(data, "fft", n_threads=2) as shift_score:
+        scores = shift_score.score_population(population)
+    for n_shift, score in zip(population, scores):
+        result = numpy.zeros(data[0].shape)
+        for frame, shift in zip(data, n_shift.T):
+            result += imageRegistration._numpy_fft_shift(frame, shift[1], shift[0])
+        numpy.testing.assert_allclose(score, normalized_variance(result), rtol=1e-4)
+
+
+def test_random_search_workers(rstate):
+    """Tests that the random search gives the same result in parallel"""
+    data = rstate.uniform(1, 100, (5, 15, 11))
+    optimal_shift = numpy.outer([0.5, 0.2], numpy.arange(len(data)))
+    results = []
+    for n_workers in (1, 3):
+        numpy.random.seed(0)
+        results.append(
+            imageRegistration.random_search(
+                data, optimal_shift, 7, shift_approach="fft", n_workers=n_workers
+            )
+        )
+    numpy.testing.assert_array_equal(*results)
+
+
 def test_shift_correction00(data):
     """Tests the shift correction of a [0,0] shift."""
 
@@ -364,6 +448,26 @@ def test_shift_correction_float(data):
     numpy.testing.assert_allclose(new_data, expected, rtol=1e-05)
 
 
+@pytest.mark.parametrize("frame_shape", [(5, 5), (16, 12)])
+def test_fourier_shift(rstate, frame_shape):
+    """Tests the shift of blocks of frames against the shift of each frame"""
+    frames = rstate.uniform(0, 100, (7,) + frame_shape).astype(numpy.float32)
+    shifts = rstate.uniform(-3, 3, (2, len(frames)))
+
+    shifter = imageRegistration.FourierShift(frame_shape, n_threads=2)
+    shifted = shifter(frames, shifts)
+    assert shifted.dtype == numpy.float32
+
+    for frame, shift, shifted_frame in zip(frames, shifts.T, shifted):
+        expected = imageRegistration._numpy_fft_shift(frame, shift[1], shift[0])
+        numpy.testing.assert_allclose(shifted_frame, expected, rtol=1e-4, atol=1e-3)
+
+    shifted_frames = list(
+        imageRegistration.iter_shifted_frames(iter(frames), shifts, "fft")
+    )
+    numpy.testing.assert_allclose(shifted_frames, shifted)
+
+
 @pytest.mark.skipif(scipy is None, reason="scipy is missing")
 def test_shift_detection0(tmpdir, first_frame, header):
     """Tests the shift detection using only an axis (dimension).
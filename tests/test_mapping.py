@@ -71,6 +71,25 @@ def test_moments():
         plt.show()
 
 
+def test_mean_and_std():
+    """Tests the mean and standard deviation match the unsmoothed moments"""
+    rs = numpy.random.RandomState(100)
+    x = numpy.linspace(-2, 6, 50)
+    weights = rs.uniform(0, 10, (50, 3, 4))
+    # Single point and null rocking curves
+    weights[:, 0, 0] = 0
+    weights[10, 0, 0] = 5
+    weights[:, 0, 1] = 0
+
+    mean, std = mapping.compute_mean_and_std(x, weights)
+    mean0, fwhm0, _, _ = mapping.compute_moments(x, weights, smooth=False)
+
+    numpy.testing.assert_allclose(mean, mean0)
+    numpy.testing.assert_allclose(std * darfix.config.FWHM_VAL, fwhm0)
+    assert std[0, 0] == 0
+    assert numpy.isnan(mean[0, 1]) and numpy.isnan(std[0, 1])
+
+
 def test_rsm():
     """Tests RSM"""
     data = numpy.random.random(size=(3, 10, 10))
@@ -129,3 +148,69 @@ def test_peak_position_values():
     image = mapping.compute_peak_position(data, values)
 
     assert image[0, 0] == values[numpy.argmax(data[:, 0, 0])]
+
+
+def test_moments_accumulator():
+    """Tests the moments of several dimensions are accumulated frame by frame"""
+    rs = numpy.random.RandomState(100)
+    weights = rs.uniform(0, 10, (30, 5, 6))
+    values = [numpy.linspace(-2, 6, 30), rs.uniform(10, 11, 30)]
+
+    accumulator = mapping.MomentsAccumulator(values, weights.shape[1:])
+    accumulator.add(weights[:7])
+    accumulator.add_frames(iter(weights[7:]))
+    moments = accumulator.moments(smooth=False)
+
+    assert len(moments) == 2
+    for x, (mean, fwhm, skew, kurt) in zip(values, moments):
+        mean0, fwhm0, skew0, kurt0 = _reference_moments(x, weights)
+        numpy.testing.assert_allclose(mean, mean0)
+        numpy.testing.assert_allclose(fwhm, fwhm0)
+        numpy.testing.assert_allclose(skew, skew0)
+        numpy.testing.assert_allclose(kurt, kurt0)
+
+
+def test_moments_accumulator_degenerate():
+    """Rocking curves with one or two non-zero frames, far from the center of the values"""
+    rs = numpy.random.RandomState(0)
+    n_frames = 40
+    values = numpy.linspace(-2, 6, n_frames)
+    frames = rs.randint(0, n_frames - 1, (2, 20))
+    single = numpy.zeros((n_frames, 2, 20))
+    single[frames[0], 0, numpy.arange(20)] = rs.uniform(1, 1000, 20)
+    single[frames[0], 1, numpy.arange(20)] = 1e-6
+    double = numpy.zeros((n_frames, 2, 20))
+    double[frames[1], 0, numpy.arange(20)] = rs.uniform(1, 1000, 20)
+    double[frames[1] + 1, 0, numpy.arange(20)] = rs.uniform(1, 1000, 20)
+    double[frames[1], 1, numpy.arange(20)] = 7.0
+    double[frames[1] + 1, 1, numpy.arange(20)] = 7.0
+
+    for weights in (single, double):
+        accumulator = mapping.MomentsAccumulator(values, weights.shape[1:])
+        accumulator.add(weights)
+        ((mean, fwhm, skew, kurt),) = accumulator.moments(smooth=False)
+        mean0, fwhm0, skew0, kurt0 = _reference_moments(values, weights)
+        numpy.testing.assert_allclose(mean, mean0)
+        numpy.testing.assert_allclose(fwhm, fwhm0, atol=1e-6)
+        if weights is single:
+            # The variance is 0: skewness and kurtosis are not defined
+            numpy.testing.assert_array_equal(fwhm, 0)
+            assert numpy.all(numpy.isnan(skew)) and numpy.all(numpy.isnan(kurt))
+        else:
+            numpy.testing.assert_allclose(skew, skew0, atol=1e-6)
+            numpy.testing.assert_allclose(kurt, kurt0, atol=1e-6)
+            # Two points with the same weight
+            numpy.testing.assert_allclose(kurt[1], -2)
+
+
+def _reference_moments(values, weights):
+    """Moments computed in several passes, as :func:`darfix.core.mapping.compute_moments` of darfix 2.1"""
+    x = numpy.asarray(values)[:, None, None]
+    wsum = weights.sum(axis=0)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        mean = (weights * x).sum(axis=0) / wsum
+        sigma = numpy.sqrt((weights * (x - mean) ** 2).sum(axis=0) / wsum)
+        resid = (x - mean) / sigma
+        skew = (weights * resid**3).sum(axis=0) / wsum
+        kurt = (weights * resid**4).sum(axis=0) / wsum - 3
+    return mean, sigma * darfix.config.FWHM_VAL, skew, kurt
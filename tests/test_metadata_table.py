@@ -0,0 +1,76 @@
+import numpy
+
+from darfix.core.metadata_table import POSITIONER_METADATA
+from darfix.core.metadata_table import MetadataTable
+
+
+class _MetadataReader:
+    def __init__(self, metadata: dict):
+        self._metadata = metadata
+
+    def get_value(self, kind, name):
+        return numpy.array([self._metadata[name]])
+
+    def get_keys(self, kind):
+        assert kind == POSITIONER_METADATA
+        return tuple(self._metadata)
+
+
+def test_from_columns():
+    table = MetadataTable.from_columns(
+        {"mainx": 3.0, "diffry": numpy.arange(6.0), "obpitch": numpy.arange(4.0)},
+        nframes=6,
+    )
+    assert table.shape == (6,)
+    assert table.keys() == ["mainx", "diffry", "obpitch"]
+    numpy.testing.assert_array_equal(table.values("mainx"), [3.0] * 6)
+    numpy.testing.assert_array_equal(table.values("diffry"), numpy.arange(6.0))
+    numpy.testing.assert_array_equal(table.values("obpitch"), [0, 1, 2, 3, 3, 3])
+    numpy.testing.assert_array_equal(
+        table.values("obpitch", take_previous_when_missing=False),
+        [0, 1, 2, 3, numpy.nan, numpy.nan],
+    )
+    numpy.testing.assert_array_equal(table.values("unknown"), [numpy.nan] * 6)
+
+
+def test_slicing():
+    table = MetadataTable.from_columns({"diffry": numpy.arange(6.0)}, nframes=6)
+    table = table.reshape((2, 3))
+    assert table.shape == (2, 3)
+    numpy.testing.assert_array_equal(table[1].values("diffry"), [3, 4, 5])
+    numpy.testing.assert_array_equal(table[:, 1].values("diffry"), [1, 4])
+    numpy.testing.assert_array_equal(
+        table.swapaxes(0, 1).flatten().values("diffry"), [0, 3, 1, 4, 2, 5]
+    )
+    numpy.testing.assert_array_equal(
+        table.take([2, 0], axis=1).values("diffry"), [2, 0, 5, 3]
+    )
+    assert table[1, 2] == {"diffry": 5}
+    assert table.flatten()[[0, 1]] == table[0, :2]
+
+
+def test_ravel():
+    table = MetadataTable.from_columns({"diffry": numpy.arange(6.0)}, nframes=6)
+    table = table.reshape((2, 3))
+    raveled = table.ravel()
+    assert raveled == table.flatten()
+    assert numpy.shares_memory(raveled._columns["diffry"], table._columns["diffry"])
+    numpy.testing.assert_array_equal(
+        table.swapaxes(0, 1).ravel().values("diffry"), [0, 3, 1, 4, 2, 5]
+    )
+
+
+def test_from_readers():
+    readers = [
+        _MetadataReader({"diffry": 0.5, "obx": 1.0}),
+        _MetadataReader({"diffry": 1.5}),
+        _MetadataReader({"diffry": 2.5, "obx": 3.0}),
+    ]
+    assert MetadataTable.is_metadata_readers(readers)
+    assert not MetadataTable.is_metadata_readers(["No metadata"])
+
+    table = MetadataTable.from_readers(readers)
+    assert table.keys() == ["diffry", "obx"]
+    numpy.testing.assert_array_equal(table.values("diffry"), [0.5, 1.5, 2.5])
+    numpy.testing.assert_array_equal(table.values("obx"), [1.0, 1.0, 3.0])
+    numpy.testing.assert_array_equal(table[1:].values("obx"), [numpy.nan, 3.0])
@@ -1,5 +1,7 @@
+import numpy
 import pytest
 
+from darfix.core.mapping import compute_moments
 from darfix.core.utils import NoDimensionsError
 
 
@@ -24,3 +26,15 @@ def test_apply_moments(in_memory_dataset, on_disk_dataset):
     moments = dataset.apply_moments(indices=[1, 2, 3, 4])
     assert moments[0][0].shape == dataset.get_data(0).shape
     assert moments[1][3].shape == dataset.get_data(0).shape
+
+    frames = numpy.array(list(dataset.get_data([1, 2, 3, 4])))
+    values = dataset.get_dimensions_values([1, 2, 3, 4])
+    for axis, dim in dataset.dims.items():
+        numpy.testing.assert_allclose(
+            moments[axis], compute_moments(values[dim.name], frames)
+        )
+
+    # Deprecated parameter, kept for compatibility
+    chunked_moments = dataset.apply_moments(indices=[1, 2, 3, 4], chunk_shape=(2, 2))
+    for axis in dataset.dims:
+        numpy.testing.assert_allclose(chunked_moments[axis], moments[axis])
@@ -0,0 +1,108 @@
+import os
+
+import numpy
+import pytest
+
+from darfix.core.data import Operation
+from darfix.core.noiseremoval import NoiseRemovalOperation
+from darfix.core.noiseremoval import apply_noise_removal_operation
+from darfix.core.noiseremoval import apply_noise_removal_operations
+from darfix.dtypes import Dataset
+
+from . import utils
+
+
+def _apply_one_after_the_other(dataset: Dataset, operations) -> numpy.ndarray:
+    for operation in operations:
+        new_dataset = apply_noise_removal_operation(dataset, operation)
+        dataset = Dataset(
+            dataset=new_dataset,
+            indices=dataset.indices,
+            bg_indices=dataset.bg_indices,
+            bg_dataset=dataset.bg_dataset,
+        )
+    return numpy.array(list(dataset.dataset.get_data()))
+
+
+@pytest.mark.parametrize("in_memory", (True, False))
+@pytest.mark.parametrize("indices", (None, numpy.arange(0, 20, 2)))
+@pytest.mark.parametrize(
+    "bs_parameters",
+    (
+        {"method": "median"},
+        {"method": "mean", "background_type": "Unused data (after partition)"},
+        {"method": "median", "step": None, "chunks": [100, 100]},
+    ),
+)
+def test_fused_noise_removal(tmpdir, in_memory, indices, bs_parameters):
+    dataset = utils.create_3motors_dataset(
+        dir=tmpdir, in_memory=in_memory, backend="edf"
+    )
+    mask = numpy.ones(dataset.get_data(0).shape)
+    mask[:10, :5] = 0
+    operations = [
+        NoiseRemovalOperation(
+            type=Operation.THRESHOLD, parameters={"bottom": 1, "top": 90}
+        ),
+        NoiseRemovalOperation(type=Operation.HP, parameters={"kernel_size": 3}),
+        NoiseRemovalOperation(type=Operation.BS, parameters=bs_parameters),
+        NoiseRemovalOperation(type=Operation.MASK, parameters={"mask": mask}),
+    ]
+    input_dataset = Dataset(
+        dataset=dataset, indices=indices, bg_indices=numpy.arange(1, 20, 2)
+    )
+
+    expected = _apply_one_after_the_other(input_dataset, operations)
+    fused_dataset = apply_noise_removal_operations(input_dataset, operations)
+
+    numpy.testing.assert_array_equal(
+        numpy.array(list(fused_dataset.get_data())), expected
+    )
+
+
+@pytest.mark.parametrize("in_memory", (True, False))
+def test_fused_noise_removal_calls(tmpdir, monkeypatch, in_memory):
+    """The frames used for the background are processed once, whatever the memory budget"""
+    import darfix
+    from darfix.core import noiseremoval
+
+    dataset = utils.create_3motors_dataset(
+        dir=tmpdir, in_memory=in_memory, backend="edf"
+    )
+    operations = [
+        NoiseRemovalOperation(
+            type=Operation.THRESHOLD, parameters={"bottom": 1, "top": 90}
+        ),
+        NoiseRemovalOperation(type=Operation.HP, parameters={"kernel_size": 3}),
+        NoiseRemovalOperation(type=Operation.BS, parameters={"method": "median"}),
+    ]
+    input_dataset = Dataset(dataset=dataset)
+    expected = _apply_one_after_the_other(input_dataset, operations)
+
+    calls = {"threshold_removal": 0, "hot_pixel_removal_2D": 0}
+
+    def counted(name):
+        func = getattr(noiseremoval, name)
+
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    for name in calls:
+        monkeypatch.setattr(noiseremoval, name, counted(name))
+    # Frames do not fit in the budget: the median is computed in several reads
+    monkeypatch.setattr(darfix.config, "BACKGROUND_MAX_NBYTES", 1000)
+
+    fused_dataset = apply_noise_removal_operations(input_dataset, operations)
+
+    numpy.testing.assert_array_equal(
+        numpy.array(list(fused_dataset.get_data())), expected
+    )
+    # Once for the background and once for the new data
+    assert calls == {
+        "threshold_removal": 2 * dataset.nframes,
+        "hot_pixel_removal_2D": 2 * dataset.nframes,
+    }
+    assert not any(name.endswith(".tmp") for name in os.listdir(dataset.dir))
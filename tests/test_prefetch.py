@@ -0,0 +1,61 @@
+import threading
+
+import numpy
+import pytest
+
+from darfix.io.prefetch import prefetch
+
+
+@pytest.mark.parametrize("depth", (0, 1, 4))
+def test_prefetch(depth):
+    frames = [numpy.full((3, 4), i) for i in range(10)]
+    prefetched = list(prefetch(iter(frames), depth=depth))
+    assert len(prefetched) == len(frames)
+    for frame, expected in zip(prefetched, frames):
+        numpy.testing.assert_array_equal(frame, expected)
+
+
+def test_prefetch_max_nbytes():
+    frame_nbytes = numpy.zeros((3, 4)).nbytes
+    nread = 0
+    max_ahead = 0
+
+    def read():
+        nonlocal nread
+        for _ in range(10):
+            nread += 1
+            yield numpy.zeros((3, 4))
+
+    for nprocessed, _ in enumerate(
+        prefetch(read(), depth=8, max_nbytes=2 * frame_nbytes), start=1
+    ):
+        threading.Event().wait(0.01)
+        max_ahead = max(max_ahead, nread - nprocessed)
+    assert max_ahead <= 3
+
+
+def test_prefetch_error():
+    def read():
+        yield numpy.zeros(3)
+        raise ValueError("Unreadable frame")
+
+    frames = prefetch(read(), depth=2)
+    next(frames)
+    with pytest.raises(ValueError, match="Unreadable frame"):
+        next(frames)
+
+
+def test_prefetch_stop():
+    finished = threading.Event()
+
+    def read():
+        try:
+            for i in range(1000):
+                yield numpy.full(3, i)
+        finally:
+            finished.set()
+
+    frames = prefetch(read(), depth=2)
+    next(frames)
+    frames.close()
+    assert finished.is_set()
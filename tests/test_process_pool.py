@@ -0,0 +1,76 @@
+import numpy
+import pytest
+
+import darfix
+from darfix.core import process_pool
+
+
+def _sum_shared_array(descriptor):
+    with process_pool.attach_shared_array(descriptor) as array:
+        return float(array.sum())
+
+
+@pytest.fixture
+def number_of_processes():
+    n_processes = darfix.config.NUMBER_OF_PROCESSES
+    yield
+    darfix.config.NUMBER_OF_PROCESSES = n_processes
+    process_pool.shutdown_pool()
+
+
+def test_pool_is_reused(number_of_processes):
+    darfix.config.NUMBER_OF_PROCESSES = 1
+    pool = process_pool.get_pool()
+    assert process_pool.get_pool() is pool
+    assert pool.map(abs, [-1, -2]) == [1, 2]
+
+    darfix.config.NUMBER_OF_PROCESSES = 2
+    assert process_pool.get_number_of_processes() == 2
+    assert process_pool.get_pool() is not pool
+
+    pool = process_pool.get_pool()
+    process_pool.shutdown_pool()
+    assert process_pool.get_pool() is not pool
+
+
+def test_default_number_of_processes(number_of_processes):
+    darfix.config.NUMBER_OF_PROCESSES = None
+    assert process_pool.get_number_of_processes() >= 1
+
+
+def test_shared_array(number_of_processes):
+    data = numpy.arange(24, dtype=numpy.float32).reshape(2, 3, 4)
+    with process_pool.SharedArray(data) as shared:
+        numpy.testing.assert_array_equal(shared.array, data)
+        result = process_pool.get_pool().apply(_sum_shared_array, (shared.descriptor,))
+    assert result == data.sum()
+
+
+def test_attach_shared_array_error():
+    with process_pool.SharedArray(numpy.arange(4.0)) as shared:
+        name, _, dtype = shared.descriptor
+        with pytest.raises(TypeError):
+            with process_pool.attach_shared_array((name, (100,), dtype)):
+                pass
+        with pytest.raises(ValueError):
+            with process_pool.attach_shared_array(shared.descriptor):
+                raise ValueError()
+
+
+def test_cancel_batched_fit(number_of_processes):
+    from darfix.core.rocking_curves_optimized import BatchedCurveFitter
+
+    darfix.config.NUMBER_OF_PROCESSES = 2
+    x = numpy.arange(10)
+    data = numpy.exp(-((x - 4.5) ** 2) / 4)[:, None, None] * numpy.ones((1, 20, 20))
+    pool = process_pool.get_pool()
+    fitter = BatchedCurveFitter(data)
+
+    def cancel(completed, total):
+        fitter.cancel()
+
+    with pytest.raises(InterruptedError):
+        fitter.fit(progress_callback=cancel)
+    # The shared pool is still usable
+    assert process_pool.get_pool() is pool
+    assert pool.map(abs, [-1, -2]) == [1, 2]
@@ -5,6 +5,8 @@ from darfix.core import rocking_curves
 from darfix.core.data import Data
 from darfix.core.dataset import ImageDataset
 from darfix.core.utils import NoDimensionsError
+from darfix.math import bivariate_gaussian
+from darfix.processing.batched_rocking_curves import levenberg_marquardt
 
 from .utils import createRandomHDF5Dataset
 
@@ -30,6 +32,50 @@ def test_generator_with_moments():
     numpy.testing.assert_array_equal(img, data[:, 0, 0])
 
 
+def test_generator_with_moments_yields_once_per_pixel():
+    data = numpy.random.random(size=(3, 10, 10))
+    moments = numpy.ones((2, 10, 10))
+
+    assert len(list(rocking_curves.generator(data, moments))) == 100
+
+
+def test_compute_starting_values():
+    """Tests the starting values match the moments computed by the pixel-by-pixel fit"""
+    data = numpy.random.random(size=(6, 4, 5))
+    values = numpy.linspace(0, 1, 6)
+    indices = [1, 2, 4, 5]
+
+    moments = rocking_curves.compute_starting_values(data, values)
+    assert moments.shape == (2, 4, 5)
+    y = data[:, 2, 3]
+    mean = numpy.sum(values * y) / numpy.sum(y)
+    numpy.testing.assert_allclose(moments[0, 2, 3], mean)
+    numpy.testing.assert_allclose(
+        moments[1, 2, 3], numpy.sqrt(numpy.sum(y * (values - mean) ** 2) / numpy.sum(y))
+    )
+
+    moments_2d = rocking_curves.compute_starting_values(
+        data, [values, values[::-1]], indices
+    )
+    assert moments_2d.shape == (4, 4, 5)
+    numpy.testing.assert_allclose(
+        moments_2d[[0, 2]],
+        rocking_curves.compute_starting_values(data[indices], values[indices]),
+    )
+
+
+def test_fit_rocking_curve_with_moments():
+    """Tests the fit with moments gives the same result as the fit without moments"""
+    x = numpy.linspace(-1, 1, 40)
+    y = 50 * numpy.exp(-((x - 0.2) ** 2) / (2 * 0.1**2)) + 3
+    moments = rocking_curves.compute_starting_values(y[:, None, None], x)[:, 0, 0]
+
+    _, pars = rocking_curves.fit_rocking_curve((y, None), x_values=x)
+    _, pars_with_moments = rocking_curves.fit_rocking_curve((y, moments), x_values=x)
+
+    numpy.testing.assert_allclose(pars_with_moments, pars, rtol=1e-6)
+
+
 def test_fit_rocking_curve():
     """Tests the correct fit of a rocking curve"""
 
@@ -56,6 +102,94 @@ def test_fit_data():
     assert maps[0].shape == data[0].shape
 
 
+def test_fit_data_batched():
+    """Tests the batched fit gives the same maps as the pixel-by-pixel fit"""
+    x = numpy.linspace(-1, 1, 31)
+    rng = numpy.random.default_rng(0)
+    amplitude = rng.uniform(50, 100, size=(4, 5))
+    peak = rng.uniform(-0.3, 0.3, size=(4, 5))
+    std_dev = rng.uniform(0.1, 0.3, size=(4, 5))
+    data = amplitude * numpy.exp(
+        -((x[:, None, None] - peak) ** 2) / (2 * std_dev**2)
+    ) + rng.normal(scale=0.5, size=(31, 4, 5))
+    # Flat curves are not fitted
+    data[:, 0, 0] = 1
+
+    new_data, maps = rocking_curves.fit_data(data, values=x, method="batched")
+
+    assert new_data.shape == data.shape
+    assert maps.shape == (4, 4, 5)
+    for i in range(data.shape[1]):
+        for j in range(data.shape[2]):
+            curve, pars = rocking_curves.fit_rocking_curve(
+                (data[:, i, j], None), x_values=x, int_thresh=15
+            )
+            numpy.testing.assert_allclose(maps[:, i, j], pars, rtol=1e-3, atol=1e-3)
+            numpy.testing.assert_allclose(new_data[:, i, j], curve, atol=1e-2)
+
+
+def test_levenberg_marquardt_stalled():
+    """Tests fits whose cost never decreases are not reported as converged"""
+
+    def model(params):
+        # The jacobian has the wrong sign: every step increases the cost
+        return params.copy(), -numpy.ones(params.shape + (1,))
+
+    p0 = numpy.array([[1.0], [0.0]])
+    params, converged = levenberg_marquardt(
+        model,
+        p0,
+        numpy.zeros((2, 1)),
+        numpy.full((2, 1), -10.0),
+        numpy.full((2, 1), 10.0),
+        xtol=0,
+    )
+
+    numpy.testing.assert_array_equal(converged, [False, True])
+    numpy.testing.assert_array_equal(params, p0)
+
+
+@pytest.mark.parametrize("indices", (range(35), numpy.arange(2, 30)))
+def test_fit_2d_data_batched(indices):
+    """Tests the batched 2D fit gives the same maps as the pixel-by-pixel fit"""
+    shape = (7, 5)
+    x0, x1 = numpy.meshgrid(numpy.linspace(-1, 1, 7), numpy.linspace(-0.5, 0.5, 5))
+    values = numpy.vstack((x0.ravel(), x1.ravel()))
+    rng = numpy.random.default_rng(0)
+    data = numpy.empty((35, 3, 4))
+    for i in range(3):
+        for j in range(4):
+            data[:, i, j] = bivariate_gaussian(
+                values,
+                rng.uniform(-0.5, 0.5),
+                rng.uniform(-0.2, 0.2),
+                rng.uniform(0.2, 0.5),
+                rng.uniform(0.1, 0.3),
+                rng.uniform(30, 100),
+                rng.uniform(-0.5, 0.5),
+                rng.uniform(0, 10),
+            ) + rng.normal(scale=0.5, size=35)
+    # Flat curves are not fitted
+    data[:, 0, 0] = 1
+
+    new_data, maps = rocking_curves.fit_2d_data(
+        data, values=values, shape=shape, indices=indices, method="batched"
+    )
+
+    assert new_data.shape == data[indices].shape
+    assert maps.shape == (7, 3, 4)
+    for i, (y, _) in enumerate(rocking_curves.generator(data, indices=indices)):
+        curve, pars = rocking_curves.fit_2d_rocking_curve(
+            (y, None), x_values=values, shape=shape, int_thresh=15
+        )
+        numpy.testing.assert_allclose(
+            maps[:, i // 4, i % 4], pars, rtol=1e-3, atol=1e-3
+        )
+        numpy.testing.assert_allclose(
+            new_data[:, i // 4, i % 4], curve[indices], atol=1e-2
+        )
+
+
 @pytest.mark.parametrize("in_memory", (True, False))
 def test_apply_2d_fit_hdf5_dataset(in_memory: bool):
     dataset = createRandomHDF5Dataset(
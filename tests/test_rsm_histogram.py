@@ -1,6 +1,7 @@
 import numpy
 import pytest
 
+from ..core.mapping import RSMAccumulator
 from ..dtypes import Dataset
 from ..pixel_sizes import PixelSize
 from ..tasks.rsm_histogram import RSMHistogram
@@ -47,3 +48,105 @@ def test_ewoks_task(tmpdir):
     edges = task.get_output_value("hist_edges")
     assert len(edges) > 0
     assert isinstance(edges[0], numpy.ndarray)
+
+
+@pytest.mark.parametrize("units", ("poulsen", "gorfman"))
+def test_rsm_histogram_engine(units):
+    """Compare the RSM accumulated by bin indices with numpy.histogramdd"""
+    rstate = numpy.random.RandomState(0)
+    k = 2 * numpy.pi / (12.391 / 17.0)
+    theta_ref = numpy.degrees(numpy.arcsin(numpy.pi * numpy.sqrt(2) / 4.08 / k))
+    twotheta, eta = numpy.meshgrid(
+        2 * theta_ref + numpy.linspace(-0.5, 0.5, 30),
+        numpy.linspace(-2, 2, 40),
+    )
+    # Repeated diffry values
+    diffry_values = numpy.repeat(numpy.linspace(-0.3, 0.3, 4), 2)
+    data = rstate.uniform(0, 100, (len(diffry_values),) + twotheta.shape)
+    map_shape = (20, 15, 10)
+
+    rsm = RSMAccumulator(
+        diffry_values,
+        twotheta,
+        eta,
+        Q=(1, 0, 1),
+        a=4.08,
+        map_range=0.01,
+        units=units,
+        map_shape=map_shape,
+        n=(0, 1, 0),
+        n_threads=2,
+    )
+    arr, edges = rsm.compute(data)
+
+    sum_inte = numpy.zeros(map_shape)
+    sum_freq = numpy.zeros(map_shape)
+    for diffry, image in zip(diffry_values, data):
+        q_rot = rsm.rotated_q(diffry)
+        sum_inte += numpy.histogramdd(
+            q_rot.transpose(), map_shape, rsm.ranges, weights=image.flatten()
+        )[0]
+        sum_freq += numpy.histogramdd(q_rot.transpose(), map_shape, rsm.ranges)[0]
+    assert numpy.count_nonzero(sum_freq) > 0
+    numpy.testing.assert_array_equal(rsm.frequency, sum_freq)
+    sum_freq[sum_freq == 0] = numpy.nan
+    numpy.testing.assert_allclose(arr, sum_inte / sum_freq, rtol=1e-12)
+
+    expected_edges = numpy.histogramdd(q_rot.transpose(), map_shape, rsm.ranges)[1]
+    if units == "poulsen":
+        expected_edges[2] = expected_edges[2] - 1
+    for edge, expected_edge in zip(edges, expected_edges):
+        numpy.testing.assert_array_equal(edge, expected_edge)
+
+
+@pytest.mark.parametrize("units", ("poulsen", "gorfman"))
+def test_rsm_histogram_sparse(units):
+    """Narrow range and frames with zero pixels: only the reachable pixels are binned"""
+    rstate = numpy.random.RandomState(1)
+    k = 2 * numpy.pi / (12.391 / 17.0)
+    theta_ref = numpy.degrees(numpy.arcsin(numpy.pi * numpy.sqrt(2) / 4.08 / k))
+    twotheta, eta = numpy.meshgrid(
+        2 * theta_ref + numpy.linspace(-2, 2, 60),
+        numpy.linspace(-4, 4, 50),
+    )
+    diffry_values = numpy.linspace(-1, 1, 21)
+    data = rstate.uniform(0, 100, (len(diffry_values),) + twotheta.shape)
+    data[data < 70] = 0
+    map_shape = (10, 12, 8)
+
+    rsm = RSMAccumulator(
+        diffry_values,
+        twotheta,
+        eta,
+        Q=(1, 0, 1),
+        a=4.08,
+        map_range=0.03,
+        units=units,
+        map_shape=map_shape,
+        n=(0, 1, 0),
+    )
+    reachable = rsm.reachable_pixels()
+    assert 0 < len(reachable) < twotheta.size
+
+    sum_inte = numpy.zeros(map_shape)
+    sum_freq = numpy.zeros(map_shape)
+    in_range = numpy.zeros(twotheta.size, dtype=bool)
+    for diffry, image in zip(diffry_values, data):
+        q_rot = rsm.rotated_q(diffry)
+        in_range |= numpy.all(
+            [
+                (values >= low) & (values <= high)
+                for values, (low, high) in zip(q_rot, rsm.ranges)
+            ],
+            axis=0,
+        )
+        sum_inte += numpy.histogramdd(
+            q_rot.transpose(), map_shape, rsm.ranges, weights=image.flatten()
+        )[0]
+        sum_freq += numpy.histogramdd(q_rot.transpose(), map_shape, rsm.ranges)[0]
+    assert numpy.all(numpy.isin(numpy.flatnonzero(in_range), reachable))
+
+    arr, _ = rsm.compute(data)
+    numpy.testing.assert_array_equal(rsm.frequency, sum_freq)
+    sum_freq[sum_freq == 0] = numpy.nan
+    numpy.testing.assert_allclose(arr, sum_inte / sum_freq, rtol=1e-12)
@@ -1,5 +1,9 @@
 import numpy
 
+from darfix.core.shiftcorrection import apply_shift
+from darfix.core.shiftcorrection import find_shift
+from darfix.dtypes import Dataset
+
 
 def test_find_shift(in_memory_dataset, on_disk_dataset):
     """Tests the shift detection with dimensions and indices"""
@@ -94,3 +98,28 @@ def test_apply_shift_along_dimension(in_memory_dataset, on_disk_dataset):
 
     assert new_dataset.data.urls[0, 0, 0] == dataset.data.urls[0, 0, 0]
     assert new_dataset.data.urls[0, 0, 1] != dataset.data.urls[0, 0, 1]
+
+
+def test_apply_refined_shift(in_memory_dataset):
+    """Tests the shift correction with a refinement of the shift of each frame"""
+    dataset = Dataset(dataset=in_memory_dataset, indices=numpy.arange(10))
+    for refinement in ("random", "genetic"):
+        new_dataset = apply_shift(
+            dataset,
+            [0.5, 0.2],
+            refinement=refinement,
+            iterations=3,
+            population_size=4,
+            n_workers=2,
+        )
+        assert new_dataset.data.shape == in_memory_dataset.data.shape
+        assert new_dataset.data.urls[1] != in_memory_dataset.data.urls[1]
+
+
+def test_find_shift_pyramid(in_memory_dataset):
+    """Tests the shift detection of a dataset with a multi-resolution pyramid"""
+    dataset = Dataset(dataset=in_memory_dataset)
+    shift = find_shift(dataset)
+    pyramid_shift = find_shift(dataset, pyramid_levels=2)
+    assert pyramid_shift.shape == (2,)
+    numpy.testing.assert_allclose(pyramid_shift, shift, atol=0.1)
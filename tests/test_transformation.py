@@ -1,6 +1,7 @@
 import numpy
 import pytest
 
+from darfix.core import mapping
 from darfix.core.transformation import Transformation
 from darfix.core.utils import NoDimensionsError
 
@@ -68,3 +69,87 @@ def test_compute_magnification(in_memory_dataset, on_disk_dataset):
     dataset = on_disk_dataset.reshape_data()
     dataset.compute_transformation(d=0.1)
     assert dataset.transformation.shape == dataset.get_data(0).shape
+
+
+def _reference_rsm(H, W, d, ffz, mainx, rotate):
+    if rotate:
+        y, z = numpy.meshgrid(
+            (numpy.arange(H) - H / 2) * d,
+            ffz - (W / 2 - numpy.arange(W)) * d,
+            indexing="ij",
+        )
+    else:
+        z, y = numpy.meshgrid(
+            ffz - (H / 2 - numpy.arange(H)) * d,
+            (numpy.arange(W) - W / 2) * d,
+            indexing="ij",
+        )
+    eta = numpy.arctan2(y, z)
+    twotheta = numpy.arctan2(numpy.sqrt(y * y + z * z), mainx)
+    return numpy.degrees(eta), numpy.degrees(twotheta)
+
+
+def _reference_magnification(H, W, d, obx, obpitch, mainx):
+    x, y = numpy.meshgrid(numpy.arange(H), numpy.arange(W))
+    d1 = obx / numpy.cos(numpy.radians(obpitch))
+    d2 = mainx / numpy.cos(numpy.radians(obpitch)) - d1
+    d /= d2 / d1
+    return (x - W / 2) * d, (H / 2 - y) * d
+
+
+@pytest.mark.parametrize("kind", ("rsm", "rsm_rotated", "magnification"))
+def test_compact_transformation(kind):
+    H, W = 12, 9
+    if kind == "magnification":
+        transformation = mapping.magnification_transformation(
+            H, W, 0.1, 2.0, 20.0, 15.0
+        )
+        expected_x, expected_y = _reference_magnification(H, W, 0.1, 2.0, 20.0, 15.0)
+        # Separable axes are not copied
+        assert transformation.x.base is not None
+        assert transformation.x.strides[0] == 0
+    else:
+        rotate = kind == "rsm_rotated"
+        transformation = mapping.rsm_transformation(H, W, 0.1, 2.0, -5.0, rotate)
+        expected_x, expected_y = _reference_rsm(H, W, 0.1, 2.0, -5.0, rotate)
+
+    assert transformation.shape == expected_x.shape
+    numpy.testing.assert_allclose(transformation.x, expected_x, rtol=1e-12)
+    numpy.testing.assert_allclose(transformation.y, expected_y, rtol=1e-12)
+    assert not transformation.x.flags.writeable
+    numpy.testing.assert_allclose(
+        transformation.origin, (expected_x[0, 0], expected_y[0, 0]), rtol=1e-12
+    )
+
+    cropped = transformation.crop(origin=(2, 3), size=(5, 4))
+    assert cropped.kind == transformation.kind
+    numpy.testing.assert_allclose(cropped.x, expected_x[2:7, 3:7], rtol=1e-12)
+    numpy.testing.assert_allclose(cropped.y, expected_y[2:7, 3:7], rtol=1e-12)
+
+
+def test_transformation_cache(tmpdir):
+    dataset = create_1d_dataset(
+        dir=tmpdir,
+        in_memory=True,
+        backend="hdf5",
+        motor1="obx",
+        motor2="obpitch",
+    )
+    dataset.find_dimensions()
+    dataset.compute_transformation(0.1)
+    transformation = dataset.transformation
+    dataset.compute_transformation(0.1)
+    # The separable axes are shared
+    assert numpy.shares_memory(dataset.transformation.x, transformation.x)
+    dataset.compute_transformation(0.2)
+    assert not numpy.shares_memory(dataset.transformation.x, transformation.x)
+
+
+def test_rsm_transformation_cache():
+    """The cache does not keep the dense coordinates of the transformations"""
+    transformation = mapping.rsm_transformation(12, 9, 0.1, 2.0, -5.0)
+    x = transformation.x
+    other = mapping.rsm_transformation(12, 9, 0.1, 2.0, -5.0)
+    assert other is not transformation
+    assert other._dense is None
+    numpy.testing.assert_array_equal(other.x, x)